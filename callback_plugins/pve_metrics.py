@@ -0,0 +1,124 @@
+#!/usr/bin/python
+#
+# Ansible callback collecting per-VM, per-phase provisioning metrics.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_plugins.html#callback-plugins
+# * https://prometheus.io/docs/instrumenting/exposition_formats/
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.plugins.callback import CallbackBase
+import os
+import sys
+import time
+
+try:
+    from ansible.module_utils import metrics
+except ImportError:
+    # Callbacks load before roles; use the role module_utils directly.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils'))
+    import metrics
+
+DOCUMENTATION = r'''
+---
+name: pve_metrics
+
+type: aggregate
+
+short_description: Export per-VM, per-phase provisioning metrics.
+
+version_added: '1.0.0'
+
+description: Time every role task and attribute it to a VM (the VMID prefix of
+  the task name, '{{ _pve_vm.vmid }} | ...'), the cluster node it ran on
+  (delegate_to) and a provisioning phase derived from the task file under
+  kvm/tasks, lxc/tasks or global_tasks (parse, quorum, status, image_download,
+  extract, import, disk_alloc, shutdown, config_write, start, ...). Durations
+  and outcomes are written as a Prometheus textfile (node_exporter textfile
+  collector) and a JSON summary with p50/p99 per node and phase when the
+  playbook finishes. Callbacks load before roles; add the role callback_plugins
+  directory to the callback plugin path (ansible.cfg callback_plugins) and
+  enable pve_metrics (callbacks_enabled).
+
+requirements:
+  - enable in configuration
+
+options:
+  prom_path:
+    description: Prometheus textfile written at the end of the run. Empty to
+      disable.
+    default: 'pve_provision.prom'
+    env:
+      - name: PVE_METRICS_PROM_PATH
+    ini:
+      - section: callback_pve_metrics
+        key: prom_path
+  json_path:
+    description: JSON summary written at the end of the run. Empty to disable.
+    default: 'pve_provision.json'
+    env:
+      - name: PVE_METRICS_JSON_PATH
+    ini:
+      - section: callback_pve_metrics
+        key: json_path
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'pve_metrics'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self._metrics = metrics.PhaseMetrics()
+        self._started = {}
+        self._nodes = {}
+
+    def v2_runner_on_start(self, host, task):
+        self._started[(host.get_name(), task._uuid)] = time.monotonic()
+
+    def _Record(self, result, status):
+        task = result._task
+        started = self._started.pop((result._host.get_name(), task._uuid), None)
+        phase = metrics.Phase(task.get_path(), task.action)
+        if started is None or phase is None:
+            return
+        kind, _ = metrics.TaskFile(task.get_path())
+        vmid = metrics.Vmid(result.task_name)
+        # kvm_config/lxc_config results name the node a VM resides on; tasks
+        # for the VM run on the controller or are delegated to that node.
+        if isinstance(result._result, dict) and 'vmid' in result._result and result._result.get('node'):
+            self._nodes[str(result._result['vmid'])] = result._result['node']
+        fields = getattr(result, '_task_fields', {}) or {}
+        node = self._nodes.get(vmid) or fields.get('delegate_to') or result._host.get_name()
+        self._metrics.Add(
+            vmid,
+            str(node).split('.')[0],
+            kind,
+            phase,
+            time.monotonic() - started,
+            status)
+
+    def v2_runner_on_ok(self, result):
+        self._Record(result, 'changed' if result.is_changed() else 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._Record(result, 'ok' if ignore_errors else 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._Record(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._Record(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        try:
+            self._metrics.Write(self.get_option('prom_path'), self.get_option('json_path'))
+        except OSError as e:
+            self._display.warning('pve_metrics: unable to write metrics: %s' % e)
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+#
+# Ansible callback writing a Chrome trace-event timeline of role runs.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_plugins.html#callback-plugins
+# * https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.playbook.task_include import TaskInclude
+from ansible.plugins.callback import CallbackBase
+import os
+import sys
+import time
+
+try:
+    from ansible.module_utils import metrics
+    from ansible.module_utils import pve_trace_events
+except ImportError:
+    # Callbacks load before roles; use the role module_utils directly.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils'))
+    import metrics
+    import pve_trace_events
+
+DOCUMENTATION = r'''
+---
+name: pve_trace
+
+type: aggregate
+
+short_description: Write a trace-event timeline of role runs.
+
+version_added: '1.0.0'
+
+description: Record every role task as a span on a timeline with one track
+  per PVE node (the VM node, or delegate_to) and one row per VM (the VMID
+  prefix of the task name, '{{ _pve_vm.vmid }} | ...'). Tasks are nested in
+  spans for the task files they were included from (provision.yml,
+  reconfigure.yml, operations/*.yml, cloud_init/*.yml). The trace-event JSON
+  is written when the playbook finishes and loads in chrome://tracing or
+  https://ui.perfetto.dev. Callbacks load before roles; add the role
+  callback_plugins directory to the callback plugin path (ansible.cfg
+  callback_plugins) and enable pve_trace (callbacks_enabled).
+
+requirements:
+  - enable in configuration
+
+options:
+  trace_path:
+    description: Trace-event JSON written at the end of the run.
+    default: 'pve_trace.json'
+    env:
+      - name: PVE_TRACE_PATH
+    ini:
+      - section: callback_pve_trace
+        key: trace_path
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'pve_trace'
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self._trace = pve_trace_events.Trace()
+        self._started = {}
+        self._includes = {}
+
+    def v2_runner_on_start(self, host, task):
+        self._started[(host.get_name(), task._uuid)] = time.monotonic()
+
+    def _Include(self, include):
+        '''Return int key for an include instance.
+
+        Includes (one copy per loop item) are kept referenced so their ids are
+        not reused during the run.
+        '''
+        if include is None:
+            return 0
+        return self._includes.setdefault(id(include), (len(self._includes) + 1, include))[0]
+
+    def _Includes(self, task):
+        '''Return list of (include key, role task file) for a task, outermost first.'''
+        includes = []
+        path = task.get_path()
+        parent = task._parent
+        while True:
+            while parent is not None and not isinstance(parent, TaskInclude):
+                parent = parent._parent
+            kind, task_file = metrics.TaskFile(path)
+            if task_file is not None:
+                includes.insert(0, (self._Include(parent), '%s/%s.yml' % (kind, task_file)))
+            if parent is None:
+                return includes
+            path, parent = parent.get_path(), parent._parent
+
+    def _Record(self, result, status):
+        task = result._task
+        host = result._host.get_name()
+        started = self._started.pop((host, task._uuid), None)
+        includes = self._Includes(task)
+        if started is None or not includes:
+            return
+        vmid = metrics.Vmid(result.task_name)
+        if isinstance(result._result, dict) and 'vmid' in result._result:
+            self._trace.Node(result._result.get('vmid'), result._result.get('node'))
+        fields = getattr(result, '_task_fields', {}) or {}
+        self._trace.Task(
+            host,
+            vmid,
+            fields.get('delegate_to') or host,
+            includes,
+            result.task_name,
+            started,
+            time.monotonic(),
+            status,
+            metrics.Phase(task.get_path(), task.action))
+
+    def v2_runner_on_ok(self, result):
+        self._Record(result, 'changed' if result.is_changed() else 'ok')
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._Record(result, 'ignored' if ignore_errors else 'failed')
+
+    def v2_runner_on_skipped(self, result):
+        self._Record(result, 'skipped')
+
+    def v2_runner_on_unreachable(self, result):
+        self._Record(result, 'unreachable')
+
+    def v2_playbook_on_stats(self, stats):
+        try:
+            self._trace.Write(self.get_option('trace_path'))
+        except OSError as e:
+            self._display.warning('pve_trace: unable to write trace: %s' % e)
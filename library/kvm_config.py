@@ -51,6 +51,11 @@ options:
     description: Firewall configuration. Default: {}.
     required: false
     type: dict
+  fingerprint:
+    description: Stamp the config fingerprint into 'tags' so unchanged
+                 VMs can be detected from cluster resources. Default: false.
+    required: false
+    type: bool
   config:
     description: Configuration to process (qm.conf).
     required: true
@@ -196,6 +201,31 @@ config_list:
       'boot: order=scsi0;ide0',
       'cdrom: ide2',
     ],
+config_list_canonical:
+    description: List of strings from config file, ordered and formatted as
+                 PVE writes the config file.
+    type: list
+    returned: always
+    sample:
+    [
+      'acpi: 1',
+      'agent: 1,fstrim_cloned_disks=1,type=virtio',
+      'arch: x86_64',
+    ],
+config_checksum:
+    description: sha1 of the canonical config file, excluding
+                 config_checksum_ignore keys and the fingerprint tag.
+    type: string
+    returned: always
+    sample:
+      '5a485a6f0499341b7082cefa6fb59d68d1888962'
+config_checksum_ignore:
+    description: Config keys managed by PVE that are excluded from
+                 config_checksum.
+    type: list
+    returned: always
+    sample:
+      ['meta', 'ide0']
 config_text:
     description: String containing entire config file.
     type: string
@@ -222,6 +252,17 @@ firewall:
       'ipset': []
       'ip_aliases': []
     }
+startup:
+    description: Startup and shutdown behavior from the 'startup' option.
+                 Unset values are None.
+    type: dict
+    returned: always
+    sample:
+    {
+      'order': 2,
+      'up': 30,
+      'down': None
+    }
 config:
     description: Dict processed config file.
     type: dict
@@ -266,6 +307,20 @@ cli_list:
       '--bios ovmf',
       ...
     ]
+fingerprint:
+    description: Canonical, order-independent blake2b fingerprint of the
+                 config, firewall, template and cloud init storage.
+                 Fingerprint tags are ignored.
+    type: string
+    returned: always
+    sample:
+      '8c1d4b0e2f6a9d31'
+fingerprint_tag:
+    description: PVE tag containing the config fingerprint.
+    type: string
+    returned: always
+    sample:
+      'fp-8c1d4b0e2f6a9d31'
 cli:
     description: String configuration file as command line options.
     type: string
@@ -283,6 +338,7 @@ def run_module():
       template=dict(type='dict', required=False),
       force_stop=dict(type='bool', required=False, default=True),
       firewall=dict(type='dict', required=False),
+      fingerprint=dict(type='bool', required=False, default=False),
       config=dict(type='str', required=True),
       cloud_init=dict(type='str', required=False, default=None),
     )
@@ -46,6 +46,18 @@ options:
     description: Firewall configuration. Default: {}.
     required: false
     type: dict
+  fingerprint:
+    description: Stamp the config fingerprint into 'tags' so unchanged
+                 containers can be detected from cluster resources. Default: false.
+    required: false
+    type: bool
+  idmap_passthrough:
+    description: Container IDs to map to the same host ID. Either a list of
+                 IDs used for both users and groups, or a dict {'u': list,
+                 'g': list}. Generates the complete lxc.idmap mapping; config
+                 must not contain lxc.idmap. Default: None.
+    required: false
+    type: raw
   config:
     description: Configuration to process (qm.conf).
     required: true
@@ -141,6 +153,31 @@ config_list:
       'rootfs: local-lvm:vm-200-disk-0,size=4G'
       ...
     ]
+config_list_canonical:
+    description: List of strings from config file, ordered and formatted as
+                 PVE writes the config file.
+    type: list
+    returned: always
+    sample:
+    [
+      'acpi: 1',
+      'agent: 1,fstrim_cloned_disks=1,type=virtio',
+      'arch: x86_64',
+    ],
+config_checksum:
+    description: sha1 of the canonical config file, excluding
+                 config_checksum_ignore keys and the fingerprint tag.
+    type: string
+    returned: always
+    sample:
+      '5a485a6f0499341b7082cefa6fb59d68d1888962'
+config_checksum_ignore:
+    description: Config keys managed by PVE that are excluded from
+                 config_checksum.
+    type: list
+    returned: always
+    sample:
+      []
 config_text:
     description: String containing entire config file.
     type: string
@@ -167,6 +204,29 @@ firewall:
       'ipset': []
       'ip_aliases': []
     }
+startup:
+    description: Startup and shutdown behavior from the 'startup' option.
+                 Unset values are None.
+    type: dict
+    returned: always
+    sample:
+    {
+      'order': 2,
+      'up': 30,
+      'down': None
+    }
+idmap:
+    description: Container ID ranges not mapped by lxc.idmap (shown as
+                 nobody/nogroup in the container). Overlapping mappings fail
+                 the module.
+    type: dict
+    returned: always
+    sample:
+    {
+      'gaps': [
+        {'ctype': 'g', 'start': 1005, 'end': 1005}
+      ]
+    }
 config:
     description: Dict processed config file. Note: LXC Extensions are not
                  considered to be part of the main config. See 'lxc' dict.
@@ -284,6 +344,20 @@ cli_list:
       '--description Description for the Container.',
       ...
     ]
+fingerprint:
+    description: Canonical, order-independent blake2b fingerprint of the
+                 config, firewall, template and cloud init storage.
+                 Fingerprint tags are ignored.
+    type: string
+    returned: always
+    sample:
+      '8c1d4b0e2f6a9d31'
+fingerprint_tag:
+    description: PVE tag containing the config fingerprint.
+    type: string
+    returned: always
+    sample:
+      'fp-8c1d4b0e2f6a9d31'
 cli:
     description: String configuration file as command line options.
     type: string
@@ -300,6 +374,8 @@ def run_module():
       template=dict(type='dict', required=False),
       force_stop=dict(type='bool', required=False, default=True),
       firewall=dict(type='dict', required=False),
+      fingerprint=dict(type='bool', required=False, default=False),
+      idmap_passthrough=dict(type='raw', required=False),
       config=dict(type='str', required=True),
     )
 
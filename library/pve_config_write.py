@@ -0,0 +1,101 @@
+#!/usr/bin/python
+#
+# Ansible interface to pmxcfs config writer.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+# * https://pve.proxmox.com/pve-docs/chapter-pmxcfs.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import node
+from ansible.module_utils.basic import AnsibleModule
+import os
+
+DOCUMENTATION = r'''
+---
+module: pve_config_write
+
+short_description: Write a KVM or LXC canonical config directly to pmxcfs.
+
+version_added: '1.0.0'
+
+description: Write the canonical config (config_list_canonical) of a kvm_config
+  or lxc_config result to /etc/pve/{qemu-server,lxc}/{VMID}.conf in place.
+  pmxcfs does not support atomic renames or permission changes, so the file is
+  written with a single in-place write instead of staging a template in /tmp
+  and copying it. The file is only written if the content differs. Must run on
+  the cluster node (use delegate_to).
+
+options:
+  vm:
+    description: kvm_config or lxc_config result.
+    required: true
+    type: dict
+  config_dir:
+    description: pmxcfs mountpoint. Default: '/etc/pve'.
+    required: false
+    type: str
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Apply configuration changes.
+- name: 'Apply configuration changes'
+  pve_config_write:
+    vm: '{{ _pve_vm }}'
+  delegate_to: '{{ _pve_vm.node }}'
+'''
+
+RETURN = r'''
+path:
+    description: Config file written.
+    type: string
+    returned: always
+    sample:
+    '/etc/pve/qemu-server/100.conf'
+'''
+
+
+def run_module():
+    module_args = dict(
+      vm=dict(type='dict', required=True),
+      config_dir=dict(type='str', required=False, default='/etc/pve'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    vm = module.params['vm']
+    path = node.ConfigPath(vm, module.params['config_dir'])
+    lines = vm['config_list_canonical']
+    result = {'changed': False, 'path': path}
+    try:
+      if module.check_mode or module._diff:
+        before = ''
+        if os.path.exists(path):
+          with open(path, 'r') as f:
+            before = f.read()
+        after = ''.join(['%s\n' % x for x in lines])
+        result['changed'] = before != after
+        if module._diff:
+          result['diff'] = {'before': before, 'after': after, 'before_header': path, 'after_header': path}
+      if not module.check_mode:
+        result['changed'] = node.WriteConfig(path, lines)
+    except Exception as e:
+      module.fail_json(msg='unable to write config: %s' % e, **result)
+
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
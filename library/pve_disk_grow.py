@@ -0,0 +1,110 @@
+#!/usr/bin/python
+#
+# Ansible interface to detect online disk grow changes.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+# * https://pve.proxmox.com/wiki/Resize_disks
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import node
+from ansible.module_utils import parsers
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_disk_grow
+
+short_description: Detect disk size increases that can be applied online.
+
+version_added: '1.0.0'
+
+description: Compare a kvm_config or lxc_config result with the node config
+  in /etc/pve/{qemu-server,lxc}/{VMID}.conf. If the only changes are size
+  increases of disks (DISK), root disks (ROOTFS) or mountpoints (MP) the disks
+  can be grown online with 'qm resize' or 'pct resize' and the config written
+  without a shutdown/start cycle. Changes to fingerprint tags are ignored. Must
+  run on the cluster node (use delegate_to).
+
+options:
+  vm:
+    description: kvm_config or lxc_config result.
+    required: true
+    type: dict
+  config_dir:
+    description: pmxcfs mountpoint. Default: '/etc/pve'.
+    required: false
+    type: str
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Check if configuration changes are only disk size increases.
+- name: 'Check for online disk grow'
+  pve_disk_grow:
+    vm: '{{ _pve_vm }}'
+  register: _pve_vm_grow
+  delegate_to: '{{ _pve_vm.node }}'
+'''
+
+RETURN = r'''
+online:
+    description: True if all changes can be applied online.
+    type: bool
+    returned: always
+    sample:
+    true
+resize:
+    description: Disks to grow online; empty unless online.
+    type: list
+    elements: dict
+    returned: always
+    sample:
+    [
+      {'disk': 'scsi0', 'size': '8G', 'current': '4G'}
+    ]
+'''
+
+
+def run_module():
+    module_args = dict(
+      vm=dict(type='dict', required=True),
+      config_dir=dict(type='str', required=False, default='/etc/pve'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    vm = module.params['vm']
+    result = {'changed': False, 'online': False, 'resize': []}
+    try:
+      with open(node.ConfigPath(vm, module.params['config_dir']), 'r') as f:
+        current = f.read()
+      requested = parsers.PveConfig({
+          'vmid': vm['vmid'],
+          'node': vm['node'],
+          'cloud_init': (vm.get('cloud_init') or {}).get('storage', ''),
+          'config': '\n'.join(vm['config_list_canonical'])})
+      resize = requested.DiskGrowth(current)
+    except Exception as e:
+      # The offline (shutdown/start) path applies any config.
+      module.warn('unable to compare node config, disks are not grown online: %s' % e)
+      module.exit_json(**result)
+
+    if resize is not None:
+      result.update({'online': True, 'resize': resize})
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+#!/usr/bin/python
+#
+# Ansible interface to firewall module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import firewall
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_firewall
+
+short_description: Render and apply a PVE firewall (.fw) file.
+
+version_added: '1.0.0'
+
+description: Render a VM/container or cluster firewall file from a firewall
+  definition and compare it semantically against the existing file (both are
+  parsed; whitespace, option order, IPSET/alias entry order and address
+  formatting are ignored). The file is only written (in place; pmxcfs does not support atomic moves) when the
+  firewall definitions differ. pve-firewall automatically applies changes.
+
+options:
+  firewall:
+    description: Firewall definition. For VMs this is the 'firewall' value
+                 returned by kvm_config/lxc_config. Default: {}.
+    required: false
+    type: dict
+  path:
+    description: Firewall file to manage, e.g. '/etc/pve/firewall/100.fw'.
+    required: true
+    type: str
+  kind:
+    description: Firewall file type. Default: 'vm'.
+    required: false
+    type: str
+    choices: ['vm', 'cluster']
+  compact_ipsets:
+    description: Collapse adjacent/overlapping IPSET addresses into networks
+                 and remove duplicate entries. Default: false.
+    required: false
+    type: bool
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Apply VM firewall.
+- name: 'Apply firewall'
+  pve_firewall:
+    firewall: '{{ _pve_vm.firewall }}'
+    path:     '/etc/pve/firewall/{{ _pve_vm.vmid }}.fw'
+'''
+
+RETURN = r'''
+path:
+    description: Firewall file managed.
+    type: string
+    returned: always
+    sample:
+    '/etc/pve/firewall/100.fw'
+changes:
+    description: Firewall sections that differ semantically from the existing
+                 file. ['file'] if the file did not exist or could not be
+                 parsed.
+    type: list
+    returned: always
+    sample:
+    ['ipset trusted', 'rules']
+ipset_compaction:
+    description: IPSET entries before and after compaction. Empty if
+                 compact_ipsets is not set.
+    type: dict
+    returned: always
+    sample:
+    {
+      'before': 1200,
+      'after': 310,
+      'ipsets': [{'name': 'trusted', 'before': 1200, 'after': 310}]
+    }
+'''
+
+
+def run_module():
+    module_args = dict(
+      firewall=dict(type='dict', required=False, default={}),
+      path=dict(type='str', required=True),
+      kind=dict(type='str', required=False, default='vm', choices=['vm', 'cluster']),
+      compact_ipsets=dict(type='bool', required=False, default=False),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = {'changed': False, 'path': module.params['path']}
+    try:
+      applied = firewall.Apply(
+          module.params['firewall'],
+          module.params['path'],
+          kind=module.params['kind'],
+          check_mode=module.check_mode,
+          compact=module.params['compact_ipsets'])
+    except Exception as e:
+      module.fail_json(msg='unable to apply firewall: %s' % e, **result)
+
+    result['changed'] = applied['changed']
+    result['changes'] = applied['changes']
+    result['ipset_compaction'] = applied['compaction'] if module.params['compact_ipsets'] else {}
+    if module._diff and applied['changed']:
+      result['diff'] = {'before': applied['before'], 'after': applied['after']}
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
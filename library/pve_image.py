@@ -0,0 +1,105 @@
+#!/usr/bin/python
+#
+# Ansible interface to image cache module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import images
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_image
+
+short_description: Verify a cloud init or ISO image, downloading if needed.
+
+version_added: '1.0.0'
+
+description: Verify an image on a cluster node against the template checksum
+  and download it if it is missing, truncated or modified. A checksum sidecar
+  ('{path}.checksum') records (size, mtime, algorithm, digest) after
+  verification; later runs trust it without reading the image unless the size
+  or mtime changed. Must run on the cluster node (use delegate_to).
+
+options:
+  path:
+    description: Image location on the cluster node.
+    required: true
+    type: str
+  template:
+    description: Image definition; the 'template' value returned by
+                 kvm_config/lxc_config.
+    required: true
+    type: dict
+  timeout:
+    description: Seconds before a download is considered failed. Default: 120.
+    required: false
+    type: int
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Ensure the cloud init image exists and is valid.
+- name: 'Verify cloud init image'
+  pve_image:
+    path:     '{{ pve_cloud_init_cache }}/{{ _pve_vm.template.file }}'
+    template: '{{ _pve_vm.template }}'
+    timeout:  '{{ pve_vm_download_timeout }}'
+  delegate_to: '{{ _pve_vm.node }}'
+'''
+
+RETURN = r'''
+path:
+    description: Image location.
+    type: string
+    returned: always
+    sample:
+    '/var/lib/vz/images/debian-11-genericcloud-amd64-20211011-792.qcow2'
+status:
+    description: Image verification result. 'trusted' (sidecar matched; image
+                 not read), 'verified' (image hashed), 'unverified' (template
+                 has no checksum) or 'downloaded'.
+    type: string
+    returned: always
+    sample:
+    'trusted'
+'''
+
+
+def run_module():
+    module_args = dict(
+      path=dict(type='str', required=True),
+      template=dict(type='dict', required=True),
+      timeout=dict(type='int', required=False, default=120),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=False
+    )
+
+    result = {'changed': False, 'path': module.params['path'], 'status': ''}
+    try:
+      result['status'] = images.Ensure(
+          module.params['path'],
+          module.params['template'],
+          module.params['timeout'])
+    except Exception as e:
+      module.fail_json(msg='unable to verify image: %s' % e, **result)
+
+    result['changed'] = result['status'] == 'downloaded'
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+#!/usr/bin/python
+#
+# Ansible interface to image cache module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import images
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_image_cache
+
+short_description: Distribute cloud init images to cluster nodes.
+
+version_added: '1.0.0'
+
+description: Download each distinct cloud init image (keyed by checksum)
+  required by the fleet once on the cluster node running the module, verify
+  it, and copy it to other cluster nodes which need it over the cluster network
+  (scp; cluster nodes share root SSH keys). A checksum sidecar
+  ('{image}.checksum') is written after verification; images with a matching
+  sidecar and unchanged size and mtime are not downloaded or copied again.
+  Must run on a cluster node (use delegate_to).
+
+options:
+  vms:
+    description: pve_kvm host definitions (vmid, node, template, cloud_init).
+                 VMs without cloud_init are ignored.
+    required: true
+    type: list
+    elements: dict
+  image_map:
+    description: Image definitions (pve_image_map).
+    required: true
+    type: dict
+  existing:
+    description: VMIDs which already exist and do not need images. Default: [].
+    required: false
+    type: list
+    elements: int
+  cache:
+    description: Image cache location on all cluster nodes.
+    required: true
+    type: str
+  node:
+    description: Cluster node running the module (delegate_to host).
+    required: true
+    type: str
+  max_workers:
+    description: Maximum concurrent node copies. Default: 4.
+    required: false
+    type: int
+  timeout:
+    description: Seconds before a download is considered failed. Default: 120.
+    required: false
+    type: int
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Distribute cloud init images for all KVM hosts.
+- name: 'Distribute cloud init images'
+  pve_image_cache:
+    vms:       '{{ hostvars.values()|selectattr("pve_kvm", "defined")|map(attribute="pve_kvm")|list }}'
+    image_map: '{{ pve_image_map }}'
+    cache:     '{{ pve_cloud_init_cache }}'
+    node:      'pm1.example.com'
+  delegate_to: 'pm1.example.com'
+'''
+
+RETURN = r'''
+images:
+    description: Result for each distinct image. status is 'downloaded' or
+                 'cached' on the seed node.
+    type: list
+    returned: always
+    sample:
+    [
+      {
+        'key': 'cf93...',
+        'files': ['debian-11-genericcloud-amd64-20211011-792.qcow2'],
+        'status': 'downloaded',
+        'nodes': [
+          {'node': 'pm2.example.com', 'copied': ['debian-11-genericcloud-amd64-20211011-792.qcow2'], 'failed': False, 'msg': ''}
+        ],
+        'failed': False,
+        'msg': ''
+      }
+    ]
+'''
+
+
+def run_module():
+    module_args = dict(
+      vms=dict(type='list', elements='dict', required=True),
+      image_map=dict(type='dict', required=True),
+      existing=dict(type='list', elements='int', required=False, default=[]),
+      cache=dict(type='str', required=True),
+      node=dict(type='str', required=True),
+      max_workers=dict(type='int', required=False, default=4),
+      timeout=dict(type='int', required=False, default=120),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=False
+    )
+
+    result = {'changed': False, 'images': []}
+    try:
+      cache = images.ImageCache(
+          module.params['cache'],
+          module.params['node'],
+          max_workers=module.params['max_workers'],
+          timeout=module.params['timeout'])
+      result['images'] = cache.Apply(
+          module.params['vms'],
+          module.params['image_map'],
+          module.params['existing'])
+    except Exception as e:
+      module.fail_json(msg='unable to distribute images: %s' % e, **result)
+
+    result['changed'] = any([x['status'] == 'downloaded' or any([y['copied'] for y in x['nodes']]) for x in result['images']])
+    failed = [x for x in result['images'] if x['failed']]
+    if failed:
+      module.fail_json(msg='; '.join([f'{",".join(x["files"])}: {x["msg"]}' for x in failed]), **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
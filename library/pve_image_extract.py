@@ -0,0 +1,115 @@
+#!/usr/bin/python
+#
+# Ansible interface to image extraction module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import images
+from ansible.module_utils.basic import AnsibleModule
+import os
+
+DOCUMENTATION = r'''
+---
+module: pve_image_extract
+
+short_description: Extract a disk image from a tar.xz cloud image.
+
+version_added: '1.0.0'
+
+description: Stream a member (disk.raw) of a tar.xz cloud image directly to
+  its final location. Decompression uses multithreaded xz when installed on
+  the node (in-process lzma otherwise); zero blocks are left as holes so the
+  raw disk stays sparse. No intermediate file is written. Existing
+  destinations are not replaced. Must run on the cluster node (use
+  delegate_to).
+
+options:
+  src:
+    description: tar.xz cloud image on the cluster node.
+    required: true
+    type: str
+  dest:
+    description: Final location of the extracted disk image.
+    required: true
+    type: str
+  member:
+    description: Archive member to extract. Default: 'disk.raw'.
+    required: false
+    type: str
+  threads:
+    description: xz decompression threads; 0 uses all cores. Default: 0.
+    required: false
+    type: int
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Extract cloud init disk.
+- name: 'Extract cloud init image'
+  pve_image_extract:
+    src:  '{{ pve_cloud_init_cache }}/{{ _pve_vm.template.file }}'
+    dest: '{{ _pve_cloud_init_disk }}'
+  delegate_to: '{{ _pve_vm.node }}'
+'''
+
+RETURN = r'''
+dest:
+    description: Extracted disk image location.
+    type: string
+    returned: always
+    sample:
+    '/var/lib/vz/template/qemu/debian-11-genericcloud-amd64-20211011-792.raw'
+size:
+    description: Bytes extracted (apparent size). 0 if dest already existed.
+    type: integer
+    returned: always
+    sample:
+    2147483648
+'''
+
+
+def run_module():
+    module_args = dict(
+      src=dict(type='str', required=True),
+      dest=dict(type='str', required=True),
+      member=dict(type='str', required=False, default='disk.raw'),
+      threads=dict(type='int', required=False, default=0),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = {'changed': False, 'dest': module.params['dest'], 'size': 0}
+    if os.path.exists(module.params['dest']):
+      module.exit_json(**result)
+    if module.check_mode:
+      result['changed'] = True
+      module.exit_json(**result)
+
+    try:
+      result['size'] = images.Extract(
+          module.params['src'],
+          module.params['member'],
+          module.params['dest'],
+          threads=module.params['threads'])
+    except Exception as e:
+      module.fail_json(msg='unable to extract image: %s' % e, **result)
+
+    result['changed'] = True
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+#!/usr/bin/python
+#
+# Ansible interface to linked clone module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import clone
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_linked_clone
+
+short_description: Create a cloud init KVM instance as a linked clone.
+
+version_added: '1.0.0'
+
+description: Create a new cloud init KVM instance as a linked clone (qm clone
+  --full 0) of a template VM holding the cloud init image. The template VM is
+  created (qm importdisk; qm template) the first time an image is used on a
+  node and storage, and found by tag ('ci-{digest}-{storage}') afterwards.
+  Storage other than lvmthin (zfspool and rbd name linked clone volumes
+  base-{TEMPLATE}-disk-N/vm-{VMID}-disk-N) is skipped with linked=false; the disk should then be imported normally. Must run on the
+  cluster node (use delegate_to).
+
+options:
+  vm:
+    description: kvm_config result for the new VM.
+    required: true
+    type: dict
+  disk:
+    description: Local path of the extracted cloud init disk image.
+    required: true
+    type: str
+  template_vmid:
+    description: First VMID used for template VMs. Default: 9000.
+    required: false
+    type: int
+  reserved:
+    description: VMIDs defined in the inventory. Template VMs never use these
+      VMIDs, and the module fails if one is already an image template VM.
+    required: false
+    type: list
+    elements: int
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Linked clone cloud init VM.
+- name: 'Linked clone from image template'
+  pve_linked_clone:
+    vm:   '{{ _pve_vm }}'
+    disk: '{{ _pve_cloud_init_disk }}'
+    reserved: '{{ lookup("pve_inventory", "kvm", "lxc", wantlist=True)|map(attribute="vmid")|list }}'
+  register: _pve_vm_clone
+  delegate_to: '{{ _pve_vm.node }}'
+'''
+
+RETURN = r'''
+linked:
+    description: True if the VM was created as a linked clone.
+    type: boolean
+    returned: always
+    sample:
+    True
+template_vmid:
+    description: Template VMID cloned. None if not linked.
+    type: integer
+    returned: always
+    sample:
+    9000
+template_created:
+    description: True if the template VM was created.
+    type: boolean
+    returned: always
+    sample:
+    False
+commands:
+    description: Node commands executed.
+    type: list
+    returned: always
+    sample:
+    [{'cmd': ['qm', 'clone', '9000', '100', '--full', '0'], 'rc': 0, 'stdout': '', 'stderr': '', 'ok': True}]
+'''
+
+
+def run_module():
+    module_args = dict(
+      vm=dict(type='dict', required=True),
+      disk=dict(type='str', required=True),
+      template_vmid=dict(type='int', required=False, default=9000),
+      reserved=dict(type='list', elements='int', required=False, default=[]),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=False
+    )
+
+    result = {'changed': False}
+    linked_clone = clone.LinkedClone(
+        module.params['vm'],
+        module.params['disk'],
+        template_vmid=module.params['template_vmid'],
+        reserved=module.params['reserved'])
+    try:
+      result.update(linked_clone.Apply())
+    except Exception as e:
+      module.fail_json(msg='unable to create linked clone: %s' % e, commands=linked_clone.commands, **result)
+
+    result['changed'] = result['linked']
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
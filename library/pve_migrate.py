@@ -0,0 +1,160 @@
+#!/usr/bin/python
+#
+# Ansible interface to migrate VMs to their requested cluster node.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+# * https://pve.proxmox.com/pve-docs/qm.1.html
+# * https://pve.proxmox.com/pve-docs/pct.1.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import migrate
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_migrate
+
+short_description: Migrate VMs running on a different node than requested.
+
+version_added: '1.0.0'
+
+description: Compare the requested node of each VM with its current node in
+  cluster resources and migrate VMs on a different node. Running KVMs are
+  live migrated ('qm migrate --online'); running containers are restarted on
+  the target ('pct migrate --restart'); stopped VMs are migrated offline.
+  Migrations run concurrently, limited per source and per target node.
+  Migrations are started on the source node; other nodes are reached over the
+  cluster SSH trust (root@node). Must run on a cluster node.
+
+options:
+  vms:
+    description: Requested node (FQDN or short name) for each VMID.
+    required: true
+    type: dict
+  type:
+    description: Cluster resource type to migrate, 'qemu' or 'lxc'.
+    required: true
+    type: str
+    choices: ['qemu', 'lxc']
+  resources:
+    description: Cluster VM resources (pvesh get /cluster/resources --type vm).
+    required: true
+    type: list
+    elements: dict
+  source_limit:
+    description: Maximum concurrent migrations from a node. Default: 1.
+    required: false
+    type: int
+  target_limit:
+    description: Maximum concurrent migrations to a node. Default: 1.
+    required: false
+    type: int
+  with_local_disks:
+    description: Migrate KVM disks on local storage. Default: false.
+    required: false
+    type: bool
+  shutdown_timeout:
+    description: Seconds a container is given to shutdown when restarted.
+      Default: 30.
+    required: false
+    type: int
+  timeout:
+    description: Seconds before a migration is killed. Default: 3600.
+    required: false
+    type: int
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Migrate KVMs to the node in their pve_kvm definition.
+- name: 'Migrate KVM instances'
+  pve_migrate:
+    vms: {100: 'pm2.example.com', 101: 'pm1.example.com'}
+    type: 'qemu'
+    resources: '{{ _pve_cluster_vms }}'
+    source_limit: 2
+    target_limit: 1
+'''
+
+RETURN = r'''
+migrations:
+    description: Migration results, sorted by VMID.
+    type: list
+    returned: always
+    sample:
+    [
+      {
+        'vmid': 100,
+        'type': 'qemu',
+        'source': 'pm1',
+        'target': 'pm2',
+        'running': True,
+        'cmd': ['qm', 'migrate', '100', 'pm2', '--online'],
+        'rc': 0,
+        'stdout': '',
+        'stderr': '',
+        'ok': True,
+        'waited': 0.0,
+        'duration': 42.1,
+      }
+    ]
+stats:
+    description: Run duration, migration count, failures and migration
+      duration percentiles (seconds).
+    type: dict
+    returned: always
+    sample:
+    {'duration': 42.2, 'migrations': 1, 'failed': 0, 'p50': 42.1, 'max': 42.1}
+'''
+
+
+def run_module():
+    module_args = dict(
+      vms=dict(type='dict', required=True),
+      type=dict(type='str', required=True, choices=['qemu', 'lxc']),
+      resources=dict(type='list', elements='dict', required=True),
+      source_limit=dict(type='int', required=False, default=1),
+      target_limit=dict(type='int', required=False, default=1),
+      with_local_disks=dict(type='bool', required=False, default=False),
+      shutdown_timeout=dict(type='int', required=False, default=30),
+      timeout=dict(type='int', required=False, default=3600),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = {'changed': False, 'migrations': [], 'stats': {}}
+    try:
+      plan = migrate.Plan(module.params['vms'], module.params['resources'], module.params['type'])
+      result['changed'] = len(plan) > 0
+      if module.check_mode:
+        result['migrations'] = plan
+        module.exit_json(**result)
+      result.update(migrate.Migrator(
+          source_limit=module.params['source_limit'],
+          target_limit=module.params['target_limit'],
+          with_local_disks=module.params['with_local_disks'],
+          shutdown_timeout=module.params['shutdown_timeout'],
+          timeout=module.params['timeout']).Run(plan))
+    except Exception as e:
+      module.fail_json(msg='unable to migrate: %s' % e, **result)
+
+    failed = [str(x['vmid']) for x in result['migrations'] if not x['ok']]
+    if failed:
+      module.fail_json(msg='failed migrations: %s' % ', '.join(failed), **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
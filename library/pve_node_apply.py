@@ -0,0 +1,176 @@
+#!/usr/bin/python
+#
+# Ansible interface to node apply module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import executor
+from ansible.module_utils import node
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_node_apply
+
+short_description: Apply configuration changes for all VMs on a cluster node.
+
+version_added: '1.0.0'
+
+description: Apply parsed kvm_config/lxc_config results for every VM on a
+  cluster node in a single module execution. Configs are written to pmxcfs,
+  disks are allocated or resized, and cloud init settings are mounted
+  in-process as asyncio subprocesses, bounded per node and per storage. Must
+  run on the cluster node (use delegate_to). VMs are expected to be stopped.
+
+options:
+  vms:
+    description: List of kvm_config/lxc_config results. All VMs must reside
+                 on the same cluster node.
+    required: true
+    type: list
+    elements: dict
+  max_workers:
+    description: Maximum number of commands run concurrently on the node.
+                 Default: 4.
+    required: false
+    type: int
+  storage_workers:
+    description: Maximum number of commands run concurrently on a storage.
+                 Default: 2.
+    required: false
+    type: int
+  timeout:
+    description: Seconds before a node command is killed. Default: 300.
+    required: false
+    type: int
+  shutdown_timeout:
+    description: Seconds a VM is given to shutdown (pve_kvm_shutdown_timeout);
+                 shutdown commands are killed after this plus a grace period.
+                 Default: 30.
+    required: false
+    type: int
+  config_dir:
+    description: pmxcfs mountpoint. Default: '/etc/pve'.
+    required: false
+    type: str
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Apply all queued VM changes on a cluster node.
+- name: 'Apply VM changes on node'
+  pve_node_apply:
+    vms:              '{{ _pve_node_apply_queue|selectattr("node", "equalto", node)|list }}'
+    max_workers:      '{{ pve_vm_node_apply_workers }}'
+    storage_workers:  '{{ pve_vm_node_apply_storage_workers }}'
+    shutdown_timeout: '{{ pve_kvm_shutdown_timeout }}'
+  register: _pve_node_apply
+  delegate_to: '{{ node }}'
+'''
+
+RETURN = r'''
+vm_results:
+    description: Per-VM apply results, in the order VMs were given.
+    type: list
+    returned: always
+    sample:
+    [
+      {
+        'vmid': 100,
+        'changed': True,
+        'failed': False,
+        'msg': '',
+        'resized': False,
+        'allocated': ['local-lvm:vm-100-disk-1'],
+        'rescans_avoided': 0,
+        'commands': [
+          {
+            'cmd': ['pvesm', 'alloc', 'local-lvm', '100', 'vm-100-disk-1', '4G'],
+            'rc': 0,
+            'stdout': "successfully created 'local-lvm:vm-100-disk-1'",
+            'stderr': '',
+            'ok': True,
+            'storage': 'local-lvm',
+            'waited': 0.0,
+            'duration': 0.41,
+          },
+          {
+            'cmd': ['qm', 'rescan', '--vmid', '100'],
+            'rc': 0,
+            'stdout': '',
+            'stderr': '',
+            'ok': True,
+            'storage': None,
+            'waited': 0.0,
+            'duration': 1.2,
+          },
+        ],
+      }
+    ]
+stats:
+    description: Node command statistics. Latency includes time waiting for a
+                 node or storage slot.
+    type: dict
+    returned: always
+    sample:
+    {
+      'duration': 1.65,
+      'commands': 2,
+      'throughput': 1.212,
+      'p50': 0.41,
+      'p99': 1.2,
+      'max': 1.2,
+      'failed': 0,
+    }
+'''
+
+
+def run_module():
+    module_args = dict(
+      vms=dict(type='list', elements='dict', required=True),
+      max_workers=dict(type='int', required=False, default=4),
+      storage_workers=dict(type='int', required=False, default=2),
+      timeout=dict(type='int', required=False, default=300),
+      shutdown_timeout=dict(type='int', required=False, default=30),
+      config_dir=dict(type='str', required=False, default='/etc/pve'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=False
+    )
+
+    result = {'changed': False, 'vm_results': [], 'stats': {}}
+    runner = executor.Executor(
+        node_limit=module.params['max_workers'],
+        storage_limit=module.params['storage_workers'],
+        timeout=module.params['timeout'],
+        shutdown_timeout=module.params['shutdown_timeout'])
+    try:
+      result['vm_results'] = node.NodeApply(
+          module.params['vms'],
+          config_dir=module.params['config_dir'],
+          executor=runner).Apply()
+      result['stats'] = runner.Stats()
+    except Exception as e:
+      module.fail_json(msg='unable to apply node changes: %s' % e, **result)
+
+    result['changed'] = any([x['changed'] for x in result['vm_results']])
+    failed = [str(x['vmid']) for x in result['vm_results'] if x['failed']]
+    if failed:
+      module.fail_json(msg='failed to apply VMs: %s' % ', '.join(failed), **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+#!/usr/bin/python
+#
+# Ansible interface to place VMs without a requested node on cluster nodes.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+# * https://pve.proxmox.com/pve-docs/api-viewer/index.html#/cluster/resources
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import placement
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_placement
+
+short_description: Assign cluster nodes to VMs without a requested node.
+
+version_added: '1.0.0'
+
+description: Parse the resource demand (memory, balloon, cores, sockets and
+  disk sizes) of every KVM and LXC definition and assign a cluster node to
+  definitions without 'node' from the memory, CPU and storage left on each
+  online node (first fit decreasing). VMs with a requested node and other
+  cluster VMs count against their node; existing VMs keep their current node
+  unless rebalancing. VMs sharing an anti-affinity tag are placed on different
+  nodes. Only plans; nothing is changed on the cluster.
+
+options:
+  vms:
+    description: pve_inventory lookup items for KVM and LXC instances.
+    required: true
+    type: list
+    elements: dict
+  resources:
+    description: Cluster resources (pvesh get /cluster/resources) including
+      nodes and storage.
+    required: true
+    type: list
+    elements: dict
+  nodes:
+    description: Inventory names of nodes VMs may be placed on. Default: all
+      online nodes, short names.
+    required: false
+    type: list
+    elements: str
+  strategy:
+    description: Fill the fewest nodes ('pack') or balance load ('spread').
+      Default: 'pack'.
+    required: false
+    type: str
+    choices: ['pack', 'spread']
+  memory_ratio:
+    description: Memory overcommit ratio. Default: 1.0.
+    required: false
+    type: float
+  cpu_ratio:
+    description: CPU overcommit ratio. Default: 1.0.
+    required: false
+    type: float
+  reserved_memory:
+    description: MB of memory reserved for each node host. Default: 0.
+    required: false
+    type: int
+  balloon:
+    description: Reserve the KVM balloon minimum instead of memory.
+      Default: true.
+    required: false
+    type: bool
+  anti_affinity_prefix:
+    description: Tag prefix of anti-affinity groups. Default: 'aa-'.
+    required: false
+    type: str
+  rebalance:
+    description: Place existing VMs without a requested node again; changed
+      nodes are migrated by pve_migrate. Default: false.
+    required: false
+    type: bool
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Place unpinned KVM and LXC instances, balancing node load.
+- name: 'Place instances'
+  pve_placement:
+    vms: '{{ lookup("pve_inventory", "kvm", "lxc", wantlist=True) }}'
+    resources: '{{ _pve_placement_resources.stdout|from_json }}'
+    nodes: '{{ groups["pve_nodes"] }}'
+    strategy: 'spread'
+    cpu_ratio: 4.0
+  register: _pve_placement_plan
+  no_log: true
+'''
+
+RETURN = r'''
+placement:
+    description: Node for every VM without a requested node that fits.
+    type: dict
+    returned: always
+    sample:
+    {101: 'pm2.example.com'}
+unplaced:
+    description: Demands of VMs that fit no node.
+    type: list
+    elements: dict
+    returned: always
+    sample:
+    [
+      {'vmid': 102, 'node': '', 'memory': 65536, 'cpus': 64, 'storage': {}, 'tags': []}
+    ]
+nodes:
+    description: Memory (MB) and CPUs used and available per node.
+    type: dict
+    returned: always
+    sample:
+    {'pm1': {'memory': 4096, 'memory_total': 63488, 'cpus': 4, 'cpus_total': 16, 'vms': 2}}
+overcommitted:
+    description: Nodes loaded beyond capacity by VMs with a requested node.
+    type: list
+    elements: str
+    returned: always
+    sample:
+    []
+stats:
+    description: VM counts and parse and placement duration (seconds).
+    type: dict
+    returned: always
+    sample:
+    {'vms': 3, 'pinned': 1, 'placed': 1, 'unplaced': 1, 'parse': 0.001, 'duration': 0.001}
+'''
+
+
+def run_module():
+    module_args = dict(
+      vms=dict(type='list', elements='dict', required=True),
+      resources=dict(type='list', elements='dict', required=True),
+      nodes=dict(type='list', elements='str', required=False, default=[]),
+      strategy=dict(type='str', required=False, default='pack', choices=list(placement.STRATEGIES)),
+      memory_ratio=dict(type='float', required=False, default=1.0),
+      cpu_ratio=dict(type='float', required=False, default=1.0),
+      reserved_memory=dict(type='int', required=False, default=0),
+      balloon=dict(type='bool', required=False, default=True),
+      anti_affinity_prefix=dict(type='str', required=False, default='aa-'),
+      rebalance=dict(type='bool', required=False, default=False),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = {'changed': False, 'placement': {}, 'unplaced': [], 'nodes': {}, 'overcommitted': [], 'stats': {}}
+    try:
+      # pve_inventory items hold the definition as {'pve_kvm': vm}.
+      vms = [list(x['value'].values())[0] for x in module.params['vms']]
+      result.update(placement.Plan(
+          vms,
+          module.params['resources'],
+          nodes=module.params['nodes'],
+          strategy=module.params['strategy'],
+          memory_ratio=module.params['memory_ratio'],
+          cpu_ratio=module.params['cpu_ratio'],
+          reserved_memory=module.params['reserved_memory'],
+          balloon=module.params['balloon'],
+          anti_affinity_prefix=module.params['anti_affinity_prefix'],
+          rebalance=module.params['rebalance']))
+    except Exception as e:
+      module.fail_json(msg='unable to place VMs: %s' % e, **result)
+
+    if result['overcommitted']:
+      module.warn('nodes overcommitted by VMs with a requested node: %s' % ', '.join(result['overcommitted']))
+    if result['unplaced']:
+      module.fail_json(msg='no node with capacity for: %s' % ', '.join([str(x['vmid']) for x in result['unplaced']]), **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/python
+#
+# Ansible interface to subordinate ID module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import subid
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_subid
+
+short_description: Merge LXC subordinate user/group IDs on a cluster node.
+
+version_added: '1.0.0'
+
+description: Merge subordinate ID entries (lxc_config 'lxc.meta.subuid' and
+  'lxc.meta.subgid') for any number of containers into /etc/subuid and
+  /etc/subgid with a single atomic read-modify-write per file. Existing
+  entries are kept; missing entries are appended. Must run on the cluster
+  node (use delegate_to).
+
+options:
+  subuid:
+    description: Subordinate user ID entries, e.g. ['root:1005:1'].
+                 Default: [].
+    required: false
+    type: list
+    elements: str
+  subgid:
+    description: Subordinate group ID entries, e.g. ['root:1005:1'].
+                 Default: [].
+    required: false
+    type: list
+    elements: str
+  subuid_path:
+    description: Subordinate user ID file. Default: '/etc/subuid'.
+    required: false
+    type: str
+  subgid_path:
+    description: Subordinate group ID file. Default: '/etc/subgid'.
+    required: false
+    type: str
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Map container IDs for a container.
+- name: 'Map container IDs'
+  pve_subid:
+    subuid: '{{ _pve_vm.lxc.meta.subuid }}'
+    subgid: '{{ _pve_vm.lxc.meta.subgid }}'
+  delegate_to: '{{ _pve_vm.node }}'
+'''
+
+RETURN = r'''
+added:
+    description: Entries added to each file.
+    type: dict
+    returned: always
+    sample:
+    {
+      'subuid': ['root:1005:1'],
+      'subgid': []
+    }
+'''
+
+
+def run_module():
+    module_args = dict(
+      subuid=dict(type='list', elements='str', required=False, default=[]),
+      subgid=dict(type='list', elements='str', required=False, default=[]),
+      subuid_path=dict(type='str', required=False, default='/etc/subuid'),
+      subgid_path=dict(type='str', required=False, default='/etc/subgid'),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=True
+    )
+
+    result = {'changed': False, 'added': {'subuid': [], 'subgid': []}}
+    try:
+      for key in ('subuid', 'subgid'):
+        if module.params[key]:
+          result['added'][key] = subid.Apply(
+              module.params[f'{key}_path'],
+              module.params[key],
+              check_mode=module.check_mode)
+    except Exception as e:
+      module.fail_json(msg='unable to map subordinate ids: %s' % e, **result)
+
+    result['changed'] = len(result['added']['subuid'] + result['added']['subgid']) > 0
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
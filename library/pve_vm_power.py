@@ -0,0 +1,130 @@
+#!/usr/bin/python
+#
+# Ansible interface to power schedule module.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_modules_general.html#creating-a-module
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.module_utils import power
+from ansible.module_utils.basic import AnsibleModule
+
+DOCUMENTATION = r'''
+---
+module: pve_vm_power
+
+short_description: Start or shutdown VMs in startup order waves.
+
+version_added: '1.0.0'
+
+description: Group VMs into waves by their 'startup' order and start (or
+  shutdown in reverse order) each wave concurrently through the cluster API.
+  The 'up' delay of a wave is honored before starting the next wave; the 'down'
+  value is used as the VM shutdown timeout. Remaining waves are skipped if a VM
+  fails. Must run on a cluster node (use delegate_to).
+
+options:
+  vms:
+    description: List of kvm_config/lxc_config results. VMs may reside on any
+                 cluster node.
+    required: true
+    type: list
+    elements: dict
+  state:
+    description: Power state of the VMs.
+    required: true
+    type: str
+    choices: ['started', 'stopped']
+  start_timeout:
+    description: Seconds to wait for a KVM start. Default: 300.
+    required: false
+    type: int
+  shutdown_timeout:
+    description: Seconds to wait for a shutdown if startup 'down' is not set.
+                 Default: 300.
+    required: false
+    type: int
+  max_workers:
+    description: Maximum number of VMs powered concurrently. Default: 8.
+    required: false
+    type: int
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+# Shutdown queued VMs in reverse startup order.
+- name: 'Shutdown VMs'
+  pve_vm_power:
+    vms:              '{{ _pve_node_apply_queue }}'
+    state:            'stopped'
+    shutdown_timeout: '{{ pve_kvm_shutdown_timeout }}'
+  delegate_to: '{{ _pve_node_apply_queue[0].node }}'
+'''
+
+RETURN = r'''
+waves:
+    description: VM IDs for each wave, in execution order.
+    type: list
+    returned: always
+    sample:
+    [[102], [100, 101]]
+vm_results:
+    description: Per-VM results for executed waves.
+    type: list
+    returned: always
+    sample:
+    [
+      {
+        'vmid': 102,
+        'action': 'start',
+        'failed': False,
+        'msg': '',
+        'commands': [['pvesh', 'create', '/nodes/pm1/qemu/102/status/start', '--timeout', '300']],
+      }
+    ]
+'''
+
+
+def run_module():
+    module_args = dict(
+      vms=dict(type='list', elements='dict', required=True),
+      state=dict(type='str', required=True, choices=['started', 'stopped']),
+      start_timeout=dict(type='int', required=False, default=300),
+      shutdown_timeout=dict(type='int', required=False, default=300),
+      max_workers=dict(type='int', required=False, default=8),
+    )
+
+    module = AnsibleModule(
+        argument_spec=module_args,
+        supports_check_mode=False
+    )
+
+    schedule = power.PowerSchedule(
+        module.params['vms'],
+        start_timeout=module.params['start_timeout'],
+        shutdown_timeout=module.params['shutdown_timeout'],
+        max_workers=module.params['max_workers'])
+    if module.params['state'] == 'started':
+      result = schedule.Start()
+    else:
+      result = schedule.Shutdown()
+
+    failed = result.pop('failed')
+    result['changed'] = len(result['vm_results']) > 0
+    if failed:
+      module.fail_json(msg='unable to %s VMs: %s' % (
+          'start' if module.params['state'] == 'started' else 'shutdown',
+          ', '.join([str(x['vmid']) for x in result['vm_results'] if x['failed']])), **result)
+    module.exit_json(**result)
+
+
+def main():
+    run_module()
+
+
+if __name__ == '__main__':
+    main()
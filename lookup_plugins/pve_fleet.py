@@ -0,0 +1,134 @@
+#!/usr/bin/python
+#
+# Ansible lookup querying the SQLite fleet index of parsed VM configs.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_plugins.html#lookup-plugins
+# * https://www.sqlite.org/lang_expr.html#like
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.errors import AnsibleError
+from ansible.plugins.lookup import LookupBase
+import os
+import sqlite3
+import sys
+
+try:
+    from ansible.module_utils import fleet
+except ImportError:
+    # Lookups run on the controller; use the role module_utils directly.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils'))
+    import fleet
+
+DOCUMENTATION = r'''
+---
+name: pve_fleet
+
+short_description: Query the fleet index of parsed KVM and LXC configs.
+
+version_added: '1.0.0'
+
+description: Filter VMs by parsed config options without re-parsing every
+  host config. Configs are indexed (one row per option and sub-option) in a
+  SQLite file with module_utils/fleet.py, or by this lookup with 'update';
+  only VMs whose definition changed since the last update are re-parsed.
+  Patterns are SQLite GLOB patterns ('mp*', '/dev/nvidia*').
+
+options:
+  _terms:
+    description: Query, 'vms' (matching VMs) or 'storage' (disks and bytes
+      allocated per storage).
+    required: true
+  db:
+    description: SQLite fleet index path.
+    default: 'pve_fleet.db'
+    env:
+      - name: PVE_FLEET_DB
+  update:
+    description: Index inventory hosts defining 'pve_kvm' or 'pve_lxc' before
+      querying; VMs no longer defined are removed.
+    default: false
+    type: bool
+  key:
+    description: Option key pattern ('scsi0', 'mp*', 'lxc.mount.entry').
+    type: str
+  sub_key:
+    description: Option sub-key pattern ('file', 'bridge'); '' for options
+      without one.
+    type: str
+  value:
+    description: Option value pattern.
+    type: str
+  storage:
+    description: Storage a disk, rootfs or mountpoint volume is on.
+    type: str
+  node:
+    description: Cluster node (FQDN or short name).
+    type: str
+  kind:
+    description: VM type, 'kvm' or 'lxc'.
+    type: str
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+- name: 'containers bind mounting nvidia devices'
+  ansible.builtin.debug:
+    msg: '{{ lookup("pve_fleet", "vms", update=True, key="mp*", value="/dev/nvidia*", kind="lxc", wantlist=True) }}'
+
+- name: 'VMs using ceph storage'
+  ansible.builtin.debug:
+    msg: '{{ lookup("pve_fleet", "vms", storage="ceph", wantlist=True)|map(attribute="host")|list }}'
+
+- name: 'disk allocated per storage'
+  ansible.builtin.debug:
+    msg: '{{ lookup("pve_fleet", "storage") }}'
+'''
+
+RETURN = r'''
+_list:
+    description: Matching VMs sorted by node and VMID ('vms'), or a dict of
+      storage to disks and bytes allocated ('storage').
+    type: list
+    elements: dict
+    sample:
+    [
+      {'vmid': 101, 'host': 'gpu.example.com', 'node': 'pm1.example.com', 'kind': 'lxc'}
+    ]
+'''
+
+_queries = ('vms', 'storage')
+
+
+class LookupModule(LookupBase):
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        for term in terms:
+            if term not in _queries:
+                raise AnsibleError('pve_fleet: query must be one of %s: %s' % (', '.join(_queries), term))
+
+        path = self.get_option('db')
+        try:
+            if self.get_option('update'):
+                with fleet.Fleet(path) as index:
+                    index.Update(fleet.Inventory((variables or {}).get('hostvars', {})), prune=True)
+            with fleet.Fleet(path, readonly=True) as index:
+                results = []
+                for term in terms:
+                    if term == 'storage':
+                        results.append(index.Storage())
+                        continue
+                    results += index.Vms(
+                        self.get_option('key'),
+                        self.get_option('sub_key'),
+                        self.get_option('value'),
+                        self.get_option('storage'),
+                        self.get_option('node'),
+                        self.get_option('kind'))
+                return results
+        except (sqlite3.Error, ValueError) as e:
+            raise AnsibleError('pve_fleet: unable to query %s: %s' % (path, e))
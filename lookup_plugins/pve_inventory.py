@@ -0,0 +1,98 @@
+#!/usr/bin/python
+#
+# Ansible lookup returning an index of inventory hosts defining PVE VMs.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/developing_plugins.html#lookup-plugins
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html#embedding-modules-and-plugins-in-roles
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from ansible.errors import AnsibleError
+from ansible.plugins.lookup import LookupBase
+import os
+import sys
+
+try:
+    from ansible.module_utils import inventory
+except ImportError:
+    # Lookups run on the controller; use the role module_utils directly.
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'module_utils'))
+    import inventory
+
+DOCUMENTATION = r'''
+---
+name: pve_inventory
+
+short_description: Index inventory hosts defining KVM or LXC instances.
+
+version_added: '1.0.0'
+
+description: Build an index of only the inventory hosts defining 'pve_kvm' or
+  'pve_lxc', sorted (grouped) by cluster node and VMID. Only the VM definition
+  variable of each host is templated; looping over 'hostvars|dict2items'
+  templates every variable of every inventory host instead. Items keep the
+  'key'/'value' shape of dict2items so tasks can use 'host.value.pve_kvm'.
+
+options:
+  _terms:
+    description: VM type to index, 'kvm' or 'lxc'.
+    required: true
+  node:
+    description: Only return VMs on this cluster node (FQDN or short name).
+    required: false
+    type: str
+  placement:
+    description: Node for each VMID without a requested node ('placement' of
+      pve_placement). Placed VMs are returned as if 'node' were defined.
+    required: false
+    type: dict
+
+author:
+    - Robert Pufky (@r-pufky)
+'''
+
+EXAMPLES = r'''
+- name: 'provision KVM instances'
+  ansible.builtin.include_tasks: provision.yml
+  loop: '{{ lookup("pve_inventory", "kvm", wantlist=True) }}'
+  loop_control:
+    loop_var: host
+
+- name: 'provision KVM instances, including placed instances'
+  ansible.builtin.include_tasks: provision.yml
+  loop: '{{ lookup("pve_inventory", "kvm", placement=_pve_placement, wantlist=True) }}'
+  loop_control:
+    loop_var: host
+'''
+
+RETURN = r'''
+_list:
+    description: Hosts defining the VM type, sorted by node and VMID.
+    type: list
+    elements: dict
+    sample:
+    [
+      {
+        'key': 'vtest.example.com',
+        'node': 'pm1.example.com',
+        'vmid': 100,
+        'config': 'cores: 4\nmemory: 4096\n...',
+        'value': {'pve_kvm': {'vmid': 100, 'node': 'pm1.example.com', ...}}
+      }
+    ]
+'''
+
+
+class LookupModule(LookupBase):
+
+    def run(self, terms, variables=None, **kwargs):
+        self.set_options(var_options=variables, direct=kwargs)
+        hostvars = (variables or {}).get('hostvars', {})
+        index = []
+        for term in terms:
+            try:
+                index += inventory.Index(hostvars, term, self.get_option('node'), self.get_option('placement'))
+            except ValueError as e:
+                raise AnsibleError('pve_inventory: %s' % e)
+        return index
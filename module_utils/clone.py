@@ -0,0 +1,182 @@
+#!/usr/bin/python
+#
+# Create cloud init KVM instances as linked clones of a per node/storage
+# template VM. Each distinct cloud init image is imported once per node and
+# storage (qm importdisk; qm template); new VMs are linked clones (qm clone
+# --full 0) instead of a full image import per VM.
+#
+# Linked clones require storage supporting thin snapshots/clones with the same
+# volume naming as an imported disk (vm-{VMID}-disk-N). Only LVM-thin keeps
+# that name; ZFS and RBD linked clones are named
+# base-{TEMPLATE}-disk-N/vm-{VMID}-disk-N, which the role's config and disk
+# checks do not reference, so they are imported as full copies.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/qm.1.html
+# * https://pve.proxmox.com/wiki/VM_Templates_and_Clones
+# * https://pve.proxmox.com/pve-docs/chapter-pvesm.html#_storage_types
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import hashlib
+import json
+import re
+
+try:
+  from ansible.module_utils import node
+except:
+  import node
+
+
+def IsTemplate(resource):
+  '''Return bool True if a cluster VM resource is an image template VM.
+
+  Args
+    resource: dict cluster VM resource.
+  '''
+  return bool(resource.get('template')) and any(
+      x.startswith('ci-') for x in re.split(r'[;,\s]+', resource.get('tags', '')))
+
+
+class LinkedClone(object):
+  '''Create a cloud init KVM instance as a linked clone of a template VM.
+
+  Template VMs are identified by a tag derived from the image checksum and
+  storage ('ci-{digest}-{storage}') on the VM node.
+
+  Attributes
+    vm: dict PveConfig.Ansible() result for the new VM.
+    disk: str local path of the extracted cloud init disk image.
+    template_vmid: int first VMID used for template VMs.
+    reserved: set of int VMIDs defined in the inventory; never used for
+        template VMs.
+  '''
+  linked_storage = ('lvmthin',)
+
+  def __init__(self, vm, disk, template_vmid=9000, reserved=None, run=node.Run):
+    '''Initialize LinkedClone.
+
+    Args
+      vm: dict PveConfig.Ansible() result for the new VM.
+      disk: str local path of the extracted cloud init disk image.
+      template_vmid: int first VMID used for template VMs. Default: 9000.
+      reserved: list of int VMIDs defined in the inventory. Default: None.
+      run: function executing a node command; see node.Run.
+    '''
+    self.vm = vm
+    self.disk = disk
+    self.template_vmid = int(template_vmid)
+    self.reserved = set([int(x) for x in reserved or []])
+    self._run = run
+    self.node = vm['node'].split('.')[0]
+    self.storage = vm['root']['storage']
+    self.commands = []
+
+  def _Execute(self, cmd, ok_rc=(0,)):
+    '''Run command, record it and raise on failure.'''
+    result = self._run(cmd, ok_rc=ok_rc)
+    self.commands.append(result.AsDict())
+    if not result.ok:
+      raise RuntimeError(f'{" ".join(cmd)} failed ({result.rc}): {result.stderr.strip()}')
+    return result
+
+  def _Get(self, path, *args):
+    '''Return decoded json for a cluster API path.'''
+    return json.loads(self._Execute(['pvesh', 'get', path, *args, '--output-format', 'json']).stdout or '[]')
+
+  def Tag(self):
+    '''Return str template VM tag for the image and storage.'''
+    template = self.vm['template']
+    digest = template['checksum'] or hashlib.sha256(template['url'].encode()).hexdigest()
+    return f'ci-{digest[:16].lower()}-{self.storage.lower()}'
+
+  def Supported(self):
+    '''Return bool True if the VM root disk can be a linked clone.'''
+    if self.vm['root'].get('fullname') != f'vm-{self.vm["vmid"]}-disk-0':
+      return False
+    return self._Get(f'/storage/{self.storage}').get('type') in self.linked_storage
+
+  def CheckReserved(self, resources):
+    '''Raise if an inventory VMID is held by an image template VM.
+
+    A template VM created for an earlier run may hold a VMID since added to
+    the inventory; provisioning that VM would reconfigure the base of every
+    linked clone.
+
+    Args
+      resources: list of dict cluster VM resources.
+
+    Raises
+      RuntimeError if an inventory VMID is an image template VM.
+    '''
+    for vm in resources:
+      if int(vm['vmid']) in self.reserved and IsTemplate(vm):
+        raise RuntimeError(f'inventory VMID {vm["vmid"]} is image template VM on {vm.get("node")}')
+
+  def FindTemplate(self, resources):
+    '''Return int VMID of the template VM on the node, or None.
+
+    Args
+      resources: list of dict cluster VM resources.
+    '''
+    for vm in resources:
+      if (vm.get('template') and vm.get('node') == self.node and
+          self.Tag() in re.split(r'[;,\s]+', vm.get('tags', ''))):
+        return int(vm['vmid'])
+    return None
+
+  def _FreeVmid(self, resources):
+    '''Return int lowest VMID starting at template_vmid not in the cluster or inventory.'''
+    used = set([int(x['vmid']) for x in resources]) | self.reserved
+    vmid = self.template_vmid
+    while vmid in used:
+      vmid += 1
+    return vmid
+
+  def CreateTemplate(self, vmid):
+    '''Import the cloud init disk into a new template VM.
+
+    Args
+      vmid: int template VMID.
+    '''
+    vmid = str(vmid)
+    name = re.sub(r'[^a-z0-9-]+', '-', f'ci-{self.vm["template"]["name"]}'.lower())[:63].strip('-')
+    self._Execute(['qm', 'create', vmid, '--name', name, '--memory', '512', '--tags', self.Tag()])
+    self._Execute(['qm', 'importdisk', vmid, self.disk, self.storage])
+    self._Execute(['qm', 'set', vmid, f'--{self.vm["root"]["disk"]}', f'{self.storage}:vm-{vmid}-disk-0'])
+    self._Execute(['qm', 'template', vmid])
+
+  def Apply(self):
+    '''Clone the VM from the image template, creating the template if needed.
+
+    Returns
+      dict result. linked is False if the storage does not support linked
+      clones (import the disk instead).
+      {
+        'linked': True,
+        'template_vmid': 9000,
+        'template_created': False,
+        'commands': [{'cmd': [...], 'rc': 0, 'stdout': '', ...}],
+      }
+
+    Raises
+      RuntimeError if a node command fails or an inventory VMID is an image
+      template VM.
+    '''
+    result = {'linked': False, 'template_vmid': None, 'template_created': False, 'commands': self.commands}
+    if not self.Supported():
+      return result
+
+    resources = self._Get('/cluster/resources', '--type', 'vm')
+    self.CheckReserved(resources)
+    template = self.FindTemplate(resources)
+    if template is None:
+      template = self._FreeVmid(resources)
+      self.CreateTemplate(template)
+      result['template_created'] = True
+
+    self._Execute(['qm', 'clone', str(template), str(self.vm['vmid']), '--full', '0'])
+    result.update(linked=True, template_vmid=template)
+    return result
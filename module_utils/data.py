@@ -1,14 +1,23 @@
 #!/usr/bin/python
 #
-# Manage configuration data from pct.conf, qm.conf, pct, qm using dataclasses.
+# Manage configuration data from pct.conf, qm.conf, pct, qm using data classes.
 #
-# Dataclasses are used to encapulsate configuration/cli lines, and return
+# Data classes are used to encapulsate configuration/cli lines, and return
 # formatted values for ansible, qm.conf, and the qm cli. All formats use the
 # same {KEY}:{VALUE} format with no distinction in data storage.
 #
 # Data class parsers are matched on the KEY in the {KEY}:{VALUE} pair for the
 # configuration.
 #
+# Every kvm_config/lxc_config execution (once per VM) imports this module in a
+# new interpreter. Data classes are plain classes (Record) instead of
+# dataclasses: importing dataclasses (inspect, ast, dis, tokenize) and building
+# the dataclass machinery costs more than parsing a typical config. Line
+# matcher patterns are compiled on first use. Track cold start with:
+#
+#   python3 -X importtime -c 'import parsers'
+#   python3 -m unittest tests.test_import
+#
 # Run unittests from module_utils: python3 -m unittest
 #
 # Reference:
@@ -16,19 +25,37 @@
 # * https://pve.proxmox.com/pve-docs/qm.1.html
 # * https://pve.proxmox.com/wiki/Manual:_pct.conf
 # * https://pve.proxmox.com/pve-docs/pct.1.html
+# * https://docs.python.org/3/using/cmdline.html#cmdoption-X
 
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
-from abc import ABC
-from abc import abstractmethod
-from dataclasses import dataclass
-from dataclasses import field
 from enum import Enum
 from enum import auto
-from typing import ClassVar
 import re
 
 
+class Record(object):
+  '''Base data class providing field based equality, repr and dict export.
+
+  Attributes
+    _fields: tuple of str attribute names, in declaration order.
+  '''
+  _fields = ()
+  __hash__ = None
+
+  def __eq__(self, other):
+    if other.__class__ is not self.__class__:
+      return NotImplemented
+    return all(getattr(self, x) == getattr(other, x) for x in self._fields)
+
+  def __repr__(self):
+    return f'{self.__class__.__name__}({", ".join(f"{x}={getattr(self, x)!r}" for x in self._fields)})'
+
+  def AsDict(self):
+    '''Return dict of fields (shallow).'''
+    return {x: getattr(self, x) for x in self._fields}
+
+
 class PveType(Enum):
   '''Configuration line broad classification.'''
   DEFAULT = auto()
@@ -49,16 +76,26 @@ class PveConfigType(Enum):
   LXC = auto()
 
 
-@dataclass
-class ImageMap:
-  url: str
-  checksum: str
-  algorithm: str
-  file: str = field(init=False)
-  name: str = field(init=False)
-  extension: str = field(init=False)
+class ImageMap(Record):
+  '''Image template download options.
 
-  def __post_init__(self):
+  Attributes
+    url: str image location.
+    checksum: str image checksum.
+    algorithm: str checksum algorithm.
+    file: str image file name.
+    name: str image file name without extension.
+    extension: str image file extension (tar.gz, tar.xz included).
+  '''
+  _fields = ('url', 'checksum', 'algorithm', 'file', 'name', 'extension')
+
+  def __init__(self, url, checksum, algorithm):
+    self.url = url
+    self.checksum = checksum
+    self.algorithm = algorithm
+    self._Parse()
+
+  def _Parse(self):
     '''Parse provided options to generate file, name, extension.'''
     self.file = self.url.split('/')[-1]
 
@@ -70,21 +107,32 @@ class ImageMap:
       self.name, self.extension = self.file.rsplit('.', 1)
 
 
-@dataclass
-class LineMatcher:
+class LineMatcher(Record):
   '''Matches config lines based on regular expressions.
 
+  The pattern is compiled on first use.
+
   Attributes
-    regex: re object to match config line. Default any {KEY}:{VALUE} pair.
+    pattern: str regular expression to match config line.
     type: PveType to match config line to. Default: PveType.Default.
   '''
-  regex: re.Pattern
-  type: PveType = field(default=PveType.DEFAULT)
+  _fields = ('pattern', 'type')
 
+  def __init__(self, pattern, type=PveType.DEFAULT):
+    self.pattern = pattern
+    self.type = type
+    self._regex = None
 
-@dataclass
-class PveSecondaryOption:
-  '''Pve secondary option dataclass.
+  @property
+  def regex(self):
+    '''Return compiled re.Pattern.'''
+    if self._regex is None:
+      self._regex = re.compile(self.pattern)
+    return self._regex
+
+
+class PveSecondaryOption(Record):
+  '''Pve secondary option data class.
 
   Secondary (sub-option) key/values are separated by ';'.
 
@@ -100,12 +148,14 @@ class PveSecondaryOption:
     type: PveType KEY_VALUE if a key/value pair or VALUE_ONLY for string.
         COMMMENT if original line is a comment.
   '''
-  line: str
-  options: list = field(default_factory=list)
-  type: PveType = field(default=PveType.VALUE_ONLY)
+  _fields = ('line', 'options', 'type')
 
-  def __post_init__(self):
+  def __init__(self, line, type=PveType.VALUE_ONLY):
     '''Parse secondary options'''
+    self.line = line
+    self.options = []
+    self.type = type
+
     # Comments and LXC extensions are considered strings.
     if self.type in (PveType.COMMENT, PveType.LXC_EXTENSION):
       self.options = [self.line.strip()]
@@ -128,9 +178,8 @@ class PveSecondaryOption:
     return self.options
 
 
-@dataclass
-class PvePrimaryOption:
-  '''Pve primary option dataclass.
+class PvePrimaryOption(Record):
+  '''Pve primary option data class.
 
   Primary (option) key/values are separated by '='.
 
@@ -149,13 +198,13 @@ class PvePrimaryOption:
         including any sub-options.
     type: PveType configuration line broad classification.
   '''
-  line: str
-  key: str = field(init=False)
-  value: PveSecondaryOption = field(init=False)
-  type: PveType = field(default=PveType.KEY_VALUE)
+  _fields = ('line', 'key', 'value', 'type')
 
-  def __post_init__(self):
+  def __init__(self, line, type=PveType.KEY_VALUE):
     '''Parse primary options'''
+    self.line = line
+    self.type = type
+
     # Comments and LXC extensions are considered strings.
     if self.type in (PveType.COMMENT, PveType.LXC_EXTENSION):
       self.key = None
@@ -188,9 +237,8 @@ class PvePrimaryOption:
     return {self.key: self.value.Ansible()}
 
 
-@dataclass
-class PveConfigOption:
-  '''Pve config option dataclass.
+class PveConfigOption(Record):
+  '''Pve config option data class.
 
   Pve configs for both the CLI and file use a simple {KEY}: {VALUE}
   method for storing data. primary option/values are separated by '=' and
@@ -213,20 +261,16 @@ class PveConfigOption:
     type: PveType category. Optional, default: PveType.DEFAULT.
     config: PveConfig category config hint. Optional, default: PveConfig.KVM.
   '''
-  line: str
-  config: PveConfigType = field(default=PveConfigType.KVM)
-  key: str = field(init=False)
-  value: list = field(init=False, default_factory=list)
-  type: PveType = field(init=False, default=PveType.DEFAULT)
-  _matcher: ClassVar[LineMatcher] = [
-    LineMatcher(re.compile('(^scsi|sata|ide|virtio|efidisk)(\d+)'), PveType.DISK),
-    LineMatcher(re.compile('(^mp)(\d+)'), PveType.MP),
-    LineMatcher(re.compile('^rootfs'), PveType.ROOTFS),
-    LineMatcher(re.compile('^lxc'), PveType.LXC_EXTENSION),
-    LineMatcher(re.compile('^sshkeys'), PveType.SSH_KEYS),
-    LineMatcher(re.compile('^.*'), PveType.DEFAULT),
+  _fields = ('line', 'config', 'key', 'value', 'type')
+  _matcher = [
+    LineMatcher('(^scsi|sata|ide|virtio|efidisk)(\d+)', PveType.DISK),
+    LineMatcher('(^mp)(\d+)', PveType.MP),
+    LineMatcher('^rootfs', PveType.ROOTFS),
+    LineMatcher('^lxc', PveType.LXC_EXTENSION),
+    LineMatcher('^sshkeys', PveType.SSH_KEYS),
+    LineMatcher('^.*', PveType.DEFAULT),
   ]
-  _optional_keys: ClassVar[dict[str, str]] = {
+  _optional_keys = {
     'agent': 'enabled',
     #'boot': 'legacy',   # Deprecated; do not support.
     'cpu': 'cputype',
@@ -254,6 +298,17 @@ class PveConfigOption:
     ]
   }
 
+  # Keys PVE serializes immediately after the default key.
+  _canonical_required_keys = {
+    'audio': ['device'],
+    'mp': ['mp'],
+    'net': ['name'],
+  }
+  # Keys PVE stores as given (not re-serialized as property strings).
+  _canonical_verbatim_keys = ['args', 'startup']
+  # Keys PVE stores as '#' comment lines.
+  _canonical_comment_keys = ['description']
+
   def _OptionalKeyMapping(self, option) -> str:
     '''Map default key for optional primary option.
 
@@ -284,8 +339,14 @@ class PveConfigOption:
 
     return self._optional_keys.get(stripped_key, '')
 
-  def __post_init__(self):
+  def __init__(self, line, config=PveConfigType.KVM):
     '''Parse primary options'''
+    self.line = line
+    self.config = config
+    self.key = None
+    self.value = []
+    self.type = PveType.DEFAULT
+
     # Special case, comments do not follow key/value pairing.
     if self.line.startswith('#'):
       self.key = None
@@ -321,7 +382,9 @@ class PveConfigOption:
     for i, option in enumerate(value.split(',')):
       if i == 0:
         option_key = self._OptionalKeyMapping(option)
-        if option_key not in option:
+        # Only a bare leading value ('3', 'local-lvm:4') omits the key;
+        # 'startup: up=5' is keyed even though it is not the default key.
+        if option_key and '=' not in option:
           self.line = f'{header}{self.key}{delim} {option_key}={value}'
           self.value.append(PvePrimaryOption(f'{option_key}={option}'))
           continue
@@ -339,11 +402,84 @@ class PveConfigOption:
     '''Return current value data as string using delim to combine.'''
     return delim.join([str(x) for x in self.value])
 
-  def Config(self) -> str:
-    '''Return data as a ready to use qm.conf line. No Spaces.'''
+  def _DefaultKey(self) -> str:
+    '''Return str property string default key for the option, or ''.'''
+    stripped_key = self.key.rstrip('0123456789')
+    if stripped_key == 'unused':
+      return 'file' if self.config == PveConfigType.KVM else 'volume'
+    if stripped_key == 'net' and self.config == PveConfigType.KVM:
+      return 'model'
+    return self._optional_keys.get(stripped_key, '')
+
+  def _CanonicalValue(self) -> str:
+    '''Return value as PVE serializes property strings.
+
+    The default key is printed first without 'key=', followed by required
+    keys, then all remaining keys sorted. KVM net models are printed as
+    '{MODEL}={MACADDR}'.
+
+    Reference
+    * https://git.proxmox.com/?p=pve-common.git;a=blob;f=src/PVE/JSONSchema.pm (print_property_string)
+    '''
+    stripped_key = self.key.rstrip('0123456789')
+    if self.type == PveType.TERTIARY_OPTION or stripped_key in self._canonical_verbatim_keys:
+      return self._ValueAsString(',')
+
+    default_key = self._DefaultKey()
+    required = self._canonical_required_keys.get(stripped_key, [])
+    options = {x.key: x for x in self.value if x.type == PveType.KEY_VALUE}
+    head = [str(x) for x in self.value if x.type != PveType.KEY_VALUE]
+
+    if stripped_key == 'net' and self.config == PveConfigType.KVM:
+      for model in self._optional_keys['_net_model_enum']:
+        if model in options:
+          head.insert(0, str(options.pop(model)))
+          break
+      else:
+        if 'model' in options and 'macaddr' in options:
+          head.insert(0, f'{options.pop("model").value}={options.pop("macaddr").value}')
+        elif 'model' in options:
+          head.insert(0, str(options.pop('model').value))
+    elif default_key in options:
+      head.insert(0, str(options.pop(default_key).value))
+
+    for key in required:
+      if key in options:
+        head.append(str(options.pop(key)))
+    return ','.join(head + [str(options[x]) for x in sorted(options)])
+
+  @staticmethod
+  def _EncodeText(text) -> str:
+    '''Return str URI escaped text as PVE encodes description lines.
+
+    Control characters, non-ASCII characters and ':' are escaped.
+    '''
+    return ''.join([chr(x) if 0x20 <= x <= 0x39 or 0x3b <= x <= 0x7e else f'%{x:02X}' for x in text.encode('utf-8')])
+
+  def Description(self) -> bool:
+    '''Return bool True if PVE stores the option as description comments.'''
+    return self.type == PveType.COMMENT or self.key in self._canonical_comment_keys
+
+  def Config(self, canonical=False) -> str:
+    '''Return data as a ready to use qm.conf line. No Spaces.
+
+    PVE stores the description (comment lines or the 'description' key) as
+    '#' lines of encoded text; comment text is kept exactly as given.
+
+    Args
+      canonical: bool True to format the line as PVE writes it.
+    '''
     if self.type == PveType.COMMENT:
+      if canonical:
+        return f'#{self._EncodeText(self.line.split("#", 1)[1])}'
       return f'# {self._ValueAsString()}'
 
+    if canonical and self.key in self._canonical_comment_keys:
+      return f'#{self._EncodeText(self.line.split(":", 1)[1].strip())}'
+
+    if canonical and self.type != PveType.LXC_EXTENSION:
+      return f'{self.key}: {self._CanonicalValue()}'
+
     return f'{self.key}: {self._ValueAsString(",")}'
 
   def Cli(self) -> str:
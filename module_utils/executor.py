@@ -0,0 +1,220 @@
+#!/usr/bin/python
+#
+# Run node commands (qm, pct, pvesm, pvesh) as asyncio subprocesses from a
+# single node-local module execution. Node apply (node.NodeApply) runs all VMs
+# on a node concurrently through Executor; concurrency is bounded per node and
+# per storage so disk heavy commands (pvesm alloc, qm importdisk, resize) do
+# not saturate a storage. Migrate runs migrations with RunAsync directly.
+#
+# A command exceeding its timeout is killed with every process it forked.
+# Shutdown commands wait up to the role shutdown timeout
+# (pve_kvm_shutdown_timeout) before being killed; all other commands use the
+# default command timeout.
+#
+# Power scheduling (power.PowerSchedule) and image copies (images.ImageCache)
+# run blocking commands on threads instead.
+#
+# Benchmark node apply throughput and tail latency from module_utils:
+#
+#   python3 -m tests.benchmark --vms 100 --latency 0.05
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://docs.python.org/3/library/asyncio-subprocess.html
+# * https://docs.python.org/3/library/asyncio-sync.html#semaphore
+# * https://pve.proxmox.com/pve-docs/qm.1.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import asyncio
+import os
+import signal
+import time
+
+try:
+  from ansible.module_utils import node
+  from ansible.module_utils import stats
+except:
+  import node
+  import stats
+
+
+async def RunAsync(cmd, ok_rc=(0,), timeout=None):
+  '''Run a node command as an asyncio subprocess.
+
+  Args
+    cmd: list of str command to execute.
+    ok_rc: tuple of int accepted return codes. Default: (0,).
+    timeout: int seconds before the command is killed. Default: None.
+
+  Returns
+    node.CommandResult for the executed command.
+  '''
+  # Own process group; the whole command (including workers it forked, which
+  # keep output pipes open) is killed on timeout.
+  try:
+    proc = await asyncio.create_subprocess_exec(*cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+                                                start_new_session=True)
+  except OSError as e:
+    return node.CommandResult(cmd, -1, '', str(e), ok=False)
+  try:
+    stdout, stderr = await asyncio.wait_for(proc.communicate(), timeout)
+  except asyncio.TimeoutError:
+    try:
+      os.killpg(proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+      pass
+    await proc.wait()
+    return node.CommandResult(cmd, -1, '', f'timeout after {timeout} seconds', ok=False)
+  return node.CommandResult(cmd, proc.returncode, stdout.decode(), stderr.decode(), ok=proc.returncode in ok_rc)
+
+
+class Executor(object):
+  '''Run node commands concurrently with per node and storage limits.
+
+  Coroutines passed to Run share the executor; each awaits Command for its
+  node commands, which run in the order awaited.
+
+  Attributes
+    node_limit: int maximum concurrent commands per node.
+    storage_limit: int maximum concurrent commands per node storage.
+    timeout: int default seconds before a command is killed.
+    shutdown_timeout: int seconds a VM is given to shutdown.
+    commands: list of dict results of commands run by the last Run.
+  '''
+  shutdown_commands = ('shutdown', 'stop', 'reboot')
+  shutdown_grace = 30
+
+  def __init__(self, node_limit=4, storage_limit=2, timeout=300, shutdown_timeout=30, run=RunAsync, clock=time.monotonic):
+    '''Initialize Executor.
+
+    Args
+      node_limit: int maximum concurrent commands per node. Default: 4.
+      storage_limit: int maximum concurrent commands per node storage.
+          Default: 2.
+      timeout: int default seconds before a command is killed. Default: 300.
+      shutdown_timeout: int seconds a VM is given to shutdown
+          (pve_kvm_shutdown_timeout). Default: 30.
+      run: coroutine function executing a node command; see RunAsync.
+      clock: function returning monotonic seconds; see time.monotonic.
+    '''
+    self.node_limit = max(1, int(node_limit))
+    self.storage_limit = max(1, int(storage_limit))
+    self.timeout = int(timeout)
+    self.shutdown_timeout = int(shutdown_timeout)
+    self.commands = []
+    self.duration = 0.0
+    self._run = run
+    self._clock = clock
+    self._semaphores = {}
+    self._locks = {}
+
+  def Timeout(self, cmd):
+    '''Return int seconds before a command is killed.
+
+    qm/pct shutdown wait for the guest themselves (--timeout); allow a grace
+    period for the forced stop before killing the command.
+    '''
+    if cmd[0] in ('qm', 'pct') and len(cmd) > 1 and cmd[1] in self.shutdown_commands:
+      return self.shutdown_timeout + self.shutdown_grace
+    return self.timeout
+
+  @staticmethod
+  def Storage(cmd):
+    '''Return str storage a command allocates on, or None.'''
+    if cmd[:2] == ['pvesm', 'alloc'] and len(cmd) > 2:
+      return cmd[2]
+    if cmd[0] in ('qm', 'pct') and len(cmd) > 4 and cmd[1] == 'importdisk':
+      return cmd[4]
+    return None
+
+  def _Semaphore(self, key, limit):
+    '''Return asyncio.Semaphore for a node or storage key.'''
+    if key not in self._semaphores:
+      self._semaphores[key] = asyncio.Semaphore(limit)
+    return self._semaphores[key]
+
+  def Lock(self, key):
+    '''Return asyncio.Lock for key, shared by all coroutines of a Run.'''
+    if key not in self._locks:
+      self._locks[key] = asyncio.Lock()
+    return self._locks[key]
+
+  async def Command(self, node_name, cmd, ok_rc=(0,), storage=None, timeout=None):
+    '''Run a node command within node (and storage) limits.
+
+    Args
+      node_name: str cluster node the command runs on.
+      cmd: list of str command to execute.
+      ok_rc: tuple of int accepted return codes. Default: (0,).
+      storage: str storage the command uses. Default: None (detected for
+          pvesm alloc and qm/pct importdisk).
+      timeout: int seconds before the command is killed. Default: None
+          (see Timeout).
+
+    Returns
+      dict command result; recorded in commands.
+      {'cmd': [...], 'rc': 0, 'stdout': '', 'stderr': '', 'ok': True,
+       'storage': 'local-lvm', 'waited': 0.0, 'duration': 1.52}
+    '''
+    cmd = [str(x) for x in cmd]
+    storage = storage or self.Storage(cmd)
+    queued = self._clock()
+    # Wait for the storage before taking a node slot; commands queued on a busy
+    # storage must not block other commands on the node.
+    storage_lock = self._Semaphore(('storage', node_name, storage), self.storage_limit) if storage else None
+    if storage_lock:
+      await storage_lock.acquire()
+    try:
+      async with self._Semaphore(('node', node_name), self.node_limit):
+        started = self._clock()
+        result = await self._run(cmd, ok_rc=tuple(ok_rc), timeout=timeout or self.Timeout(cmd))
+        finished = self._clock()
+    finally:
+      if storage_lock:
+        storage_lock.release()
+    result = result.AsDict()
+    result.update(storage=storage, waited=round(started - queued, 6), duration=round(finished - started, 6))
+    self.commands.append(result)
+    return result
+
+  def Run(self, function, items):
+    '''Run function concurrently for all items in a new event loop.
+
+    Args
+      function: coroutine function called with each item.
+      items: list of items.
+
+    Returns
+      list of function results, in the order items were given.
+    '''
+    async def RunAll():
+      return await asyncio.gather(*[function(x) for x in items])
+
+    self._semaphores = {}
+    self._locks = {}
+    self.commands = []
+    started = self._clock()
+    results = asyncio.run(RunAll())
+    self.duration = self._clock() - started
+    return results
+
+  def Stats(self):
+    '''Return dict command statistics for the last Run.
+
+    Latency is the time from a command being queued to finishing.
+
+    {'duration': 1.6, 'commands': 1, 'throughput': 0.6, 'p50': 1.52,
+     'p99': 1.52, 'max': 1.52, 'failed': 0}
+    '''
+    latency = [x['waited'] + x['duration'] for x in self.commands]
+    return {
+      'duration': round(self.duration, 6),
+      'commands': len(latency),
+      'throughput': round(len(latency) / self.duration, 3) if self.duration else 0.0,
+      'p50': stats.Percentile(latency, 50),
+      'p99': stats.Percentile(latency, 99),
+      'max': max(latency, default=0.0),
+      'failed': len([x for x in self.commands if not x['ok']]),
+    }
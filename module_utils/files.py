@@ -0,0 +1,71 @@
+#!/usr/bin/python
+#
+# Atomic file writes on local filesystems. Content is written to a temporary
+# file in the destination directory, flushed to disk and renamed over the
+# destination; readers never see a partial file and a failed write leaves
+# neither a partial destination nor a stray temporary file.
+#
+# Not for pmxcfs (/etc/pve), which does not support rename; see
+# node.WriteConfig.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://docs.python.org/3/library/os.html#os.replace
+# * https://man7.org/linux/man-pages/man2/fsync.2.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import contextlib
+import os
+import tempfile
+
+
+@contextlib.contextmanager
+def OpenAtomic(path, mode='w', perms=0o644, owner=None):
+  '''Yield a temporary file object which replaces path on success.
+
+  The temporary file is created beside path (missing directories are
+  created). If the block raises, the temporary file is removed and path is
+  unchanged.
+
+  Args
+    path: str destination path.
+    mode: str file mode, 'w' or 'wb'. Default: 'w'.
+    perms: int permission bits of the written file. Default: 0o644.
+    owner: tuple (int uid, int gid) owner of the written file. Default: None
+        (process owner).
+
+  Yields
+    file object to write.
+  '''
+  directory = os.path.dirname(os.path.abspath(path))
+  os.makedirs(directory, exist_ok=True)
+  fd, temp = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', dir=directory)
+  try:
+    with os.fdopen(fd, mode) as f:
+      yield f
+      f.flush()
+      os.fsync(f.fileno())
+    os.chmod(temp, perms)
+    if owner:
+      os.chown(temp, *owner)
+    os.replace(temp, path)
+  except BaseException:
+    if os.path.exists(temp):
+      os.remove(temp)
+    raise
+
+
+def WriteAtomic(path, content, perms=0o644, owner=None):
+  '''Write str or bytes content to a file atomically.
+
+  Args
+    path: str destination path.
+    content: str or bytes file content.
+    perms: int permission bits of the written file. Default: 0o644.
+    owner: tuple (int uid, int gid) owner of the written file. Default: None
+        (process owner).
+  '''
+  with OpenAtomic(path, 'wb' if isinstance(content, bytes) else 'w', perms, owner) as f:
+    f.write(content)
@@ -0,0 +1,307 @@
+#!/usr/bin/python
+#
+# Render PVE firewall (.fw) files from firewall definitions and compare them
+# semantically against existing files, so a firewall is rendered once and only
+# written when the definition changed.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/chapter-pve-firewall.html
+# * https://pve.proxmox.com/pve-docs/chapter-pve-firewall.html#pve_firewall_vm_container_configuration
+# * https://pve.proxmox.com/pve-docs/chapter-pve-firewall.html#_firewall_rules
+# * https://pve.proxmox.com/pve-docs/chapter-pve-firewall.html#pve_firewall_ip_sets
+# * https://docs.python.org/3/library/ipaddress.html#ipaddress.collapse_addresses
+# * https://pve.proxmox.com/pve-docs/chapter-pmxcfs.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import ipaddress
+import os
+
+try:
+  from ansible.module_utils import parsers
+except:
+  import parsers
+
+
+class PveFirewall(object):
+  '''Render a PVE firewall definition.
+
+  VM/container firewalls (vmid.fw) contain OPTIONS, RULES, IPSET and ALIASES
+  sections. Cluster firewalls (cluster.fw) additionally contain security
+  GROUP sections and datacenter options.
+
+  Attributes
+    firewall: dict firewall definition (see defaults/main/{kvm,lxc}.yml
+        pve_{kvm,lxc}.firewall and defaults/main/firewall.yml).
+    kind: str 'vm' or 'cluster'.
+    compact: bool True to collapse and dedupe IPSET entries.
+    compaction: list of dict IPSET compaction report from the last render.
+  '''
+  # Option name, default value and format for each firewall kind.
+  _options = {
+    'vm': [
+      ('enable', False, 'bool'),
+      ('dhcp', True, 'bool'),
+      ('ipfilter', False, 'bool'),
+      ('log_level_in', 'nolog', 'lower'),
+      ('log_level_out', 'nolog', 'lower'),
+      ('macfilter', True, 'bool'),
+      ('ndp', True, 'bool'),
+      ('policy_in', 'DROP', 'upper'),
+      ('policy_out', 'ACCEPT', 'upper'),
+      ('radv', False, 'bool'),
+    ],
+    'cluster': [
+      ('ebtables', True, 'bool'),
+      ('enable', True, 'bool'),
+      ('policy_in', 'ACCEPT', 'upper'),
+      ('policy_out', 'ACCEPT', 'upper'),
+      ('log_ratelimit', {}, 'ratelimit'),
+    ],
+  }
+  # Rule key, rule option flag.
+  _rule_options = [
+    ('source', '-source'),
+    ('sport', '-sport'),
+    ('dest', '-dest'),
+    ('dport', '-dport'),
+    ('proto', '-p'),
+    ('log', '-log'),
+    ('icmp_type', '-icmp-type'),
+    ('iface', '-i'),
+  ]
+
+  def __init__(self, firewall, kind='vm', compact=False):
+    '''Initialize PveFirewall.
+
+    Args
+      firewall: dict firewall definition. Empty for defaults.
+      kind: str 'vm' or 'cluster'. Default: 'vm'.
+      compact: bool True to collapse and dedupe IPSET entries. Default: False.
+
+    Raises
+      ValueError if kind is unknown.
+    '''
+    if kind not in self._options:
+      raise ValueError(f'unknown firewall kind: {kind}')
+    self.firewall = firewall or {}
+    self.kind = kind
+    self.compact = compact
+    self.compaction = []
+
+  @staticmethod
+  def _Bool(value):
+    '''Return int 1/0 for a boolean-like value.'''
+    if isinstance(value, str):
+      return int(value.strip().lower() in ('1', 'true', 'yes', 'on'))
+    return int(bool(value))
+
+  @staticmethod
+  def _Comment(text, comment):
+    '''Return str text with comment appended, if any.'''
+    if comment:
+      return f'{text} # {comment}'
+    return text
+
+  def _Option(self, key, default, format):
+    '''Return str formatted option line.'''
+    value = self.firewall.get(key, default)
+    if format == 'bool':
+      value = self._Bool(value)
+    elif format == 'lower':
+      value = str(value).lower()
+    elif format == 'upper':
+      value = str(value).upper()
+    elif format == 'ratelimit':
+      value = (f'burst={int(value.get("burst", 5))},'
+               f'enable={self._Bool(value.get("enable", True))},'
+               f'rate={value.get("rate", "1/second")}')
+    return f'{key}: {value}'
+
+  def Rule(self, rule):
+    '''Return str firewall rule line.
+
+    Args
+      rule: dict rule definition.
+      {
+        'direction': 'IN',
+        'action': 'ACCEPT',
+        'proto': 'tcp',
+        'dport': '22',
+        'comment': 'ssh',
+      }
+
+    Returns
+      str rule, e.g. 'IN ACCEPT -dport 22 -p tcp # ssh'.
+    '''
+    action = rule.get('action', 'ACCEPT')
+    parts = [str(rule.get('direction', 'in')).upper()]
+    if not PveFirewall._Bool(rule.get('enable', True)):
+      # Disabled rules are prefixed with '|'.
+      parts[0] = f'|{parts[0]}'
+    parts.append(f'{rule["macro"]}({action})' if rule.get('macro') else action)
+    for key, flag in self._rule_options:
+      if key in rule:
+        parts += [flag, str(rule[key]).lower() if key == 'log' else str(rule[key])]
+    return self._Comment(' '.join(parts), rule.get('comment'))
+
+  def _IpSet(self, ipset):
+    '''Return list of str lines for an IPSET section.'''
+    lines = [self._Comment(f'[IPSET {ipset["name"]}]', ipset.get('comment')), '']
+    hosts = ipset.get('hosts', [])
+    if self.compact:
+      hosts, stats = CompactHosts(hosts)
+      self.compaction.append(dict(name=ipset['name'], **stats))
+    for host in hosts:
+      if isinstance(host, dict):
+        lines.append(self._Comment(host['ip'], host.get('comment')))
+      else:
+        lines.append(str(host))
+    return lines + ['']
+
+  def Lines(self):
+    '''Return list of str firewall file lines.'''
+    self.compaction = []
+    lines = ['[OPTIONS]', '']
+    lines += [self._Option(*x) for x in self._options[self.kind]]
+    lines.append('')
+
+    rules = self.firewall.get('rules', [])
+    ipsets = []
+    for ipset in self.firewall.get('ipset', []):
+      ipsets += self._IpSet(ipset)
+    if rules:
+      rules = ['[RULES]', ''] + [self.Rule(x) for x in rules] + ['']
+
+    # Cluster IPSETs are listed before rules, VM IPSETs after.
+    if self.kind == 'cluster':
+      lines += ipsets + rules
+    else:
+      lines += rules + ipsets
+
+    aliases = self.firewall.get('ip_aliases', [])
+    if aliases:
+      lines += ['[ALIASES]', '']
+      lines += [self._Comment(f'{x["name"]} {x["ip"]}', x.get('comment')) for x in aliases]
+      lines.append('')
+
+    for group in self.firewall.get('group_rules', []):
+      lines += [self._Comment(f'[GROUP {group["name"]}]', group.get('comment')), '']
+      lines += [self.Rule(x) for x in group.get('rules', [])]
+      lines.append('')
+    return lines
+
+  def Text(self):
+    '''Return str firewall file contents.'''
+    return '\n'.join(self.Lines()).rstrip('\n') + '\n'
+
+
+def CompactHosts(hosts):
+  '''Collapse adjacent and overlapping IPSET entries and remove duplicates.
+
+  IPv4 and IPv6 addresses/networks are collapsed separately. Entries that are
+  not addresses (IP aliases, nomatch '!' entries) are deduplicated and kept
+  as given. A comment is kept if all commented entries collapsed into a
+  network share it.
+
+  Args
+    hosts: list of str or dict {ip, comment} IPSET entries.
+
+  Returns
+    tuple (list of dict {ip, comment} entries, dict {before int, after int}).
+  '''
+  networks = {4: {}, 6: {}}
+  verbatim = {}
+  for host in hosts:
+    if isinstance(host, dict):
+      ip, comment = str(host['ip']).strip(), host.get('comment')
+    else:
+      ip, comment = str(host).strip(), None
+    try:
+      network = ipaddress.ip_network(ip, strict=False)
+    except ValueError:
+      if not verbatim.get(ip):
+        verbatim[ip] = comment
+      continue
+    comments = networks[network.version].setdefault(network, set())
+    if comment:
+      comments.add(comment)
+
+  compacted = []
+  for version in (4, 6):
+    # Collapsed networks are sorted and disjoint; each sorted source network
+    # falls in exactly one, so comments are attributed in a single pass.
+    sources = sorted(networks[version])
+    index = 0
+    for network in ipaddress.collapse_addresses(sources):
+      comments = set()
+      while index < len(sources) and sources[index].subnet_of(network):
+        comments |= networks[version][sources[index]]
+        index += 1
+      if network.prefixlen == network.max_prefixlen:
+        host = {'ip': str(network.network_address)}
+      else:
+        host = {'ip': str(network)}
+      if len(comments) == 1:
+        host['comment'] = comments.pop()
+      compacted.append(host)
+
+  for ip, comment in verbatim.items():
+    compacted.append({'ip': ip, 'comment': comment} if comment else {'ip': ip})
+  return compacted, {'before': len(hosts), 'after': len(compacted)}
+
+
+def Apply(firewall, path, kind='vm', check_mode=False, compact=False):
+  '''Write firewall file if it differs semantically from the existing file.
+
+  Both firewalls are parsed (see parsers.PveFirewallConfig) and compared
+  section by section. pmxcfs does not support atomic moves; the file is
+  written in place.
+
+  Args
+    firewall: dict firewall definition.
+    path: str firewall file path.
+    kind: str 'vm' or 'cluster'. Default: 'vm'.
+    check_mode: bool True to report changes without writing. Default: False.
+    compact: bool True to collapse and dedupe IPSET entries. Default: False.
+
+  Returns
+    dict {changed bool, changes list, before str, after str, compaction dict}.
+    {
+      'changed': True,
+      'changes': ['ipset trusted', 'rules'],
+      'before': '...',
+      'after': '...',
+      'compaction': {
+        'before': 1200,
+        'after': 310,
+        'ipsets': [{'name': 'trusted', 'before': 1200, 'after': 310}],
+      },
+    }
+  '''
+  render = PveFirewall(firewall, kind, compact)
+  after = render.Text()
+  compaction = {
+    'before': sum([x['before'] for x in render.compaction]),
+    'after': sum([x['after'] for x in render.compaction]),
+    'ipsets': render.compaction,
+  }
+  before = ''
+  if os.path.exists(path):
+    with open(path) as f:
+      before = f.read()
+
+  try:
+    changes = parsers.PveFirewallConfig(after).Diff(parsers.PveFirewallConfig(before))
+  except ValueError:
+    # Unparsable existing firewalls are replaced.
+    changes = ['file']
+  if not before:
+    changes = ['file']
+  changed = len(changes) > 0
+  if changed and not check_mode:
+    with open(path, 'w') as f:
+      f.write(after)
+  return {'changed': changed, 'changes': changes, 'before': before, 'after': after, 'compaction': compaction}
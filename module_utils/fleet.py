@@ -0,0 +1,291 @@
+#!/usr/bin/python
+#
+# SQLite index of parsed VM configs for fleet-wide queries ("which VMs use
+# storage X", "which containers bind-mount /dev/nvidia*", "total disk per
+# storage") without re-parsing every host_var with PveConfig.
+#
+# Each config option is stored as one row per primary option:
+#
+#   scsi0: local-lvm:vm-100-disk-0,size=4G
+#
+#   vmid  line  key    sub_key  value                    type
+#   100   0     scsi0  file     local-lvm:vm-100-disk-0  DISK
+#   100   0     scsi0  size     4G                       DISK
+#
+# Options without a sub-key (memory: 2048), comments and LXC extensions use
+# an empty sub_key. VMs are re-parsed only when their config hash changes.
+#
+# Usage (from module_utils):
+#
+#   ansible-inventory --list | python3 fleet.py index --db fleet.db
+#   python3 fleet.py vms --db fleet.db --key 'mp*' --value '/dev/nvidia*'
+#   python3 fleet.py vms --db fleet.db --storage local-lvm
+#   python3 fleet.py storage --db fleet.db
+#   python3 fleet.py sql --db fleet.db 'SELECT node, count(*) FROM vms GROUP BY node'
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://www.sqlite.org/lang_createindex.html
+# * https://www.sqlite.org/optoverview.html#the_like_optimization
+# * https://docs.ansible.com/ansible/latest/cli/ansible-inventory.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import argparse
+import hashlib
+import json
+import sqlite3
+import sys
+
+try:
+  from ansible.module_utils import parsers
+except:
+  import parsers
+
+# Inventory variable defining a VM, per VM type.
+KINDS = {'kvm': 'pve_kvm', 'lxc': 'pve_lxc'}
+
+_schema = '''
+CREATE TABLE IF NOT EXISTS vms (
+  vmid INTEGER PRIMARY KEY,
+  host TEXT NOT NULL,
+  node TEXT NOT NULL,
+  kind TEXT NOT NULL,
+  hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS tokens (
+  vmid INTEGER NOT NULL,
+  line INTEGER NOT NULL,
+  key TEXT NOT NULL,
+  sub_key TEXT NOT NULL,
+  value TEXT NOT NULL,
+  type TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vms_node ON vms (node, kind);
+CREATE INDEX IF NOT EXISTS tokens_vmid ON tokens (vmid, line);
+CREATE INDEX IF NOT EXISTS tokens_key ON tokens (key, sub_key, value, vmid);
+CREATE INDEX IF NOT EXISTS tokens_sub_key ON tokens (sub_key, value, vmid);
+CREATE INDEX IF NOT EXISTS tokens_value ON tokens (value, vmid);
+'''
+
+
+def Hash(host, kind, vm):
+  '''Return str sha1 of the VM definition fields the index is built from.'''
+  fields = {x: vm.get(x) for x in ('vmid', 'node', 'config', 'idmap_passthrough')}
+  return hashlib.sha1(json.dumps([host, kind, fields], sort_keys=True, default=str).encode()).hexdigest()
+
+
+def Tokens(vm):
+  '''Return list of tuple (line, key, sub_key, value, type) for a VM config.
+
+  Args
+    vm: dict VM definition (pve_kvm/pve_lxc); see PveConfig.
+
+  Raises
+    Exception inherited from PveConfig.
+  '''
+  tokens = []
+  for line, token in enumerate(parsers.PveConfig(vm).tokens):
+    for option in token.value:
+      tokens.append((line, token.key or '', option.key or '', str(option.value), token.type.name))
+  return tokens
+
+
+def Inventory(hostvars):
+  '''Return list of dict {host, kind, vm} for hosts defining VMs.
+
+  Args
+    hostvars: mapping of str host name to mapping of host variables.
+  '''
+  vms = []
+  for host in hostvars:
+    host_vars = hostvars[host]
+    for kind, var in KINDS.items():
+      if var in host_vars:
+        vms.append({'host': host, 'kind': kind, 'vm': dict(host_vars[var])})
+  return vms
+
+
+class Fleet(object):
+  '''SQLite index of parsed VM config tokens.
+
+  Attributes
+    path: str SQLite database path.
+    db: sqlite3.Connection.
+  '''
+
+  def __init__(self, path, readonly=False):
+    '''Open (and create) the index.
+
+    Args
+      path: str SQLite database path.
+      readonly: bool True to open an existing index read-only.
+
+    Raises
+      sqlite3.Error if the database cannot be opened.
+    '''
+    self.path = path
+    if readonly:
+      self.db = sqlite3.connect(f'file:{path}?mode=ro', uri=True)
+    else:
+      self.db = sqlite3.connect(path)
+      self.db.execute('PRAGMA journal_mode=WAL')
+      self.db.executescript(_schema)
+    self.db.row_factory = sqlite3.Row
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def Close(self):
+    self.db.close()
+
+  def Update(self, vms, prune=False):
+    '''Index VMs whose definition changed since they were last indexed.
+
+    Args
+      vms: list of dict {host, kind, vm}; see Inventory.
+      prune: bool True to remove indexed VMs not in vms (vms is the whole
+          fleet).
+
+    Returns
+      dict VMIDs {added, updated, unchanged, removed}.
+
+    Raises
+      ValueError for duplicate VMIDs or configs that fail to parse.
+    '''
+    hashes = {x['vmid']: x['hash'] for x in self.db.execute('SELECT vmid, hash FROM vms')}
+    result = {'added': [], 'updated': [], 'unchanged': [], 'removed': []}
+    hosts = {}
+    rows = []
+    for item in vms:
+      vm = item['vm']
+      vmid = int(vm['vmid'])
+      if vmid in hosts:
+        raise ValueError(f'duplicate VMID {vmid}: {hosts[vmid]}, {item["host"]}')
+      hosts[vmid] = item['host']
+      digest = Hash(item['host'], item['kind'], vm)
+      if hashes.get(vmid) == digest:
+        result['unchanged'].append(vmid)
+        continue
+      try:
+        tokens = Tokens(vm)
+      except Exception as e:
+        raise ValueError(f'unable to parse {item["host"]} ({vmid}): {e}')
+      result['updated' if vmid in hashes else 'added'].append(vmid)
+      rows.append(((vmid, item['host'], vm['node'], item['kind'], digest), [(vmid,) + x for x in tokens]))
+
+    if prune:
+      result['removed'] = sorted(set(hashes) - set(hosts))
+    with self.db:
+      for vmid in result['updated'] + result['removed']:
+        self.db.execute('DELETE FROM tokens WHERE vmid = ?', (vmid,))
+      self.db.executemany('DELETE FROM vms WHERE vmid = ?', [(x,) for x in result['removed']])
+      for vm, tokens in rows:
+        self.db.execute('INSERT OR REPLACE INTO vms (vmid, host, node, kind, hash) VALUES (?, ?, ?, ?, ?)', vm)
+        self.db.executemany('INSERT INTO tokens (vmid, line, key, sub_key, value, type) VALUES (?, ?, ?, ?, ?, ?)', tokens)
+    for key in result:
+      result[key].sort()
+    return result
+
+  def Query(self, sql, params=()):
+    '''Return list of dict rows for an SQL query.'''
+    return [dict(x) for x in self.db.execute(sql, params)]
+
+  def Vms(self, key=None, sub_key=None, value=None, storage=None, node=None, kind=None):
+    '''Return list of dict {vmid, host, node, kind} for matching VMs.
+
+    key, sub_key and value are GLOB patterns ('mp*', '/dev/nvidia*') matched
+    against the same option row; prefix patterns use the token indexes.
+
+    Args
+      key: str option key pattern ('scsi0', 'mp*', 'lxc.mount.entry').
+      sub_key: str sub-key pattern ('file', 'bridge'); '' for options without
+          one.
+      value: str option value pattern.
+      storage: str storage a disk, rootfs or mountpoint volume is on.
+      node: str cluster node (FQDN or short name).
+      kind: str VM type, 'kvm' or 'lxc'.
+    '''
+    sql = 'SELECT vmid, host, node, kind FROM vms v WHERE 1'
+    params = []
+    if node:
+      short = node.split('.')[0]
+      sql += ' AND (node = ? OR node = ? OR node GLOB ?)'
+      params += [node, short, f'{short}.*']
+    if kind:
+      sql += ' AND kind = ?'
+      params.append(kind)
+    filters = {x: y for x, y in (('key', key), ('sub_key', sub_key), ('value', value)) if y is not None}
+    if filters:
+      sql += ' AND vmid IN (SELECT vmid FROM tokens WHERE ' + ' AND '.join([f'{x} GLOB ?' for x in filters]) + ')'
+      params += list(filters.values())
+    if storage:
+      sql += " AND vmid IN (SELECT vmid FROM tokens WHERE sub_key IN ('file', 'volume') AND value GLOB ?)"
+      params.append(f'{storage}:*')
+    return self.Query(sql + ' ORDER BY node, vmid', params)
+
+  def Storage(self):
+    '''Return dict of str storage to dict {disks, bytes} allocated.
+
+    Counts disks, rootfs and mountpoint volumes with a size; bind mounts and
+    ISOs (no size) are not counted.
+    '''
+    rows = self.db.execute('''
+      SELECT f.value AS volume, s.value AS size FROM tokens f
+      JOIN tokens s ON s.vmid = f.vmid AND s.line = f.line AND s.sub_key = 'size'
+      WHERE f.sub_key IN ('file', 'volume') AND f.type IN ('DISK', 'ROOTFS', 'MP')
+    ''')
+    storage = {}
+    for row in rows:
+      if ':' not in row['volume']:
+        continue
+      usage = storage.setdefault(row['volume'].split(':', 1)[0], {'disks': 0, 'bytes': 0})
+      usage['disks'] += 1
+      usage['bytes'] += parsers.Bytes(row['size'])
+    return dict(sorted(storage.items()))
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='SQLite index of parsed VM configs.')
+  parser.add_argument('--db', default='fleet.db', help='SQLite index path')
+  commands = parser.add_subparsers(dest='command', required=True)
+  index = commands.add_parser('index', help='index VMs from ansible-inventory --list JSON')
+  index.add_argument('--inventory', default='-', help="ansible-inventory --list JSON file; '-' for stdin")
+  vms = commands.add_parser('vms', help='list VMs with a matching config option')
+  for option in ('key', 'sub-key', 'value'):
+    vms.add_argument(f'--{option}', help=f'option {option} GLOB pattern')
+  vms.add_argument('--storage', help='storage a disk is on')
+  vms.add_argument('--node', help='cluster node')
+  vms.add_argument('--kind', choices=sorted(KINDS), help='VM type')
+  commands.add_parser('storage', help='disks and bytes allocated per storage')
+  sql = commands.add_parser('sql', help='run a read-only SQL query')
+  sql.add_argument('query', help='SQL query')
+  args = parser.parse_args(argv)
+
+  if args.command == 'index':
+    if args.inventory == '-':
+      inventory = json.load(sys.stdin)
+    else:
+      with open(args.inventory) as f:
+        inventory = json.load(f)
+    with Fleet(args.db) as fleet:
+      result = fleet.Update(Inventory(inventory.get('_meta', {}).get('hostvars', {})), prune=True)
+    print(json.dumps({k: len(v) for k, v in result.items()}))
+    return
+
+  with Fleet(args.db, readonly=True) as fleet:
+    if args.command == 'vms':
+      result = fleet.Vms(args.key, args.sub_key, args.value, args.storage, args.node, args.kind)
+    elif args.command == 'storage':
+      result = fleet.Storage()
+    else:
+      result = fleet.Query(args.query)
+  print(json.dumps(result, indent=2))
+
+
+if __name__ == '__main__':
+  main()
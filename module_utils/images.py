@@ -0,0 +1,470 @@
+#!/usr/bin/python
+#
+# Content-addressed cloud init image cache. Each distinct image (keyed by
+# ImageMap checksum) required by the fleet is downloaded once to a seed cluster
+# node, verified, and copied node to node over the cluster network. A checksum
+# sidecar (size, mtime, algorithm, digest) written after verification lets
+# later runs skip the download, and re-hashing unless the image changed.
+#
+# tar.xz cloud images are decompressed with multithreaded xz (when available)
+# and the disk member streamed sparsely to its final path.
+#
+# pve_image and pve_image_extract import this module for each VM. Modules only
+# needed to download, extract or copy images (urllib.request and
+# concurrent.futures import logging, tokenize and ipaddress) are imported by
+# the functions using them to keep per-VM module cold start low.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/wiki/Cloud-Init_Support
+# * https://pve.proxmox.com/pve-docs/chapter-pvecm.html#pvecm_cluster_network
+# * https://docs.python.org/3/library/hashlib.html
+# * https://docs.python.org/3/library/tarfile.html
+# * https://man7.org/linux/man-pages/man1/xz.1.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import hashlib
+import json
+import os
+import shlex
+import shutil
+
+try:
+  from ansible.module_utils import data
+  from ansible.module_utils import files
+  from ansible.module_utils import node
+except:
+  import data
+  import files
+  import node
+
+
+CHUNK = 16 * 1024 * 1024
+
+
+def Sidecar(path):
+  '''Return str checksum sidecar path for an image.'''
+  return f'{path}.checksum'
+
+
+def ReadSidecar(path):
+  '''Return dict sidecar contents for an image, or {} if missing/invalid.'''
+  try:
+    with open(Sidecar(path)) as f:
+      sidecar = json.load(f)
+  except (OSError, ValueError):
+    return {}
+  return sidecar if isinstance(sidecar, dict) else {}
+
+
+def WriteSidecar(path, algorithm, digest):
+  '''Record a verified image digest in the image sidecar.
+
+  The image size and mtime (seconds; preserved by scp -p and rsync) are
+  recorded so later runs can trust the digest without re-hashing.
+
+  Args
+    path: str image path.
+    algorithm: str hashlib algorithm name.
+    digest: str hex digest of the image.
+  '''
+  stat = os.stat(path)
+  sidecar = {'size': stat.st_size, 'mtime': int(stat.st_mtime), 'algorithm': algorithm, 'digest': digest}
+  files.WriteAtomic(Sidecar(path), json.dumps(sidecar))
+
+
+def Hash(path, algorithm, chunk=CHUNK):
+  '''Return str hex digest of a file, read in large chunks.
+
+  Args
+    path: str file path.
+    algorithm: str hashlib algorithm name.
+    chunk: int bytes read per iteration.
+  '''
+  digest = hashlib.new(algorithm)
+  buffer = bytearray(chunk)
+  view = memoryview(buffer)
+  with open(path, 'rb', buffering=0) as f:
+    for size in iter(lambda: f.readinto(buffer), 0):
+      digest.update(view[:size])
+  return digest.hexdigest()
+
+
+def Verify(path, template, chunk=CHUNK):
+  '''Verify an image against its template checksum.
+
+  A sidecar matching the template checksum, image size and mtime is trusted
+  without reading the image. Otherwise the image is hashed and the sidecar
+  rewritten if it matches. Truncated or modified images fail verification.
+
+  Args
+    path: str image path.
+    template: dict data.ImageMap options.
+    chunk: int bytes read per iteration when hashing.
+
+  Returns
+    str status:
+      'missing': image does not exist.
+      'trusted': sidecar matches; image not read.
+      'verified': image hashed and matches checksum; sidecar written.
+      'unverified': template has no checksum and no valid sidecar exists.
+      'invalid': image does not match checksum.
+  '''
+  try:
+    stat = os.stat(path)
+  except FileNotFoundError:
+    return 'missing'
+
+  sidecar = ReadSidecar(path)
+  unchanged = sidecar.get('size') == stat.st_size and sidecar.get('mtime') == int(stat.st_mtime)
+  if not template['checksum']:
+    return 'trusted' if unchanged else 'unverified'
+  if unchanged and sidecar.get('algorithm') == template['algorithm'] and sidecar.get('digest') == template['checksum']:
+    return 'trusted'
+
+  if Hash(path, template['algorithm'], chunk) != template['checksum']:
+    return 'invalid'
+  WriteSidecar(path, template['algorithm'], template['checksum'])
+  return 'verified'
+
+
+def Cached(path, template):
+  '''Return bool True if the image exists and passes verification.
+
+  Args
+    path: str image path.
+    template: dict data.ImageMap options.
+  '''
+  return Verify(path, template) in ('trusted', 'verified')
+
+
+def Download(template, path, timeout=120, chunk=CHUNK):
+  '''Download and verify an image, then write its sidecar.
+
+  The image is streamed to a temporary file in the destination directory and
+  hashed while downloading; it is only moved into place if the checksum
+  matches.
+
+  Args
+    template: dict data.ImageMap options.
+    path: str destination image path.
+    timeout: int seconds before the connection is considered failed.
+    chunk: int bytes read per iteration.
+
+  Returns
+    str hex digest of the image.
+
+  Raises
+    ValueError if the downloaded image does not match the checksum.
+    OSError/URLError on download failure.
+  '''
+  import urllib.request
+  digest = hashlib.new(template['algorithm'] or 'sha256')
+  with files.OpenAtomic(path, 'wb') as f, urllib.request.urlopen(template['url'], timeout=timeout) as response:
+    for block in iter(lambda: response.read(chunk), b''):
+      digest.update(block)
+      f.write(block)
+    if template['checksum'] and digest.hexdigest() != template['checksum']:
+      raise ValueError(f'{template["file"]} checksum mismatch: expected {template["checksum"]}, got {digest.hexdigest()}')
+  WriteSidecar(path, digest.name, digest.hexdigest())
+  return digest.hexdigest()
+
+
+def Ensure(path, template, timeout=120):
+  '''Verify an image, downloading it if missing or invalid.
+
+  Args
+    path: str image path.
+    template: dict data.ImageMap options.
+    timeout: int seconds before the connection is considered failed.
+
+  Returns
+    str status; see Verify(). 'downloaded' if the image was (re)downloaded.
+
+  Raises
+    ValueError if the downloaded image does not match the checksum.
+    OSError/URLError on download failure.
+  '''
+  status = Verify(path, template)
+  if status in ('missing', 'invalid'):
+    Download(template, path, timeout)
+    return 'downloaded'
+  return status
+
+
+def _XzCommand(archive, threads=0):
+  '''Return list xz decompression command, or None if xz is unavailable.
+
+  xz 5.4+ decompresses multithreaded with -T; older versions ignore it.
+  '''
+  xz = shutil.which('xz')
+  if not xz:
+    return None
+  return [xz, '--decompress', '--stdout', f'--threads={threads}', archive]
+
+
+def _WriteSparse(source, f, block=64 * 1024, chunk=CHUNK):
+  '''Copy a file object, seeking over zero blocks to leave holes.
+
+  Args
+    source: file object to read.
+    f: binary file object to write.
+    block: int hole detection granularity in bytes.
+    chunk: int bytes read per iteration.
+
+  Returns
+    int bytes copied.
+  '''
+  zero = bytes(block)
+  size = 0
+  for data in iter(lambda: source.read(chunk), b''):
+    view = memoryview(data)
+    for offset in range(0, len(data), block):
+      part = view[offset:offset + block]
+      if part == zero[:len(part)]:
+        f.seek(len(part), os.SEEK_CUR)
+      else:
+        f.write(part)
+    size += len(data)
+  f.truncate(size)
+  return size
+
+
+def Extract(archive, member, dest, threads=0, use_xz=True):
+  '''Stream a member of a tar.xz archive sparsely to its final path.
+
+  The archive is decompressed by xz (multithreaded) when available, falling
+  back to in-process lzma. The tar stream is read sequentially and the member
+  written directly to a temporary file beside dest (zero blocks are left as
+  holes) which is renamed into place; no intermediate copy is made.
+
+  Args
+    archive: str tar.xz path.
+    member: str member name, e.g. 'disk.raw'. Leading './' is ignored.
+    dest: str final path for the member.
+    threads: int xz decompression threads; 0 uses all cores. Default: 0.
+    use_xz: bool False to force in-process lzma decompression. Default: True.
+
+  Returns
+    int bytes extracted.
+
+  Raises
+    ValueError if member is not in the archive.
+    OSError if decompression fails.
+  '''
+  import lzma
+  import subprocess
+  import tarfile
+  cmd = _XzCommand(archive, threads) if use_xz else None
+  proc = None
+  if cmd:
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stream = proc.stdout
+  else:
+    stream = lzma.open(archive)
+
+  size = None
+  try:
+    with files.OpenAtomic(dest, 'wb') as f:
+      with tarfile.open(fileobj=stream, mode='r|') as tar:
+        for info in tar:
+          if info.isfile() and os.path.normpath(info.name) == os.path.normpath(member):
+            size = _WriteSparse(tar.extractfile(info), f)
+            break
+      if proc:
+        # Drain trailing archive data so xz exits cleanly (cloud images
+        # contain only the disk), then check for decompression errors.
+        for _ in iter(lambda: stream.read(CHUNK), b''):
+          pass
+        if proc.wait():
+          raise OSError(f'xz failed ({proc.returncode}): {proc.stderr.read().decode().strip()}')
+      if size is None:
+        raise ValueError(f'{member} not found in {archive}')
+  except BaseException:
+    if proc and proc.poll() is None:
+      proc.kill()
+      proc.wait()
+    raise
+  finally:
+    stream.close()
+    if proc:
+      proc.stderr.close()
+  return size
+
+
+class ImageCache(object):
+  '''Distribute cloud init images to cluster nodes.
+
+  Images are fetched once on the node running the module (seed) and copied to
+  other nodes with scp. Cluster nodes share root SSH keys.
+
+  Attributes
+    cache: str image cache directory on all nodes.
+    node: str cluster node running the module (seed).
+    max_workers: int maximum concurrent node copies.
+    timeout: int seconds before a download is considered failed.
+  '''
+
+  def __init__(self, cache, node_name, max_workers=4, timeout=120, run=node.Run):
+    '''Initialize ImageCache.
+
+    Args
+      cache: str image cache directory on all nodes.
+      node_name: str cluster node running the module (seed).
+      max_workers: int maximum concurrent node copies. Default: 4.
+      timeout: int seconds before a download is considered failed.
+          Default: 120.
+      run: callable executing node commands. Default: node.Run.
+    '''
+    self.cache = cache
+    self.node = node_name
+    self.max_workers = max_workers
+    self.timeout = timeout
+    self._run = run
+
+  @staticmethod
+  def Plan(vms, image_map, existing=()):
+    '''Return distinct images required by VMs, keyed by checksum.
+
+    Args
+      vms: list of dict pve_kvm host definitions {vmid, node, template,
+          cloud_init}. VMs without cloud_init are ignored.
+      image_map: dict pve_image_map.
+      existing: list of int VMIDs which already exist (image not needed).
+
+    Returns
+      list of dict {key str, template dict, files list, nodes list} in first
+      seen order.
+      [
+        {
+          'key': 'cf93...',
+          'template': {'url': ..., 'checksum': ..., 'algorithm': ..., 'file': ...},
+          'files': ['debian-11-genericcloud-amd64.qcow2'],
+          'nodes': ['pm1.example.com', 'pm2.example.com'],
+        },
+      ]
+    '''
+    existing = set([int(x) for x in existing])
+    plan = {}
+    for vm in vms:
+      if not vm.get('cloud_init') or not vm.get('template') or int(vm['vmid']) in existing:
+        continue
+      template = data.ImageMap(**image_map[vm['template']]).AsDict()
+      image = plan.setdefault(template['checksum'] or template['url'], {
+          'key': template['checksum'] or template['url'],
+          'template': template,
+          'files': [],
+          'nodes': [],
+      })
+      if template['file'] not in image['files']:
+        image['files'].append(template['file'])
+      if vm['node'] not in image['nodes']:
+        image['nodes'].append(vm['node'])
+    return list(plan.values())
+
+  def _Path(self, file):
+    return os.path.join(self.cache, file)
+
+  def _Seed(self, image):
+    '''Ensure all image files exist and are verified on the seed node.
+
+    Returns
+      str 'cached' or 'downloaded'.
+    '''
+    template = image['template']
+    first = self._Path(image['files'][0])
+    status = 'cached'
+    ensured = Ensure(first, template, self.timeout)
+    if ensured == 'downloaded':
+      status = 'downloaded'
+    elif ensured == 'unverified':
+      # Images without a template checksum: record the digest for copies. The
+      # sidecar is missing or was written for different image content.
+      WriteSidecar(first, 'sha256', Hash(first, 'sha256'))
+    digest = ReadSidecar(first).get('digest')
+    # Same content published under different names is linked, not fetched.
+    for file in image['files'][1:]:
+      path = self._Path(file)
+      if ReadSidecar(path).get('digest') != digest or not Cached(path, template):
+        if os.path.exists(path):
+          os.remove(path)
+        try:
+          os.link(first, path)
+        except OSError:
+          shutil.copy2(first, path)
+        shutil.copy2(Sidecar(first), Sidecar(path))
+    return status
+
+  def _Ssh(self, node_name, command, ok_rc=(0,)):
+    return self._run(['ssh', '-o', 'BatchMode=yes', f'root@{node_name}', command], ok_rc=ok_rc)
+
+  def _Copy(self, image, node_name):
+    '''Copy image files missing on a node from the seed node.
+
+    A node image is only trusted if its sidecar matches the seed digest and
+    the image exists with the size and mtime recorded in the sidecar (scp
+    preserves mtime); otherwise it is copied again.
+
+    Returns
+      dict {node str, copied list, failed bool, msg str}.
+    '''
+    result = {'node': node_name, 'copied': [], 'failed': False, 'msg': ''}
+    for file in image['files']:
+      path = self._Path(file)
+      expected = ReadSidecar(path)
+      check = self._Ssh(node_name, (
+          f'mkdir -p {shlex.quote(self.cache)} && stat -c "%s %Y" {shlex.quote(path)} && '
+          f'cat {shlex.quote(Sidecar(path))}'), ok_rc=(0, 1))
+      if not check.ok:
+        result.update(failed=True, msg=check.stderr.strip())
+        return result
+      try:
+        stat, sidecar = check.stdout.split('\n', 1) if check.rc == 0 else ('', '{}')
+        size, mtime = [int(x) for x in stat.split()] if stat else (None, None)
+        remote = json.loads(sidecar)
+      except ValueError:
+        size, mtime, remote = None, None, {}
+      if (isinstance(remote, dict) and all([remote.get(x) == expected[x] for x in ('algorithm', 'digest')]) and
+          size is not None and remote.get('size') == size and remote.get('mtime') == mtime):
+        continue
+      # Sidecar is copied last so an interrupted copy is never trusted.
+      for src in (path, Sidecar(path)):
+        copy = self._run(['scp', '-B', '-p', '-o', 'BatchMode=yes', src, f'root@{node_name}:{self.cache}/'])
+        if not copy.ok:
+          result.update(failed=True, msg=copy.stderr.strip())
+          return result
+      result['copied'].append(file)
+    return result
+
+  def Apply(self, vms, image_map, existing=()):
+    '''Download distinct images once and copy them to nodes which need them.
+
+    Args
+      vms: list of dict pve_kvm host definitions. See Plan().
+      image_map: dict pve_image_map.
+      existing: list of int VMIDs which already exist.
+
+    Returns
+      list of dict {key, files, status, nodes, failed, msg} per image.
+    '''
+    from concurrent.futures import ThreadPoolExecutor
+    results = []
+    os.makedirs(self.cache, exist_ok=True)
+    for image in self.Plan(vms, image_map, existing):
+      result = {'key': image['key'], 'files': image['files'], 'status': '', 'nodes': [], 'failed': False, 'msg': ''}
+      results.append(result)
+      try:
+        result['status'] = self._Seed(image)
+      except Exception as e:
+        result.update(failed=True, msg=str(e))
+        continue
+
+      peers = [x for x in image['nodes'] if x != self.node]
+      with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+        result['nodes'] = list(executor.map(lambda x: self._Copy(image, x), peers))
+      failed = [x for x in result['nodes'] if x['failed']]
+      if failed:
+        result.update(failed=True, msg='; '.join([f'{x["node"]}: {x["msg"]}' for x in failed]))
+    return results
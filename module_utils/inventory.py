@@ -0,0 +1,63 @@
+#!/usr/bin/python
+#
+# Index of inventory hosts defining PVE VMs ('pve_kvm' or 'pve_lxc'), sorted
+# (grouped) by cluster node and VMID. Only the VM definition variable of each
+# host is read, so templating every variable of every inventory host is
+# avoided. Used by the pve_inventory lookup plugin.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/user_guide/playbooks_reuse_roles.html#embedding-modules-and-plugins-in-roles
+# * https://docs.ansible.com/ansible/latest/plugins/lookup.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+KINDS = {'kvm': 'pve_kvm', 'lxc': 'pve_lxc'}
+
+
+def Index(hosts, kind, node=None, placement=None):
+  '''Return list of index items for hosts defining a VM type.
+
+  Items keep the 'key'/'value' shape of dict2items so tasks can use
+  'host.value.pve_kvm'.
+
+  Args
+    hosts: mapping of str host name to mapping of host variables (hostvars).
+        Only the VM definition variable is read from each host.
+    kind: str VM type, 'kvm' or 'lxc'.
+    node: str only return VMs on this cluster node (FQDN or short name).
+        Default: all nodes.
+    placement: dict of VMID to str node for VMs without 'node'.
+
+  Returns
+    list of dict {key, node, vmid, config, value} sorted by node and VMID.
+
+  Raises
+    ValueError for an unknown VM type.
+  '''
+  if kind not in KINDS:
+    raise ValueError(f'VM type must be one of {", ".join(KINDS)}: {kind}')
+
+  var = KINDS[kind]
+  placement = {int(k): v for k, v in (placement or {}).items()}
+  index = []
+  for host in hosts:
+    host_vars = hosts[host]
+    if var not in host_vars:
+      continue
+    vm = dict(host_vars[var])
+    if not vm.get('node') and int(vm.get('vmid', 0)) in placement:
+      vm['node'] = placement[int(vm.get('vmid', 0))]
+    if node and str(vm.get('node', '')).split('.')[0] != node.split('.')[0]:
+      continue
+    index.append({
+      'key': host,
+      'node': vm.get('node', ''),
+      'vmid': int(vm.get('vmid', 0)),
+      'config': vm.get('config', ''),
+      'value': {var: vm},
+    })
+  return sorted(index, key=lambda x: (x['node'], x['vmid']))
@@ -0,0 +1,285 @@
+#!/usr/bin/python
+#
+# Collect per-VM, per-phase provisioning durations and outcomes and export
+# them as a Prometheus textfile (node_exporter textfile collector) and a JSON
+# summary. Phases are derived from the role task file (and module) a task
+# belongs to; see Phase. Used by the pve_metrics callback plugin.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://prometheus.io/docs/instrumenting/exposition_formats/
+# * https://github.com/prometheus/node_exporter#textfile-collector
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import json
+import re
+
+try:
+  from ansible.module_utils import files
+  from ansible.module_utils import stats
+except:
+  import files
+  import stats
+
+# Role task file (relative to {kvm,lxc}/tasks or global_tasks) to phase.
+PHASE_FILES = {
+  'quorum': 'quorum',
+  'cluster_resources': 'status',
+  'placement': 'placement',
+  'migrate': 'migrate',
+  'config': 'parse',
+  'provision': 'config_check',
+  'create_bare_vm': 'create',
+  'create': 'create',
+  'cloud_init/image_cache': 'image_download',
+  'cloud_init/create_image': 'image_download',
+  'interfaces/create_iso': 'image_download',
+  'cloud_init/extract_image': 'extract',
+  'cloud_init/import_disk': 'import',
+  'cloud_init/linked_clone': 'import',
+  'interfaces/create_disk': 'disk_alloc',
+  'operations/rescan': 'disk_alloc',
+  'operations/resize': 'disk_resize',
+  'operations/grow': 'disk_resize',
+  'operations/shutdown': 'shutdown',
+  'operations/map_ids': 'config_write',
+  'reconfigure': 'config_write',
+  'reconfigure_queued': 'config_write',
+  'power': 'power',
+  'operations/start': 'start',
+  'node_apply': 'node_apply',
+}
+
+# Module (task action) to phase; takes precedence over the task file.
+PHASE_ACTIONS = {
+  'kvm_config': 'parse',
+  'lxc_config': 'parse',
+  'pve_image': 'image_download',
+  'pve_image_cache': 'image_download',
+  'pve_image_extract': 'extract',
+  'pve_linked_clone': 'import',
+  'pve_config_write': 'config_write',
+  'pve_disk_grow': 'config_check',
+  'pve_subid': 'config_write',
+  'pve_node_apply': 'node_apply',
+  'pve_placement': 'placement',
+  'pve_migrate': 'migrate',
+  'pve_vm_power': 'power',
+}
+
+_task_file = re.compile(r'/(?:(kvm|lxc)/tasks|global_tasks)/(.+?)\.ya?ml(?::\d+)?$')
+_vmid = re.compile(r'^\s*(\d+)\s*\|')
+
+
+def TaskFile(path):
+  '''Return tuple (str kind, str task file) for a role task path.
+
+  Args
+    path: str task path ('.../roles/pve/kvm/tasks/operations/shutdown.yml:18').
+
+  Returns
+    tuple ('kvm'|'lxc'|'global', 'operations/shutdown'), or (None, None) if
+    the task is not a role task.
+  '''
+  match = _task_file.search(path or '')
+  if not match:
+    return None, None
+  return match.group(1) or 'global', match.group(2)
+
+
+def Phase(path, action=None):
+  '''Return str provisioning phase for a task, or None if not a role task.
+
+  Args
+    path: str task path; see TaskFile.
+    action: str task module name. Optional.
+  '''
+  _, task_file = TaskFile(path)
+  if task_file is None:
+    return None
+  action = (action or '').rsplit('.', 1)[-1]
+  if action in PHASE_ACTIONS:
+    return PHASE_ACTIONS[action]
+  return PHASE_FILES.get(task_file, task_file.replace('/', '_'))
+
+
+def Vmid(task_name):
+  '''Return str VMID from a templated role task name ('100 | ...'), or ''.'''
+  match = _vmid.match(task_name or '')
+  return match.group(1) if match else ''
+
+
+def _Label(value):
+  '''Return str escaped Prometheus label value.'''
+  return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _Labels(**labels):
+  '''Return str Prometheus label set.'''
+  return ','.join([f'{k}="{_Label(v)}"' for k, v in labels.items()])
+
+
+class PhaseMetrics(object):
+  '''Per-VM, per-phase provisioning durations and outcomes.
+
+  Attributes
+    prefix: str Prometheus metric name prefix.
+    records: list of dict {vmid, node, kind, phase, duration, status}.
+  '''
+  statuses = ('ok', 'changed', 'skipped', 'failed', 'unreachable')
+
+  def __init__(self, prefix='pve_provision'):
+    '''Initialize PhaseMetrics.
+
+    Args
+      prefix: str Prometheus metric name prefix. Default: 'pve_provision'.
+    '''
+    self.prefix = prefix
+    self.records = []
+
+  def Add(self, vmid, node, kind, phase, duration, status):
+    '''Record a task.
+
+    Args
+      vmid: str VMID; '' for tasks not specific to a VM.
+      node: str cluster node the task ran on.
+      kind: str 'kvm', 'lxc' or 'global'.
+      phase: str provisioning phase; see Phase.
+      duration: float task seconds.
+      status: str task outcome; one of statuses.
+
+    Raises
+      ValueError for an unknown status.
+    '''
+    if status not in self.statuses:
+      raise ValueError(f'unknown task status: {status}')
+    self.records.append({'vmid': str(vmid), 'node': node or '', 'kind': kind or '', 'phase': phase,
+                         'duration': float(duration), 'status': status})
+
+  def Vms(self):
+    '''Return dict of str VMID to per-phase durations and outcome.
+
+    Tasks of a VM phase are summed; a phase (and VM) has failed if any task
+    failed.
+    '''
+    vms = {}
+    for record in self.records:
+      if not record['vmid']:
+        continue
+      vm = vms.setdefault(record['vmid'], {'node': record['node'], 'kind': record['kind'], 'duration': 0.0,
+                                           'status': 'ok', 'phases': {}})
+      vm['node'] = vm['node'] or record['node']
+      phase = vm['phases'].setdefault(record['phase'], {'duration': 0.0, 'tasks': 0, 'status': 'ok'})
+      phase['duration'] += record['duration']
+      phase['tasks'] += 1
+      vm['duration'] += record['duration']
+      if record['status'] in ('failed', 'unreachable'):
+        phase['status'] = vm['status'] = 'failed'
+    return vms
+
+  @staticmethod
+  def _Stats(durations, failed=0):
+    '''Return dict summary statistics for a list of durations.'''
+    return {
+      'count': len(durations),
+      'failed': failed,
+      'sum': round(sum(durations), 6),
+      'p50': round(stats.Percentile(durations, 50), 6),
+      'p99': round(stats.Percentile(durations, 99), 6),
+      'max': round(max(durations, default=0.0), 6),
+    }
+
+  def Summary(self):
+    '''Return dict JSON summary.
+
+    Phase statistics are over per-VM phase durations (fleet tasks without a
+    VM are counted per task).
+
+      {
+        'vms': {'100': {'node': 'pm1', 'kind': 'kvm', 'duration': 40.1,
+                        'status': 'ok', 'phases': {'shutdown': {...}}}},
+        'phases': {'shutdown': {'count': 1, 'failed': 0, 'sum': 12.0,
+                                'p50': 12.0, 'p99': 12.0, 'max': 12.0}},
+        'nodes': {'pm1': {'shutdown': {...}}},
+      }
+    '''
+    vms = self.Vms()
+    samples = {}
+    for vm in vms.values():
+      for phase, values in vm['phases'].items():
+        samples.setdefault((vm['node'], phase), []).append((values['duration'], values['status'] == 'failed'))
+    for record in self.records:
+      if not record['vmid']:
+        samples.setdefault((record['node'], record['phase']), []).append(
+            (record['duration'], record['status'] in ('failed', 'unreachable')))
+
+    phases = {}
+    nodes = {}
+    for (node, phase), values in sorted(samples.items()):
+      phases.setdefault(phase, []).extend(values)
+      nodes.setdefault(node, {})[phase] = self._Stats([x[0] for x in values], len([x for x in values if x[1]]))
+    return {
+      'vms': vms,
+      'phases': {k: self._Stats([x[0] for x in v], len([x for x in v if x[1]])) for k, v in sorted(phases.items())},
+      'nodes': nodes,
+    }
+
+  def Prometheus(self):
+    '''Return str metrics in Prometheus text exposition format.'''
+    p = self.prefix
+    vms = self.Vms()
+    lines = [
+      f'# HELP {p}_vm_phase_seconds Seconds spent in a provisioning phase per VM.',
+      f'# TYPE {p}_vm_phase_seconds gauge',
+    ]
+    for vmid, vm in sorted(vms.items(), key=lambda x: int(x[0])):
+      for phase, values in sorted(vm['phases'].items()):
+        labels = _Labels(vmid=vmid, node=vm['node'], kind=vm['kind'], phase=phase, status=values['status'])
+        lines.append(f'{p}_vm_phase_seconds{{{labels}}} {values["duration"]:.6f}')
+
+    lines += [
+      f'# HELP {p}_vm_failed 1 if provisioning the VM failed.',
+      f'# TYPE {p}_vm_failed gauge',
+    ]
+    for vmid, vm in sorted(vms.items(), key=lambda x: int(x[0])):
+      lines.append(f'{p}_vm_failed{{{_Labels(vmid=vmid, node=vm["node"], kind=vm["kind"])}}} {int(vm["status"] == "failed")}')
+
+    lines += [
+      f'# HELP {p}_phase_seconds Provisioning phase seconds per VM by node.',
+      f'# TYPE {p}_phase_seconds summary',
+    ]
+    for node, phases in sorted(self.Summary()['nodes'].items()):
+      for phase, stats in sorted(phases.items()):
+        for quantile in ('p50', 'p99'):
+          labels = _Labels(node=node, phase=phase, quantile=f'0.{quantile[1:]}')
+          lines.append(f'{p}_phase_seconds{{{labels}}} {stats[quantile]:.6f}')
+        lines.append(f'{p}_phase_seconds_sum{{{_Labels(node=node, phase=phase)}}} {stats["sum"]:.6f}')
+        lines.append(f'{p}_phase_seconds_count{{{_Labels(node=node, phase=phase)}}} {stats["count"]}')
+
+    lines += [
+      f'# HELP {p}_tasks_total Role tasks by phase and outcome.',
+      f'# TYPE {p}_tasks_total counter',
+    ]
+    counts = {}
+    for record in self.records:
+      key = (record['node'], record['phase'], record['status'])
+      counts[key] = counts.get(key, 0) + 1
+    for (node, phase, status), count in sorted(counts.items()):
+      lines.append(f'{p}_tasks_total{{{_Labels(node=node, phase=phase, status=status)}}} {count}')
+    return '\n'.join(lines) + '\n'
+
+  def Write(self, prom_path=None, json_path=None):
+    '''Atomically write the Prometheus textfile and/or JSON summary.
+
+    Readers (node_exporter textfile collector) never see a partial file.
+
+    Args
+      prom_path: str Prometheus textfile path ('*.prom'). Optional.
+      json_path: str JSON summary path. Optional.
+    '''
+    if prom_path:
+      files.WriteAtomic(prom_path, self.Prometheus())
+    if json_path:
+      files.WriteAtomic(json_path, json.dumps(self.Summary(), indent=2, sort_keys=True) + '\n')
@@ -0,0 +1,207 @@
+#!/usr/bin/python
+#
+# Live-migrate VMs that exist on a different cluster node than requested.
+#
+# The current node of each VM is taken from cluster resources
+# (_pve_cluster_vms). Running KVMs are migrated with 'qm migrate --online';
+# running containers are restarted on the target with 'pct migrate --restart'
+# (LXC has no live migration). Stopped VMs are migrated offline.
+#
+# Migrations must be started on the source node. Commands for other nodes are
+# run over the cluster SSH trust (root@node; set up by pvecm), as PVE does for
+# migrations itself. Migrations run concurrently, bounded per source and per
+# target node (network and storage bandwidth). A migration takes its source and
+# target slots together once both are free, so a migration waiting on a busy
+# target never holds up other migrations from its source.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/qm.1.html
+# * https://pve.proxmox.com/pve-docs/pct.1.html
+# * https://pve.proxmox.com/wiki/Cluster_Manager
+# * https://pve.proxmox.com/pve-docs/api-viewer/index.html#/cluster/resources
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import asyncio
+import socket
+import time
+
+try:
+  from ansible.module_utils import executor
+  from ansible.module_utils import stats
+except:
+  import executor
+  import stats
+
+# Cluster resource type to VM command.
+COMMANDS = {'qemu': 'qm', 'lxc': 'pct'}
+
+
+def Short(name):
+  '''Return str short node name.'''
+  return str(name).split('.')[0]
+
+
+def Plan(vms, resources, vm_type):
+  '''Return list of dict migrations for VMs not on their requested node.
+
+  Args
+    vms: dict of VMID to str requested node (FQDN or short name).
+    resources: list of dict cluster VM resources (vmid, node, type, status).
+    vm_type: str cluster resource type, 'qemu' or 'lxc'.
+
+  Returns
+    list of dict migrations, sorted by VMID.
+    [
+      {
+        'vmid': 100,
+        'type': 'qemu',
+        'source': 'pm1',
+        'target': 'pm2',
+        'running': True,
+      },
+    ]
+  '''
+  requested = {int(k): Short(v) for k, v in vms.items()}
+  migrations = []
+  for resource in resources:
+    vmid = int(resource.get('vmid', 0))
+    if resource.get('type') != vm_type or vmid not in requested:
+      continue
+    if Short(resource['node']) == requested[vmid]:
+      continue
+    migrations.append({
+      'vmid': vmid,
+      'type': vm_type,
+      'source': Short(resource['node']),
+      'target': requested[vmid],
+      'running': resource.get('status') == 'running',
+    })
+  return sorted(migrations, key=lambda x: x['vmid'])
+
+
+class Migrator(object):
+  '''Run migrations concurrently with per source and target node limits.
+
+  Attributes
+    source_limit: int maximum concurrent migrations from a node.
+    target_limit: int maximum concurrent migrations to a node.
+    with_local_disks: bool True to migrate KVM local disks.
+    shutdown_timeout: int seconds a container is given to shutdown on restart.
+    timeout: int seconds before a migration command is killed.
+    local: str short name of the node commands are run on.
+  '''
+
+  def __init__(self, source_limit=1, target_limit=1, with_local_disks=False, shutdown_timeout=30, timeout=3600,
+               local=None, run=executor.RunAsync, clock=time.monotonic):
+    '''Initialize Migrator.
+
+    Args
+      source_limit: int maximum concurrent migrations from a node. Default: 1.
+      target_limit: int maximum concurrent migrations to a node. Default: 1.
+      with_local_disks: bool True to migrate KVM local disks. Default: False.
+      shutdown_timeout: int seconds a container is given to shutdown on
+          restart (pve_lxc_shutdown_timeout). Default: 30.
+      timeout: int seconds before a migration command is killed.
+          Default: 3600.
+      local: str name of the node commands are run on. Default: hostname.
+      run: coroutine function executing a command; see executor.RunAsync.
+      clock: function returning monotonic seconds; see time.monotonic.
+    '''
+    self.source_limit = max(1, int(source_limit))
+    self.target_limit = max(1, int(target_limit))
+    self.with_local_disks = with_local_disks
+    self.shutdown_timeout = int(shutdown_timeout)
+    self.timeout = int(timeout)
+    self.local = Short(local or socket.gethostname())
+    self._run = run
+    self._clock = clock
+    self._active = {}
+    self._slots = None
+
+  def Command(self, migration):
+    '''Return list of str command migrating a VM, run on the source node.'''
+    cmd = [COMMANDS[migration['type']], 'migrate', str(migration['vmid']), migration['target']]
+    if migration['type'] == 'qemu':
+      if migration['running']:
+        cmd.append('--online')
+      if self.with_local_disks:
+        cmd.append('--with-local-disks')
+    elif migration['running']:
+      cmd += ['--restart', '--timeout', str(self.shutdown_timeout)]
+    if migration['source'] != self.local:
+      cmd = ['ssh', '-o', 'BatchMode=yes', f'root@{migration["source"]}'] + cmd
+    return cmd
+
+  @staticmethod
+  def _Keys(migration):
+    '''Return tuple of source and target slot keys for a migration.'''
+    return ('source', migration['source']), ('target', migration['target'])
+
+  def _Free(self, migration):
+    '''Return bool True if both source and target slots are free.'''
+    source, target = self._Keys(migration)
+    return self._active.get(source, 0) < self.source_limit and self._active.get(target, 0) < self.target_limit
+
+  async def _Migrate(self, migration):
+    '''Run a migration within source and target limits; return dict result.'''
+    cmd = self.Command(migration)
+    queued = self._clock()
+    # Both slots are taken at once; waiting never holds a slot, so a busy
+    # target does not block other migrations from the same source and
+    # migrations in opposite directions cannot deadlock.
+    async with self._slots:
+      await self._slots.wait_for(lambda: self._Free(migration))
+      for key in self._Keys(migration):
+        self._active[key] = self._active.get(key, 0) + 1
+    try:
+      started = self._clock()
+      result = await self._run(cmd, timeout=self.timeout)
+      finished = self._clock()
+    finally:
+      async with self._slots:
+        for key in self._Keys(migration):
+          self._active[key] -= 1
+        self._slots.notify_all()
+    result = result.AsDict()
+    result.update(migration, waited=round(started - queued, 6), duration=round(finished - started, 6))
+    return result
+
+  async def _MigrateAll(self, migrations):
+    self._active = {}
+    self._slots = asyncio.Condition()
+    return await asyncio.gather(*[self._Migrate(x) for x in migrations])
+
+  def Run(self, migrations):
+    '''Run all migrations concurrently.
+
+    Args
+      migrations: list of dict migrations; see Plan.
+
+    Returns
+      dict results, migrations in the order given.
+      {
+        'migrations': [
+          {'vmid': 100, 'type': 'qemu', 'source': 'pm1', 'target': 'pm2',
+           'running': True, 'cmd': [...], 'rc': 0, 'ok': True, 'stdout': '',
+           'stderr': '', 'waited': 0.0, 'duration': 42.1},
+        ],
+        'stats': {'duration': 42.2, 'migrations': 1, 'failed': 0,
+                  'p50': 42.1, 'max': 42.1},
+      }
+    '''
+    started = self._clock()
+    results = asyncio.run(self._MigrateAll(migrations)) if migrations else []
+    durations = [x['duration'] for x in results]
+    return {
+      'migrations': results,
+      'stats': {
+        'duration': round(self._clock() - started, 6),
+        'migrations': len(results),
+        'failed': len([x for x in results if not x['ok']]),
+        'p50': stats.Percentile(durations, 50),
+        'max': max(durations, default=0.0),
+      },
+    }
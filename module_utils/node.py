@@ -0,0 +1,249 @@
+#!/usr/bin/python
+#
+# Apply parsed PveConfig results for all VMs on a cluster node in a single
+# module execution. Node commands (pvesh, pvesm, qm, pct) are run in-process
+# as asyncio subprocesses, bounded per node and storage (executor.Executor),
+# instead of one ansible task (SSH round trip and module startup) per command.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/qm.1.html
+# * https://pve.proxmox.com/pve-docs/pct.1.html
+# * https://pve.proxmox.com/pve-docs/pvesm.1.html
+# * https://pve.proxmox.com/pve-docs/chapter-pmxcfs.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import json
+import os
+import subprocess
+
+try:
+  from ansible.module_utils import data
+except:
+  import data
+
+
+class CommandResult(data.Record):
+  '''Result of a node command.
+
+  Attributes
+    cmd: list of str command executed.
+    rc: int return code.
+    stdout: str command output.
+    stderr: str command error output.
+    ok: bool True if rc is an accepted return code.
+  '''
+  _fields = ('cmd', 'rc', 'stdout', 'stderr', 'ok')
+
+  def __init__(self, cmd, rc, stdout='', stderr='', ok=True):
+    self.cmd = cmd
+    self.rc = rc
+    self.stdout = stdout
+    self.stderr = stderr
+    self.ok = ok
+
+
+def Run(cmd, ok_rc=(0,), timeout=None):
+  '''Run a node command.
+
+  Args
+    cmd: list of str command to execute.
+    ok_rc: tuple of int accepted return codes. Default: (0,).
+    timeout: int seconds before the command is killed. Default: None.
+
+  Returns
+    CommandResult for the executed command.
+  '''
+  try:
+    proc = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+  except subprocess.TimeoutExpired as e:
+    return CommandResult(cmd, -1, e.stdout or '', f'timeout after {timeout} seconds', ok=False)
+  except OSError as e:
+    return CommandResult(cmd, -1, '', str(e), ok=False)
+  return CommandResult(cmd, proc.returncode, proc.stdout, proc.stderr, ok=proc.returncode in ok_rc)
+
+
+def ConfigPath(vm, config_dir='/etc/pve'):
+  '''Return str pmxcfs config path for a VM.
+
+  Args
+    vm: dict PveConfig.Ansible() result.
+    config_dir: str pmxcfs mountpoint. Default: '/etc/pve'.
+  '''
+  if 'lxc' in vm:
+    return os.path.join(config_dir, 'lxc', f'{vm["vmid"]}.conf')
+  return os.path.join(config_dir, 'qemu-server', f'{vm["vmid"]}.conf')
+
+
+def WriteConfig(path, lines):
+  '''Write config lines to a pmxcfs file if the content differs.
+
+  pmxcfs does not support rename (atomic temp file moves) or ownership and
+  mode changes; the file is truncated and written in place with a single
+  write. Permissions are applied by pmxcfs based on path.
+
+  Args
+    path: str config file path.
+    lines: list of str config lines (without newlines).
+
+  Returns
+    bool True if the file was written.
+  '''
+  content = ''.join([f'{x}\n' for x in lines])
+  try:
+    with open(path, 'r') as f:
+      if f.read() == content:
+        return False
+  except FileNotFoundError:
+    pass
+  with open(path, 'w') as f:
+    f.write(content)
+  return True
+
+
+class NodeApply(object):
+  '''Apply config, disk and cloud init changes for VMs on a cluster node.
+
+  Mirrors kvm/tasks/reconfigure.yml (and interfaces/create_disk.yml) and
+  lxc/tasks/reconfigure.yml. VMs are applied concurrently; commands for a
+  single VM run in order. Commands are bounded per node and storage by the
+  executor. Storage content is listed once per storage for the node and
+  shared by all VMs.
+
+  Attributes
+    vms: list of dict PveConfig.Ansible() results for VMs on this node.
+    config_dir: str pmxcfs mountpoint.
+    executor: executor.Executor running node commands.
+  '''
+
+  def __init__(self, vms, config_dir='/etc/pve', executor=None):
+    '''Initialize NodeApply.
+
+    Args
+      vms: list of dict PveConfig.Ansible() results. All VMs must reside on
+          the same node.
+      config_dir: str pmxcfs mountpoint. Default: '/etc/pve'.
+      executor: executor.Executor running node commands. Default: None
+          (executor.Executor defaults).
+
+    Raises
+      ValueError if VMs reside on different nodes.
+    '''
+    if executor is None:
+      # Only node apply needs asyncio (which imports inspect); keep it out of
+      # per-VM module cold start.
+      try:
+        from ansible.module_utils.executor import Executor
+      except:
+        from executor import Executor
+      executor = Executor()
+    self.vms = vms
+    self.config_dir = config_dir
+    self.executor = executor
+    self._content = {}
+    if len(set([vm['node'] for vm in vms])) > 1:
+      raise ValueError('All VMs must reside on the same node.')
+
+  async def _StorageContent(self, node, storage):
+    '''Return set of volume IDs on node storage. Listed once per storage.'''
+    async with self.executor.Lock(('content', storage)):
+      if storage not in self._content:
+        result = await self.executor.Command(node, ['pvesh', 'get', f'/nodes/{node.split(".")[0]}/storage/{storage}/content', '--output-format', 'json'])
+        if not result['ok']:
+          raise RuntimeError(f'unable to list storage {storage}: {result["stderr"]}')
+        self._content[storage] = set([x['volid'] for x in json.loads(result['stdout'] or '[]')])
+      return self._content[storage]
+
+  async def _Execute(self, state, vm, cmd, ok_rc=(0,), storage=None):
+    '''Run command on the VM node, record it in VM state and raise on failure.'''
+    result = await self.executor.Command(vm['node'], cmd, ok_rc=ok_rc, storage=storage)
+    state['commands'].append(result)
+    if not result['ok']:
+      raise RuntimeError(f'{" ".join(cmd)} failed ({result["rc"]}): {result["stderr"].strip()}')
+    return result
+
+  def _WriteConfig(self, state, vm):
+    '''Write the canonical config in place if it differs; see WriteConfig.'''
+    if WriteConfig(ConfigPath(vm, self.config_dir), vm['config_list_canonical']):
+      state['changed'] = True
+
+  async def _ApplyKvm(self, state, vm):
+    '''Apply KVM config, disks and cloud init settings.'''
+    vmid = str(vm['vmid'])
+    self._WriteConfig(state, vm)
+    for disk in vm.get('disks', []):
+      if disk['file'] in await self._StorageContent(vm['node'], disk['storage']):
+        if 'size' in disk:
+          result = await self._Execute(state, vm, ['qm', 'resize', vmid, disk['disk'], disk['size']], ok_rc=(0, 255), storage=disk['storage'])
+          state['resized'] = state['resized'] or result['rc'] == 0
+        continue
+
+      cmd = ['pvesm', 'alloc', disk['storage'], vmid, disk['fullname'], disk['size']]
+      if disk['format']:
+        cmd += ['-format', disk['format']]
+      result = await self._Execute(state, vm, cmd, ok_rc=(0, 5))
+      if result['rc'] == 0:
+        state['allocated'].append(disk['file'])
+
+    # Single targeted rescan instead of one per processed disk or iso.
+    processed = len(vm.get('disks', [])) + len(vm.get('isos', []))
+    if state['allocated']:
+      await self._Execute(state, vm, ['qm', 'rescan', '--vmid', vmid])
+      processed -= 1
+    state['rescans_avoided'] = processed
+
+    if vm.get('cloud_init'):
+      await self._Execute(state, vm, ['qm', 'set', vmid, f'--{vm["cloud_init"]["mountpoint"]}', f'{vm["cloud_init"]["storage"]}:cloudinit'], ok_rc=(0, 5))
+
+  async def _ApplyLxc(self, state, vm):
+    '''Apply LXC root disk resize and config.'''
+    if 'size' in vm['root']:
+      result = await self._Execute(state, vm, ['pct', 'resize', str(vm['vmid']), vm['root']['disk'], vm['root']['size']], ok_rc=(0, 255),
+                                   storage=vm['root']['storage'])
+      state['resized'] = result['rc'] == 0
+    self._WriteConfig(state, vm)
+
+  async def ApplyVm(self, vm):
+    '''Apply all changes for a single VM.
+
+    Args
+      vm: dict PveConfig.Ansible() result.
+
+    Returns
+      dict per-VM result.
+      {
+        'vmid': 100,
+        'changed': True,
+        'failed': False,
+        'msg': '',
+        'resized': False,
+        'allocated': ['local-lvm:vm-100-disk-1'],
+        'rescans_avoided': 0,
+        'commands': [{'cmd': [...], 'rc': 0, 'stdout': '', 'waited': 0.0, ...}],
+      }
+    '''
+    state = {'vmid': vm['vmid'], 'changed': False, 'failed': False, 'msg': '',
+             'resized': False, 'allocated': [], 'rescans_avoided': 0,
+             'commands': []}
+    try:
+      if 'lxc' in vm:
+        await self._ApplyLxc(state, vm)
+      else:
+        await self._ApplyKvm(state, vm)
+    except (RuntimeError, OSError, ValueError, KeyError) as e:
+      state['failed'] = True
+      state['msg'] = str(e)
+    # Allocated or grown storage is a change even if the config is current.
+    state['changed'] = state['changed'] or bool(state['allocated']) or state['resized']
+    return state
+
+  def Apply(self):
+    '''Apply all VMs concurrently.
+
+    Returns
+      list of dict per-VM results, in the order VMs were given.
+    '''
+    self._content = {}
+    return self.executor.Run(self.ApplyVm, self.vms)
@@ -4,6 +4,8 @@
 # config, and ansible formatted options. Testing validates config static
 # syntax checking, but not runtime values (e.g. proper format).
 #
+# Parse PVE firewall (.fw) files into structured data for semantic comparison.
+#
 # Run unittests from module_utils: python3 -m unittest
 #
 # NOTE(upgrade): Every new major release check for parameter changes. Check
@@ -13,23 +15,44 @@
 # Reference:
 # * https://pve.proxmox.com/wiki/Manual:_qm.conf
 # * https://pve.proxmox.com/pve-docs/qm.1.html
+# * https://pve.proxmox.com/pve-docs/chapter-pve-firewall.html
 
 from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
-from dataclasses import asdict
+from collections import Counter
+import hashlib
+import json
+import re
 
 try:
   from ansible.module_utils import data
 except:
   import data
 
+_size_units = {'': 1, 'K': 1024, 'M': 1024**2, 'G': 1024**3, 'T': 1024**4}
+
+
+def Bytes(size):
+  '''Return int bytes for a PVE disk size ('4G', '512M', '1T', '1024').
+
+  Raises
+    ValueError for an invalid size.
+  '''
+  size = str(size).strip().upper()
+  unit = size[-1:] if size[-1:] in _size_units else ''
+  return int(float(size[:len(size) - len(unit)]) * _size_units[unit])
+
 
 class PveConfig(object):
   '''Present KVM config in an ansible-consumable way.
 
   Attributes
     config_type: PveConfigType representing the source configuration file.
+    fingerprint: bool True to stamp the config fingerprint into 'tags'.
   '''
+  _fingerprint_prefix = 'fp-'
+  # Fingerprint tag in a canonical 'tags' line; see Checksum.
+  _fingerprint_tag_re = re.compile(r';?fp-[0-9a-f]{16}')
 
   def __init__(self, module=None):
     '''Initialize PveConfig.
@@ -44,6 +67,10 @@ class PveConfig(object):
           'config': str config file.
           'cloud_init': str cluster/node storage pool (identifies cloud init
               image). optional.
+          'fingerprint': bool True to add the config fingerprint tag to the
+              config. optional.
+          'idmap_passthrough': list of int IDs or dict {'u': list, 'g': list}
+              to pass through to the host; generates lxc.idmap. optional.
 
     Raises
       Exception inherited from sub-classes.
@@ -56,10 +83,34 @@ class PveConfig(object):
       self.image = None
     self.force_stop = module.get('force_stop', True)
     self.firewall = module.get('firewall', {})
-    self._TokenizeConfig(module['config'])
+    self._TokenizeConfig(self._IdmapConfig(module['config'], module.get('idmap_passthrough')))
     self.cloud_init = module.get('cloud_init', '')
+    self.fingerprint = module.get('fingerprint', False)
+    if self.fingerprint:
+      self._StampFingerprint()
 
 
+  def _IdmapConfig(self, raw, passthrough):
+    '''Append generated lxc.idmap options for passthrough IDs to the config.
+
+    Args
+      raw: str pct.conf.
+      passthrough: list of int IDs or dict {'u': list, 'g': list}. None to
+          leave config unmodified.
+
+    Returns
+      str pct.conf.
+
+    Raises
+      ValueError if the config already contains lxc.idmap options.
+    '''
+    if not passthrough:
+      return raw
+    if re.search(r'^\s*lxc\.idmap\s*:', raw, re.MULTILINE):
+      raise ValueError('idmap_passthrough cannot be used with lxc.idmap in config.')
+    idmap = ''.join([f'\nlxc.idmap: {x}' for x in LxcIdmap.Generate(passthrough)])
+    return raw.rstrip('\n') + idmap
+
   def _TokenizeConfig(self, raw):
     '''Tokenize the provided config into QmeuConfig objects.
 
@@ -85,6 +136,63 @@ class PveConfig(object):
           continue
         self.tokens.append(data.PveConfigOption(option, config=self.config_type))
 
+  def _Tags(self, token):
+    '''Return list of tags for a 'tags' token, dropping fingerprint tags.'''
+    raw = ','.join([str(x) for x in token.value])
+    return [x for x in re.split(r'[;,\s]+', raw) if x and not x.startswith(self._fingerprint_prefix)]
+
+  def _StampFingerprint(self):
+    '''Add the fingerprint tag to the config, replacing any stale tags.
+
+    Existing 'tags' are preserved; the fingerprint tag is appended.
+    '''
+    tags = [self.FingerprintTag()]
+    for i, token in enumerate(self.tokens):
+      if token.key == 'tags':
+        self.tokens[i] = data.PveConfigOption(f'tags: {";".join(self._Tags(token) + tags)}', config=self.config_type)
+        return
+    self.tokens.append(data.PveConfigOption(f'tags: {";".join(tags)}', config=self.config_type))
+
+  def Fingerprint(self):
+    '''Return str canonical, order-independent fingerprint of the config.
+
+    Option lines are normalized (optional keys inserted) and sorted; comments
+    form the VM description and are kept in order. Fingerprint tags are
+    ignored, so a stamped config has the same fingerprint as the original.
+    Inputs applied outside of the config (firewall, template and cloud init
+    storage) are included, so a VM with a current fingerprint needs no
+    firewall or config check on the node.
+
+    Returns
+      str blake2b hex digest (16 characters).
+    '''
+    options = []
+    comments = []
+    for token in self.tokens:
+      if token.type == data.PveType.COMMENT:
+        comments.append(token.Config())
+      elif token.key == 'tags':
+        tags = self._Tags(token)
+        if tags:
+          options.append(f'tags: {";".join(tags)}')
+      else:
+        options.append(token.Config())
+
+    digest = hashlib.blake2b(digest_size=8)
+    for line in sorted(options) + comments:
+      digest.update(f'{line}\n'.encode())
+    inputs = {
+      'firewall': self.firewall,
+      'template': self.image.AsDict() if self.image else None,
+      'cloud_init': self.cloud_init,
+    }
+    digest.update(json.dumps(inputs, sort_keys=True, default=str).encode())
+    return digest.hexdigest()
+
+  def FingerprintTag(self):
+    '''Return str PVE tag containing the config fingerprint.'''
+    return f'{self._fingerprint_prefix}{self.Fingerprint()}'
+
   def Config(self):
     '''Return dict equivalent for the tokenized config'''
     config = {}
@@ -92,13 +200,132 @@ class PveConfig(object):
       config.update(token.Ansible())
     return config
 
-  def ConfigText(self):
-    '''Return str file equivalent for the tokenized config'''
-    return '\n'.join(self.ConfigList())
+  def ConfigText(self, canonical=False):
+    '''Return str file equivalent for the tokenized config.
+
+    Args
+      canonical: bool True to order and format the config as PVE writes it.
+    '''
+    return '\n'.join(self.ConfigList(canonical))
+
+  def ConfigList(self, canonical=False):
+    '''Return list file equivalent for the tokenized config.
+
+    Canonical order matches PVE's own serialization: comments (description)
+    first, options sorted by key, then LXC extensions in given order. Options
+    are formatted as PVE property strings (see PveConfigOption.Config). The
+    'description' key is written as a comment line; as in PVE, comment lines
+    take precedence over it.
+
+    Args
+      canonical: bool True to order and format the config as PVE writes it.
+    '''
+    if not canonical:
+      return [x.Config() for x in self.tokens]
+
+    comments = [x for x in self.tokens if x.type == data.PveType.COMMENT]
+    comments = comments or [x for x in self.tokens if x.Description()]
+    extensions = [x for x in self.tokens if x.type == data.PveType.LXC_EXTENSION]
+    options = sorted(
+        [x for x in self.tokens if not x.Description() and x.type != data.PveType.LXC_EXTENSION],
+        key=lambda x: x.key)
+    return [x.Config(canonical=True) for x in comments + options + extensions]
+
+  def ChecksumIgnore(self):
+    '''Return list of config keys PVE manages outside of the role.
+
+    * 'meta': QEMU creation time; different every time the VM is created.
+    * cloud init mountpoint: mounted cloudinit iso, not defined in config.
+    '''
+    if self.config_type == data.PveConfigType.LXC:
+      return []
+
+    ignore = ['meta']
+    if self.CloudInitMap():
+      ignore.append(self.CloudInitMap()['mountpoint'])
+    return ignore
+
+  def _ChecksumLine(self, line):
+    '''Return str canonical config line without the fingerprint tag.
 
-  def ConfigList(self):
-    '''Return list file equivalent for the tokenized config'''
-    return [x.Config() for x in self.tokens]
+    Mirrors the sed expressions applied to the node config in provision.yml,
+    so stamping (or re-stamping) the fingerprint never reads as a change.
+    '''
+    if not line.startswith('tags: '):
+      return line
+    line = self._fingerprint_tag_re.sub('', line).replace('tags: ;', 'tags: ')
+    return '' if line.rstrip() == 'tags:' else line
+
+  def Checksum(self):
+    '''Return str sha1 of the canonical config file, without ignored keys.
+
+    This matches 'sha1sum' of the PVE config file (with ignored keys,
+    the fingerprint tag and snapshot/pending sections removed) when nothing
+    has changed.
+    '''
+    ignore = self.ChecksumIgnore()
+    lines = [self._ChecksumLine(x) for x in self.ConfigList(canonical=True) if x.split(':', 1)[0] not in ignore]
+    lines = [x for x in lines if x]
+    return hashlib.sha1(''.join([f'{x}\n' for x in lines]).encode()).hexdigest()
+
+  @staticmethod
+  def _DiskSize(token):
+    '''Return tuple (str size or None, dict other disk options) for a disk token.'''
+    options = {x.key: str(x.value) for x in token.value}
+    return options.pop('size', None), options
+
+  def DiskGrowth(self, current):
+    '''Return disks to grow if they are the only change from a node config.
+
+    Growing a disk (qm resize, pct resize) is an online operation; a running
+    VM only needs a shutdown/start cycle for other changes. Options are
+    compared as PVE writes them. Keys PVE manages (ChecksumIgnore) and
+    fingerprint tags are ignored; snapshot and pending sections of the node
+    config are dropped.
+
+    Args
+      current: str node config file (/etc/pve/qemu-server/{VMID}.conf).
+
+    Returns
+      list of dict disks to grow, empty if only fingerprint tags changed;
+      None if any other option changed (including a disk shrink).
+      [
+        {
+          'disk': 'scsi0',
+          'size': '8G',
+          'current': '4G',
+        },
+      ]
+    '''
+    ignore = self.ChecksumIgnore()
+    node = PveConfig({'vmid': self.vmid, 'node': self.node, 'config': re.split(r'^\[', current, maxsplit=1, flags=re.MULTILINE)[0]})
+    # Comments (description) and LXC extensions are ordered and may repeat.
+    ordered = [[x for x in y.ConfigList(canonical=True) if x.startswith(('#', 'lxc'))] for y in (self, node)]
+    if ordered[0] != ordered[1]:
+      return None
+
+    options = [{x.key: x for x in y.tokens
+                if not x.Description() and x.type != data.PveType.LXC_EXTENSION and x.key not in ignore}
+               for y in (self, node)]
+    grow = []
+    for key in sorted(set(options[0]) | set(options[1])):
+      requested, existing = [x.get(key) for x in options]
+      if key == 'tags':
+        tags = [self._Tags(x) if x else [] for x in (requested, existing)]
+        if tags[0] != tags[1]:
+          return None
+        continue
+      if requested is None or existing is None:
+        return None
+      if requested.Config(canonical=True) == existing.Config(canonical=True):
+        continue
+      if requested.type not in (data.PveType.DISK, data.PveType.ROOTFS, data.PveType.MP):
+        return None
+      (size, disk), (current_size, current_disk) = [self._DiskSize(x) for x in (requested, existing)]
+      if disk != current_disk or size is None or current_size is None or Bytes(size) <= Bytes(current_size):
+        return None
+      grow.append({'disk': key, 'size': size, 'current': current_size})
+    return grow
 
   def Cli(self):
     '''Return str CLI equivalent for the tokenized config.'''
@@ -269,7 +496,7 @@ class PveConfig(object):
   def ImageOptions(self):
     '''Return dict containing image template.'''
     if self.image:
-      return asdict(self.image)
+      return self.image.AsDict()
 
     return {}
 
@@ -362,16 +589,61 @@ class PveConfig(object):
       if token.key == 'lxc.idmap':
         for option in token.value:
           ctype, cid, hid, crange = str(option.value).split(' ')
-          if crange == '1':
+          if crange == '1' or cid == hid:
             if ctype == 'u':
-              lxc_idmap['subuid'].append(f'root:{cid}:1')
+              lxc_idmap['subuid'].append(f'root:{cid}:{crange}')
             else:
-              lxc_idmap['subgid'].append(f'root:{cid}:1')
+              lxc_idmap['subgid'].append(f'root:{cid}:{crange}')
           lxc_idmap['idmap'].append({'ctype': ctype, 'cid': cid, 'hid': hid, 'crange': crange})
 
     lxc['meta'].update(lxc_idmap)
     return lxc
 
+  def Idmap(self):
+    '''Validate lxc.idmap options.
+
+    Returns
+      dict {gaps list} of unmapped container ID ranges. See LxcIdmap.Gaps().
+
+    Raises
+      ValueError if container or host ID mappings overlap.
+    '''
+    idmap = LxcIdmap(self.Lxc()['meta']['idmap'])
+    overlaps = idmap.Overlaps()
+    if overlaps:
+      raise ValueError('lxc.idmap overlapping mappings: %s' % '; '.join(
+          [f'{x["ctype"]} {x["space"]} IDs {x["mappings"]}' for x in overlaps]))
+    return {'gaps': idmap.Gaps()}
+
+  def Startup(self):
+    '''Return startup and shutdown behavior from the 'startup' option.
+
+    VMs without an order are started after and shutdown before all ordered
+    VMs. 'up' is the delay in seconds before starting the next VM, 'down' is
+    the shutdown timeout in seconds.
+
+    Returns
+      dict {order int, up int, down int}. Unset values are None.
+      {
+        'order': 2,
+        'up': 30,
+        'down': None,
+      }
+
+    Raises
+      ValueError if startup values are not integers.
+    '''
+    startup = {'order': None, 'up': None, 'down': None}
+    for token in filter(lambda x: x.key == 'startup', self.tokens):
+      for i, option in enumerate([str(x) for x in token.value]):
+        key, _, value = option.rpartition('=')
+        # A bare leading value is the order ('startup: 3').
+        if not key and i == 0:
+          key = 'order'
+        if key in startup:
+          startup[key] = int(value)
+    return startup
+
   def Ansible(self):
     '''Entry point for ansible module
 
@@ -386,16 +658,23 @@ class PveConfig(object):
     ansible['node'] = self.node
     ansible['force_stop'] = self.force_stop
     ansible['firewall'] = self.firewall
+    ansible['startup'] = self.Startup()
     ansible['root'] = self.RootDisk()
     ansible['config'] = self.Config()
     ansible['config_text'] = self.ConfigText()
     ansible['config_list'] = self.ConfigList()
+    ansible['config_list_canonical'] = self.ConfigList(canonical=True)
+    ansible['config_checksum'] = self.Checksum()
+    ansible['config_checksum_ignore'] = self.ChecksumIgnore()
     ansible['cli'] = self.Cli()
     ansible['cli_list'] = self.CliList()
+    ansible['fingerprint'] = self.Fingerprint()
+    ansible['fingerprint_tag'] = self.FingerprintTag()
 
     if self.config_type == data.PveConfigType.LXC:
       ansible['template'] = self.ImageOptions()
       ansible['lxc'] = self.Lxc()
+      ansible['idmap'] = self.Idmap()
     else:
       ansible['cloud_init'] = self.CloudInitMap()
       ansible['template'] = self.ImageOptions()
@@ -403,3 +682,374 @@ class PveConfig(object):
       ansible['isos'] = self.Isos()
 
     return ansible
+
+
+class LxcIdmap(object):
+  '''Validate and generate LXC ID maps (lxc.idmap).
+
+  Each mapping is an interval of container IDs [cid, cid + crange) mapped to
+  host IDs [hid, hid + crange), tracked separately for users ('u') and groups
+  ('g'). Intervals are sorted and swept once per ID space, so validation is
+  O(n log n) in the number of mappings.
+
+  Attributes
+    maps: dict {'u': list, 'g': list} of (cid, hid, crange) int tuples.
+    id_range: int number of container IDs which should be mapped.
+  '''
+  host_base = 100000
+  id_range = 65536
+
+  def __init__(self, idmap, id_range=None):
+    '''Initialize LxcIdmap.
+
+    Args
+      idmap: list of str 'u 0 100000 1005' lines or PveConfig.Lxc() meta idmap
+          dicts.
+      id_range: int number of container IDs which should be mapped. Default:
+          65536.
+
+    Raises
+      ValueError if a mapping is malformed.
+    '''
+    self.id_range = id_range or self.id_range
+    self.maps = {'u': [], 'g': []}
+    for entry in idmap:
+      if isinstance(entry, dict):
+        entry = f'{entry["ctype"]} {entry["cid"]} {entry["hid"]} {entry["crange"]}'
+      try:
+        ctype, cid, hid, crange = str(entry).split()
+        cid, hid, crange = int(cid), int(hid), int(crange)
+      except ValueError:
+        raise ValueError(f'lxc.idmap must be "u|g cid hid range": {entry}')
+      if ctype not in self.maps or min(cid, hid) < 0 or crange < 1:
+        raise ValueError(f'lxc.idmap must be "u|g cid hid range": {entry}')
+      self.maps[ctype].append((cid, hid, crange))
+
+  @staticmethod
+  def _Sweep(intervals):
+    '''Find overlaps and gaps in a list of intervals.
+
+    Overlaps are reported against the previous interval reaching furthest.
+
+    Args
+      intervals: list of (start int, length int, label str) tuples.
+
+    Returns
+      tuple (list of (label, label) overlaps, list of (start, end) gaps, int
+      end of last interval).
+    '''
+    overlaps = []
+    gaps = []
+    reach = (0, None)
+    for start, length, label in sorted(intervals):
+      if reach[1] is not None and start < reach[0]:
+        overlaps.append((reach[1], label))
+      elif start > reach[0]:
+        gaps.append((reach[0], start - 1))
+      if start + length > reach[0]:
+        reach = (start + length, label)
+    return overlaps, gaps, reach[0]
+
+  def Overlaps(self):
+    '''Return list of dicts describing overlapping mappings.
+
+    Container overlaps map one container ID twice; host overlaps map two
+    container IDs to the same host ID. Both prevent the container starting.
+
+    Returns
+      list of dict {ctype str, space str, mappings list}.
+      [
+        {
+          'ctype': 'u',
+          'space': 'host',
+          'mappings': ['u 0 100000 1005', 'u 1005 100000 1'],
+        },
+      ]
+    '''
+    overlaps = []
+    for ctype, maps in self.maps.items():
+      lines = [f'{ctype} {cid} {hid} {crange}' for cid, hid, crange in maps]
+      for space, index in (('container', 0), ('host', 1)):
+        found, _, _ = self._Sweep([(x[index], x[2], line) for x, line in zip(maps, lines)])
+        overlaps += [{'ctype': ctype, 'space': space, 'mappings': list(x)} for x in found]
+    return overlaps
+
+  def Gaps(self):
+    '''Return list of dicts describing unmapped container ID ranges.
+
+    Unmapped IDs appear as nobody/nogroup in the container. ID types without
+    any mappings are not reported if no mappings are defined at all (PVE uses
+    the default mapping).
+
+    Returns
+      list of dict {ctype str, start int, end int} inclusive ranges.
+      [
+        {'ctype': 'g', 'start': 1005, 'end': 1005},
+      ]
+    '''
+    if not any(self.maps.values()):
+      return []
+    gaps = []
+    for ctype, maps in self.maps.items():
+      _, found, reach = self._Sweep([(cid, crange, '') for cid, hid, crange in maps])
+      if reach < self.id_range:
+        found.append((reach, self.id_range - 1))
+      gaps += [{'ctype': ctype, 'start': start, 'end': end} for start, end in found if start < self.id_range]
+    return gaps
+
+  @classmethod
+  def Generate(cls, passthrough, host_base=None, id_range=None):
+    '''Generate the minimal complete ID map for passthrough IDs.
+
+    Passthrough IDs map to the same host ID; consecutive IDs are merged into a
+    single mapping. All remaining container IDs are mapped to host_base +
+    container ID.
+
+    Args
+      passthrough: list of int IDs passed through for both users and groups,
+          or dict {'u': list, 'g': list} of int IDs for each type.
+      host_base: int first host ID for unprivileged mappings. Default: 100000.
+      id_range: int number of container IDs to map. Default: 65536.
+
+    Returns
+      list of str lxc.idmap values.
+      [
+        'u 0 100000 1005',
+        'u 1005 1005 1',
+        'u 1006 101006 64530',
+        'g 0 100000 1005',
+        ...
+      ]
+
+    Raises
+      ValueError if a passthrough ID is outside of the container ID range.
+    '''
+    host_base = cls.host_base if host_base is None else host_base
+    id_range = id_range or cls.id_range
+    if not isinstance(passthrough, dict):
+      passthrough = {'u': passthrough, 'g': passthrough}
+
+    idmap = []
+    for ctype in ('u', 'g'):
+      ids = sorted(set([int(x) for x in passthrough.get(ctype, None) or []]))
+      if ids and (ids[0] < 0 or ids[-1] >= id_range):
+        raise ValueError(f'passthrough {ctype}id must be between 0 and {id_range - 1}: {ids}')
+      runs = []
+      for cid in ids:
+        if runs and runs[-1][0] + runs[-1][1] == cid:
+          runs[-1][1] += 1
+        else:
+          runs.append([cid, 1])
+      cursor = 0
+      for cid, crange in runs:
+        if cid > cursor:
+          idmap.append(f'{ctype} {cursor} {host_base + cursor} {cid - cursor}')
+        idmap.append(f'{ctype} {cid} {cid} {crange}')
+        cursor = cid + crange
+      if cursor < id_range:
+        idmap.append(f'{ctype} {cursor} {host_base + cursor} {id_range - cursor}')
+    return idmap
+
+
+class PveFirewallConfig(object):
+  '''Present a PVE firewall (.fw) file as structured data.
+
+  Sections [OPTIONS], [RULES], [IPSET name], [ALIASES] and [GROUP name] are
+  tokenized; section headers, IPSET, alias and group names are case
+  insensitive. Leading comments (descriptions) are ignored.
+
+  Firewalls are compared semantically in O(n): rules are compared as ordered
+  hashed tuples (rule order is significant), IPSET and alias entries as
+  counted hashed tuples (order is not). Whitespace, option order, rule option
+  order and address formatting (e.g. '10.0.0.1/32' and '10.0.0.1') are not
+  significant.
+
+  Attributes
+    options: dict {str option: str value}.
+    rules: list of dict rules.
+    ipsets: dict {str name: {comment str, hosts list of dict}}.
+    aliases: dict {str name: {ip str, comment str}}.
+    groups: dict {str name: {comment str, rules list of dict}}.
+  '''
+  # Rule option flag, rule key.
+  _rule_flags = {
+    '-source': 'source',
+    '-sport': 'sport',
+    '-dest': 'dest',
+    '-dport': 'dport',
+    '-p': 'proto',
+    '-log': 'log',
+    '-icmp-type': 'icmp_type',
+    '-i': 'iface',
+  }
+  _rule_keys = ('enable', 'direction', 'macro', 'action', 'source', 'sport',
+                'dest', 'dport', 'proto', 'log', 'icmp_type', 'iface',
+                'comment')
+
+  def __init__(self, text):
+    '''Initialize PveFirewallConfig.
+
+    Args
+      text: str firewall file contents.
+
+    Raises
+      ValueError if a line cannot be parsed.
+    '''
+    self.options = {}
+    self.rules = []
+    self.ipsets = {}
+    self.aliases = {}
+    self.groups = {}
+    self._Parse(text)
+
+  @staticmethod
+  def _Comment(line):
+    '''Return tuple (str value, str comment) for a line.'''
+    value, _, comment = line.partition('#')
+    return ' '.join(value.split()), comment.strip()
+
+  @staticmethod
+  def _Address(ip):
+    '''Return str canonical IPSET/alias address; non-addresses as given.'''
+    # Only firewall parsing needs ipaddress; keep it out of config cold start.
+    import ipaddress
+    nomatch = '!' if ip.startswith('!') else ''
+    try:
+      network = ipaddress.ip_network(ip.lstrip('!'), strict=False)
+    except ValueError:
+      return ip
+    if network.prefixlen == network.max_prefixlen:
+      return f'{nomatch}{network.network_address}'
+    return f'{nomatch}{network}'
+
+  @classmethod
+  def Rule(cls, line):
+    '''Tokenize a firewall rule.
+
+    Args
+      line: str rule, e.g. '|IN Ping(ACCEPT) -source +trusted # ping'.
+
+    Returns
+      dict rule definition.
+      {
+        'enable': False,
+        'direction': 'IN',
+        'macro': 'Ping',
+        'action': 'ACCEPT',
+        'source': '+trusted',
+        'comment': 'ping',
+      }
+
+    Raises
+      ValueError if the rule is malformed.
+    '''
+    rule = {'enable': not line.startswith('|')}
+    value, comment = cls._Comment(line.lstrip('|'))
+    tokens = value.split(' ')
+    if len(tokens) < 2 or len(tokens) % 2:
+      raise ValueError(f'malformed firewall rule: {line}')
+
+    rule['direction'] = tokens[0].upper()
+    action = tokens[1]
+    if '(' in action and action.endswith(')'):
+      rule['macro'], action = action[:-1].split('(', 1)
+    # Security group names are not actions.
+    rule['action'] = action if rule['direction'] == 'GROUP' else action.upper()
+    for flag, option in zip(tokens[2::2], tokens[3::2]):
+      key = cls._rule_flags.get(flag, flag.lstrip('-'))
+      rule[key] = option.lower() if key in ('log', 'proto') else option
+    if comment:
+      rule['comment'] = comment
+    return rule
+
+  def _Parse(self, text):
+    '''Tokenize firewall file contents.'''
+    section = None
+    target = None
+    for raw in text.splitlines():
+      line = raw.strip()
+      if not line:
+        continue
+
+      if line.startswith('['):
+        header, comment = self._Comment(line)
+        kind, _, name = header.strip('[]').strip().partition(' ')
+        section = kind.upper()
+        name = name.strip().lower()
+        if section == 'IPSET':
+          target = self.ipsets.setdefault(name, {'comment': comment, 'hosts': []})
+        elif section == 'GROUP':
+          target = self.groups.setdefault(name, {'comment': comment, 'rules': []})
+        elif section not in ('OPTIONS', 'RULES', 'ALIASES'):
+          raise ValueError(f'unknown firewall section: {line}')
+        continue
+
+      if section is None:
+        continue
+      if section == 'OPTIONS':
+        key, _, value = line.partition(':')
+        value = ''.join(value.split())
+        if '=' in value:
+          # Property strings (log_ratelimit) are order independent.
+          value = ','.join(sorted(value.split(',')))
+        self.options[key.strip().lower()] = value
+      elif section == 'RULES':
+        self.rules.append(self.Rule(line))
+      elif section == 'GROUP':
+        target['rules'].append(self.Rule(line))
+      elif section == 'IPSET':
+        ip, comment = self._Comment(line)
+        target['hosts'].append({'ip': self._Address(ip), 'comment': comment})
+      elif section == 'ALIASES':
+        value, comment = self._Comment(line)
+        name, _, ip = value.partition(' ')
+        self.aliases[name.lower()] = {'ip': self._Address(ip.strip()), 'comment': comment}
+
+  @classmethod
+  def _RuleHash(cls, rule):
+    '''Return int hash of the rule tuple.'''
+    return hash(tuple([rule.get(x) for x in cls._rule_keys] +
+                      sorted([(k, v) for k, v in rule.items() if k not in cls._rule_keys])))
+
+  def Hashes(self):
+    '''Return hashed firewall representation for O(n) comparison.
+
+    Returns
+      dict {section: hashed entries}. Rules are ordered tuples of rule
+      hashes; IPSET and alias entries are Counters of entry hashes.
+    '''
+    hashes = {'options': hash(frozenset(self.options.items()))}
+    hashes['rules'] = tuple([self._RuleHash(x) for x in self.rules])
+    hashes['aliases'] = Counter([hash((k, v['ip'], v['comment'])) for k, v in self.aliases.items()])
+    for name, ipset in self.ipsets.items():
+      hashes[f'ipset {name}'] = (ipset['comment'], Counter([hash((x['ip'], x['comment'])) for x in ipset['hosts']]))
+    for name, group in self.groups.items():
+      hashes[f'group {name}'] = (group['comment'], tuple([self._RuleHash(x) for x in group['rules']]))
+    return hashes
+
+  def Diff(self, other):
+    '''Return sorted list of str sections that differ from other firewall.
+
+    Args
+      other: PveFirewallConfig to compare against.
+
+    Returns
+      list of str section names, e.g. ['ipset trusted', 'rules']. Empty if
+      the firewalls are semantically equal.
+    '''
+    a = self.Hashes()
+    b = other.Hashes()
+    return sorted([x for x in set(a) | set(b) if a.get(x) != b.get(x)])
+
+  def __eq__(self, other):
+    return isinstance(other, PveFirewallConfig) and not self.Diff(other)
+
+  def Ansible(self):
+    '''Return firewall definition in pve_firewall/PveFirewall format.'''
+    return {
+      **self.options,
+      'rules': self.rules,
+      'ipset': [{'name': k, 'comment': v['comment'], 'hosts': v['hosts']} for k, v in self.ipsets.items()],
+      'ip_aliases': [{'name': k, **v} for k, v in self.aliases.items()],
+      'group_rules': [{'name': k, **v} for k, v in self.groups.items()],
+    }
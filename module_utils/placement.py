@@ -0,0 +1,453 @@
+#!/usr/bin/python
+#
+# Capacity-aware placement of VMs without a requested cluster node.
+#
+# VMs whose pve_kvm/pve_lxc definition has no 'node' (unpinned) are assigned
+# one from their parsed resource demand (memory, balloon, cores, sockets and
+# disk sizes) and the capacity of each online cluster node from cluster
+# resources (pvesh get /cluster/resources). Placement is first fit decreasing:
+# VMs are ordered by their largest share of a node (memory or CPU) and each is
+# put on the feasible node with the highest ('pack') or lowest ('spread')
+# resulting load. Load is the larger of the memory and CPU fractions used;
+# 'pack' leaves whole nodes free but may strand CPU (or memory) on full nodes
+# when VM memory to CPU ratios differ widely.
+#
+# Node load starts with every VM that is not placed: VMs with a requested node
+# count on that node, other cluster VMs on their current node. Unpinned VMs
+# that already exist stay on their current node unless rebalancing. VMs
+# sharing a tag with the anti-affinity prefix ('aa-web') are never placed on
+# the same node.
+#
+# Usage (from module_utils):
+#
+#   ansible-inventory --list > inventory.json
+#   pvesh get /cluster/resources --output-format json > resources.json
+#   python3 placement.py plan --inventory inventory.json --resources resources.json
+#   python3 placement.py benchmark --vms 5000 --nodes 50
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/api-viewer/index.html#/cluster/resources
+# * https://pve.proxmox.com/pve-docs/qm.conf.5.html
+# * https://pve.proxmox.com/pve-docs/pct.conf.5.html
+# * https://en.wikipedia.org/wiki/First-fit-decreasing_bin_packing
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import argparse
+import json
+import random
+import re
+import sys
+import time
+
+try:
+  from ansible.module_utils import data
+  from ansible.module_utils import fleet
+  from ansible.module_utils import migrate
+  from ansible.module_utils import parsers
+except:
+  import data
+  import fleet
+  import migrate
+  import parsers
+
+# Placement strategies; see Scheduler.
+STRATEGIES = ('pack', 'spread')
+
+# PVE memory (MB) when a config does not set 'memory'.
+DEFAULT_MEMORY = 512
+
+_mb = 1024**2
+
+# Synthetic fleet (memory MB, cores) sizes.
+_flavors = ((1024, 1), (2048, 1), (4096, 2), (8192, 4), (16384, 8))
+
+
+def Demand(vm, balloon=True):
+  '''Return dict resource demand of a VM definition.
+
+  Memory is in MB, storage in bytes per storage. Cores and sockets default
+  to 1 (LXC containers without 'cores' may use all node CPUs).
+
+  Args
+    vm: dict VM definition (pve_kvm/pve_lxc); see PveConfig. 'node' may be
+        unset.
+    balloon: bool True to reserve the KVM balloon minimum (0 < balloon <
+        memory) instead of memory. Default: True.
+
+  Returns
+    dict demand.
+    {
+      'vmid': 100,
+      'node': '',
+      'memory': 1024,
+      'cpus': 4,
+      'storage': {'local-lvm': 8589934592},
+      'tags': ['aa-web'],
+    }
+
+  Raises
+    Exception inherited from PveConfig.
+  '''
+  config = parsers.PveConfig(dict(vm, node=vm.get('node') or ''))
+  options = config.Config()
+  memory = int(options.get('memory', DEFAULT_MEMORY))
+  minimum = int(options.get('balloon', 0))
+  if balloon and 0 < minimum < memory:
+    memory = minimum
+
+  volumes = [(x['storage'], x['size']) for x in config.Disks() if 'size' in x]
+  for token in filter(lambda x: x.type == data.PveType.MP, config.tokens):
+    mp = token.Ansible()[token.key]
+    if ':' in mp.get('volume', '') and 'size' in mp:
+      volumes.append((mp['volume'].split(':', 1)[0], mp['size']))
+  storage = {}
+  for name, size in volumes:
+    storage[name] = storage.get(name, 0) + parsers.Bytes(size)
+  tags = options.get('tags', [])
+  if isinstance(tags, str):
+    tags = [tags]
+
+  return {
+    'vmid': int(vm['vmid']),
+    'node': migrate.Short(vm['node']) if vm.get('node') else '',
+    'memory': memory,
+    'cpus': int(options.get('cores', 1)) * int(options.get('sockets', 1)),
+    'storage': storage,
+    'tags': [x for x in re.split(r'[;,\s]+', ';'.join(tags)) if x],
+  }
+
+
+def ResourceDemand(resource):
+  '''Return dict demand of a cluster VM resource not defined in inventory.
+
+  Disks of existing VMs are already allocated; storage is empty.
+  '''
+  return {
+    'vmid': int(resource['vmid']),
+    'node': migrate.Short(resource['node']),
+    'memory': int(resource.get('maxmem', 0)) // _mb,
+    'cpus': int(resource.get('maxcpu', 0)),
+    'storage': {},
+    'tags': [x for x in str(resource.get('tags', '')).split(';') if x],
+  }
+
+
+class Scheduler(object):
+  '''Track cluster node capacity and place VM demands on nodes.
+
+  Attributes
+    nodes: dict of str short node name to dict node capacity and usage.
+    free: dict of storage pool to int bytes free. Shared storage is one pool
+        (storage name), local storage one pool per node (node, storage).
+    strategy: str 'pack' (fill nodes) or 'spread' (balance nodes).
+    prefix: str anti-affinity tag prefix.
+  '''
+
+  def __init__(self, resources, candidates=None, strategy='pack', memory_ratio=1.0, cpu_ratio=1.0,
+               reserved_memory=0, anti_affinity_prefix='aa-'):
+    '''Initialize Scheduler.
+
+    Args
+      resources: list of dict cluster resources, including 'node' and
+          'storage' types.
+      candidates: list of str nodes VMs may be placed on. Default: all online
+          nodes.
+      strategy: str 'pack' or 'spread'. Default: 'pack'.
+      memory_ratio: float memory overcommit ratio. Default: 1.0.
+      cpu_ratio: float CPU overcommit ratio. Default: 1.0.
+      reserved_memory: int MB of memory reserved for each node host.
+          Default: 0.
+      anti_affinity_prefix: str tag prefix of anti-affinity groups.
+          Default: 'aa-'.
+
+    Raises
+      ValueError for an unknown strategy.
+    '''
+    if strategy not in STRATEGIES:
+      raise ValueError(f'strategy must be one of {", ".join(STRATEGIES)}: {strategy}')
+    self.strategy = strategy
+    self.prefix = anti_affinity_prefix
+    candidates = set(migrate.Short(x) for x in candidates or [])
+    self.nodes = {}
+    for resource in resources:
+      if resource.get('type') != 'node' or resource.get('status', 'online') != 'online':
+        continue
+      name = migrate.Short(resource['node'])
+      self.nodes[name] = {
+        'memory_total': max(0, int(int(resource.get('maxmem', 0)) // _mb * memory_ratio) - int(reserved_memory)),
+        'cpus_total': int(resource.get('maxcpu', 0)) * cpu_ratio,
+        'memory': 0,
+        'cpus': 0,
+        'vms': 0,
+        'tags': set(),
+        'storage': {},
+        'candidate': not candidates or name in candidates,
+      }
+    self.free = {}
+    for resource in resources:
+      if resource.get('type') != 'storage' or migrate.Short(resource.get('node', '')) not in self.nodes:
+        continue
+      if resource.get('status', 'available') != 'available':
+        continue
+      pool = resource['storage'] if resource.get('shared') else (migrate.Short(resource['node']), resource['storage'])
+      self.nodes[migrate.Short(resource['node'])]['storage'][resource['storage']] = pool
+      self.free[pool] = int(resource.get('maxdisk', 0)) - int(resource.get('disk', 0))
+
+  def _Storage(self, demand, node, current=''):
+    '''Return dict of storage pool to int bytes a VM allocates on a node.
+
+    Returns None if a storage is not available on the node. Existing VMs
+    allocate nothing on their node or on shared storage.
+    '''
+    pools = {}
+    for storage, size in demand['storage'].items():
+      pool = self.nodes[node]['storage'].get(storage)
+      if pool is None:
+        return None
+      if current and (current == node or isinstance(pool, str)):
+        continue
+      pools[pool] = pools.get(pool, 0) + size
+    return pools
+
+  def Reserve(self, demand, node, current=''):
+    '''Account a VM on a node regardless of capacity.
+
+    Args
+      demand: dict VM demand; see Demand.
+      node: str short node name. Unknown (offline) nodes are ignored.
+      current: str short node name the VM exists on; '' for new VMs.
+    '''
+    if node not in self.nodes:
+      return
+    usage = self.nodes[node]
+    usage['memory'] += demand['memory']
+    usage['cpus'] += demand['cpus']
+    usage['vms'] += 1
+    usage['tags'].update([x for x in demand['tags'] if x.startswith(self.prefix)])
+    for pool, size in (self._Storage(demand, node, current) or {}).items():
+      self.free[pool] -= size
+
+  def Place(self, demands, current=None):
+    '''Place VM demands on candidate nodes, largest first.
+
+    Args
+      demands: list of dict VM demands; see Demand.
+      current: dict of int VMID to str short node name of existing VMs.
+
+    Returns
+      tuple (dict of int VMID to str short node name, list of dict demands
+      that fit no node).
+    '''
+    current = current or {}
+    nodes = [(name, x) for name, x in sorted(self.nodes.items())
+             if x['candidate'] and x['memory_total'] > 0 and x['cpus_total'] > 0]
+    if not nodes:
+      return {}, list(demands)
+    memory_mean = sum([x['memory_total'] for _, x in nodes]) / len(nodes)
+    cpus_mean = sum([x['cpus_total'] for _, x in nodes]) / len(nodes)
+    pack = self.strategy == 'pack'
+    placement = {}
+    unplaced = []
+    ordered = sorted(demands, key=lambda x: (-max(x['memory'] / memory_mean, x['cpus'] / cpus_mean), x['vmid']))
+    for demand in ordered:
+      memory = demand['memory']
+      cpus = demand['cpus']
+      tags = [x for x in demand['tags'] if x.startswith(self.prefix)]
+      vm_current = current.get(demand['vmid'], '')
+      best = None
+      best_load = 0.0
+      for name, usage in nodes:
+        used_memory = usage['memory'] + memory
+        used_cpus = usage['cpus'] + cpus
+        if used_memory > usage['memory_total'] or used_cpus > usage['cpus_total']:
+          continue
+        load = max(used_memory / usage['memory_total'], used_cpus / usage['cpus_total'])
+        if best is not None and (load <= best_load if pack else load >= best_load):
+          continue
+        if tags and not usage['tags'].isdisjoint(tags):
+          continue
+        if demand['storage']:
+          pools = self._Storage(demand, name, vm_current)
+          if pools is None or any([self.free[x] < y for x, y in pools.items()]):
+            continue
+        best = name
+        best_load = load
+      if best is None:
+        unplaced.append(demand)
+        continue
+      self.Reserve(demand, best, vm_current)
+      placement[demand['vmid']] = best
+    return placement, unplaced
+
+  def Usage(self):
+    '''Return dict of str short node name to dict usage and capacity.'''
+    usage = {}
+    for name, x in sorted(self.nodes.items()):
+      usage[name] = {k: x[k] for k in ('memory', 'memory_total', 'cpus', 'cpus_total', 'vms')}
+    return usage
+
+  def Overcommitted(self):
+    '''Return list of str short node names loaded beyond capacity.'''
+    return [k for k, x in sorted(self.nodes.items()) if x['memory'] > x['memory_total'] or x['cpus'] > x['cpus_total']]
+
+
+def Plan(vms, resources, nodes=None, strategy='pack', memory_ratio=1.0, cpu_ratio=1.0, reserved_memory=0,
+         balloon=True, anti_affinity_prefix='aa-', rebalance=False, clock=time.perf_counter):
+  '''Return dict placement plan of unpinned VMs.
+
+  Args
+    vms: list of dict VM definitions (pve_kvm/pve_lxc). VMs without 'node'
+        are placed.
+    resources: list of dict cluster resources (pvesh get /cluster/resources).
+    nodes: list of str inventory names of nodes VMs may be placed on; placed
+        nodes use these names. Default: all online nodes, short names.
+    strategy: str 'pack' or 'spread'. Default: 'pack'.
+    memory_ratio: float memory overcommit ratio. Default: 1.0.
+    cpu_ratio: float CPU overcommit ratio. Default: 1.0.
+    reserved_memory: int MB of memory reserved for each node host. Default: 0.
+    balloon: bool True to reserve the KVM balloon minimum. Default: True.
+    anti_affinity_prefix: str tag prefix of anti-affinity groups.
+        Default: 'aa-'.
+    rebalance: bool True to place existing unpinned VMs again instead of
+        keeping them on their current node. Default: False.
+    clock: function returning seconds; see time.perf_counter.
+
+  Returns
+    dict plan. 'placement' contains every unpinned VM that fits a node,
+    including VMs kept on their current node.
+    {
+      'placement': {101: 'pm2.example.com'},
+      'unplaced': [{'vmid': 102, 'node': '', 'memory': 65536, 'cpus': 64,
+                    'storage': {}, 'tags': []}],
+      'nodes': {'pm1': {'memory': 4096, 'memory_total': 63488, 'cpus': 4,
+                        'cpus_total': 16, 'vms': 2}},
+      'overcommitted': [],
+      'stats': {'vms': 3, 'pinned': 1, 'placed': 1, 'unplaced': 1,
+                'parse': 0.001, 'duration': 0.001},
+    }
+
+  Raises
+    ValueError for a duplicate VMID or a VM config that cannot be parsed.
+    Exception inherited from Scheduler.
+  '''
+  started = clock()
+  demands = {}
+  for vm in vms:
+    try:
+      demand = Demand(vm, balloon)
+    except Exception as e:
+      raise ValueError(f'unable to parse VM {vm.get("vmid")}: {e}')
+    if demand['vmid'] in demands:
+      raise ValueError(f'duplicate VMID: {demand["vmid"]}')
+    demands[demand['vmid']] = demand
+  parsed = clock()
+
+  scheduler = Scheduler(resources, nodes, strategy, memory_ratio, cpu_ratio, reserved_memory, anti_affinity_prefix)
+  current = {int(x['vmid']): migrate.Short(x['node']) for x in resources if x.get('type') in migrate.COMMANDS}
+  for resource in resources:
+    if resource.get('type') in migrate.COMMANDS and int(resource['vmid']) not in demands:
+      scheduler.Reserve(ResourceDemand(resource), migrate.Short(resource['node']), migrate.Short(resource['node']))
+
+  placement = {}
+  unpinned = []
+  pinned = 0
+  for vmid, demand in demands.items():
+    if demand['node']:
+      pinned += 1
+      scheduler.Reserve(demand, demand['node'], current.get(vmid, ''))
+    elif vmid in current and not rebalance:
+      placement[vmid] = current[vmid]
+      scheduler.Reserve(demand, current[vmid], current[vmid])
+    else:
+      unpinned.append(demand)
+  placed, unplaced = scheduler.Place(unpinned, current)
+  placement.update(placed)
+
+  names = {migrate.Short(x): x for x in nodes or []}
+  return {
+    'placement': {k: names.get(v, v) for k, v in sorted(placement.items())},
+    'unplaced': sorted(unplaced, key=lambda x: x['vmid']),
+    'nodes': scheduler.Usage(),
+    'overcommitted': scheduler.Overcommitted(),
+    'stats': {
+      'vms': len(demands),
+      'pinned': pinned,
+      'placed': len(placement),
+      'unplaced': len(unplaced),
+      'parse': round(parsed - started, 6),
+      'duration': round(clock() - parsed, 6),
+    },
+  }
+
+
+def Synthetic(vms, nodes, seed=0):
+  '''Return tuple (list of dict VM definitions, list of dict resources).
+
+  Generates an unpinned fleet and an empty cluster with shared and local
+  storage for benchmarks.
+  '''
+  rng = random.Random(seed)
+  resources = []
+  for n in range(nodes):
+    name = f'pm{n + 1}'
+    resources.append({'type': 'node', 'node': name, 'status': 'online', 'maxmem': 768 * 1024 * _mb, 'maxcpu': 128})
+    resources.append({'type': 'storage', 'node': name, 'storage': 'local-lvm', 'shared': 0, 'status': 'available',
+                      'maxdisk': 4 * 1024**4, 'disk': 0})
+    resources.append({'type': 'storage', 'node': name, 'storage': 'ceph', 'shared': 1, 'status': 'available',
+                      'maxdisk': 1024**5, 'disk': 0})
+  definitions = []
+  for vmid in range(1000, 1000 + vms):
+    config = [
+      'memory: %d\ncores: %d' % rng.choice(_flavors),
+      f'scsi0: {rng.choice(["local-lvm", "ceph"])}:vm-{vmid}-disk-0,size={rng.choice([8, 32, 64])}G',
+      'net0: virtio,bridge=vmbr0',
+    ]
+    if rng.random() < 0.1:
+      config.append(f'tags: aa-group{rng.randrange(vms // 40 or 1)}')
+    definitions.append({'vmid': vmid, 'config': '\n'.join(config)})
+  return definitions, resources
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Capacity-aware placement of unpinned VMs.')
+  commands = parser.add_subparsers(dest='command', required=True)
+  plan = commands.add_parser('plan', help='place VMs from ansible-inventory --list JSON')
+  plan.add_argument('--inventory', default='-', help="ansible-inventory --list JSON file; '-' for stdin")
+  plan.add_argument('--resources', required=True, help='pvesh get /cluster/resources JSON file')
+  plan.add_argument('--node', action='append', dest='nodes', help='node VMs may be placed on (repeatable)')
+  plan.add_argument('--strategy', choices=STRATEGIES, default='pack')
+  plan.add_argument('--memory-ratio', type=float, default=1.0)
+  plan.add_argument('--cpu-ratio', type=float, default=1.0)
+  plan.add_argument('--reserved-memory', type=int, default=0, help='MB reserved per node')
+  plan.add_argument('--no-balloon', action='store_true', help='reserve memory instead of the balloon minimum')
+  plan.add_argument('--anti-affinity-prefix', default='aa-')
+  plan.add_argument('--rebalance', action='store_true', help='place existing unpinned VMs again')
+  benchmark = commands.add_parser('benchmark', help='place a synthetic fleet')
+  benchmark.add_argument('--vms', type=int, default=5000)
+  benchmark.add_argument('--nodes', type=int, default=50)
+  benchmark.add_argument('--strategy', choices=STRATEGIES, default='pack')
+  benchmark.add_argument('--cpu-ratio', type=float, default=4.0)
+  args = parser.parse_args(argv)
+
+  if args.command == 'benchmark':
+    vms, resources = Synthetic(args.vms, args.nodes)
+    print(json.dumps(Plan(vms, resources, strategy=args.strategy, cpu_ratio=args.cpu_ratio)['stats'], indent=2))
+    return
+
+  if args.inventory == '-':
+    inventory = json.load(sys.stdin)
+  else:
+    with open(args.inventory) as f:
+      inventory = json.load(f)
+  with open(args.resources) as f:
+    resources = json.load(f)
+  vms = [x['vm'] for x in fleet.Inventory(inventory.get('_meta', {}).get('hostvars', {}))]
+  print(json.dumps(Plan(vms, resources, args.nodes, args.strategy, args.memory_ratio, args.cpu_ratio,
+                        args.reserved_memory, not args.no_balloon, args.anti_affinity_prefix, args.rebalance), indent=2))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,153 @@
+#!/usr/bin/python
+#
+# Start and shutdown VMs in startup order waves. VMs sharing a startup order
+# are started (or shutdown) concurrently; waves run in startup order for start
+# and reverse order for shutdown. A fleet restart takes the time of the
+# slowest VM in each wave instead of the sum of all VM timeouts.
+#
+# Commands are issued through the cluster API (pvesh) so VMs on any cluster
+# node may be scheduled from a single node.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/pve-admin-guide.html#qm_startup_and_shutdown
+# * https://pve.proxmox.com/pve-docs/api-viewer/index.html#/nodes/{node}/qemu/{vmid}/status
+# * https://pve.proxmox.com/pve-docs/pvesh.1.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import time
+
+try:
+  from ansible.module_utils import node
+except:
+  import node
+
+
+class PowerSchedule(object):
+  '''Start or shutdown VMs in startup order waves.
+
+  Attributes
+    vms: list of dict PveConfig.Ansible() results.
+    start_timeout: int seconds to wait for a KVM start.
+    shutdown_timeout: int default seconds to wait for a shutdown. The VM
+        startup 'down' value is used if set.
+    max_workers: int maximum number of VMs powered concurrently in a wave.
+  '''
+
+  def __init__(self, vms, start_timeout=300, shutdown_timeout=300, max_workers=8, run=node.Run, sleep=time.sleep):
+    '''Initialize PowerSchedule.
+
+    Args
+      vms: list of dict PveConfig.Ansible() results.
+      start_timeout: int seconds to wait for a KVM start. Default: 300.
+      shutdown_timeout: int seconds to wait for a shutdown. Default: 300.
+      max_workers: int maximum VMs powered concurrently. Default: 8.
+      run: function executing a node command; see node.Run.
+      sleep: function sleeping for given seconds; see time.sleep.
+    '''
+    self.vms = vms
+    self.start_timeout = int(start_timeout)
+    self.shutdown_timeout = int(shutdown_timeout)
+    self.max_workers = max(1, int(max_workers))
+    self._run = run
+    self._sleep = sleep
+
+  @staticmethod
+  def Waves(vms, reverse=False):
+    '''Group VMs into waves by startup order.
+
+    VMs without an order are started last (shutdown first), matching PVE.
+
+    Args
+      vms: list of dict PveConfig.Ansible() results.
+      reverse: bool True to return shutdown order. Default: False.
+
+    Returns
+      list of list of dict VMs for each wave, in execution order.
+    '''
+    waves = {}
+    for vm in vms:
+      waves.setdefault(vm.get('startup', {}).get('order'), []).append(vm)
+    order = sorted(waves, key=lambda x: (x is None, x or 0), reverse=reverse)
+    return [waves[x] for x in order]
+
+  @staticmethod
+  def _Path(vm, action):
+    '''Return str API status path for the VM.'''
+    vm_type = 'lxc' if 'lxc' in vm else 'qemu'
+    return f'/nodes/{vm["node"].split(".")[0]}/{vm_type}/{vm["vmid"]}/status/{action}'
+
+  def _Result(self, vm, action, results):
+    '''Return dict per-VM result from executed commands.'''
+    last = results[-1]
+    return {
+      'vmid': vm['vmid'],
+      'action': action,
+      'failed': not last.ok,
+      'msg': '' if last.ok else f'{" ".join(last.cmd)} failed ({last.rc}): {last.stderr.strip()}',
+      'commands': [x.cmd for x in results],
+    }
+
+  def StartVm(self, vm):
+    '''Start a single VM.
+
+    Returns
+      dict per-VM result {vmid, action, failed, msg, commands}.
+    '''
+    cmd = ['pvesh', 'create', self._Path(vm, 'start')]
+    if 'lxc' not in vm:
+      cmd += ['--timeout', str(self.start_timeout)]
+    return self._Result(vm, 'start', [self._run(cmd)])
+
+  def ShutdownVm(self, vm):
+    '''Shutdown a single VM, forcing stop if enabled and shutdown fails.
+
+    Returns
+      dict per-VM result {vmid, action, failed, msg, commands}.
+    '''
+    timeout = vm.get('startup', {}).get('down') or self.shutdown_timeout
+    cmd = ['pvesh', 'create', self._Path(vm, 'shutdown'), '--timeout', str(timeout)]
+    results = [self._run(cmd)]
+    if not results[-1].ok and vm.get('force_stop'):
+      results.append(self._run(cmd + ['--forceStop', '1']))
+    return self._Result(vm, 'shutdown', results)
+
+  def _Schedule(self, waves, action, delay=False):
+    '''Run action for each wave; VMs in a wave run concurrently.
+
+    Remaining waves are skipped if any VM in a wave fails.
+
+    Args
+      waves: list of list of dict VMs.
+      action: function applied to each VM.
+      delay: bool True to wait the largest 'up' delay of a wave before
+          starting the next wave.
+
+    Returns
+      dict {waves list of list of vmids, vm_results list of dict, failed bool}.
+    '''
+    # concurrent.futures imports logging; keep it out of module cold start.
+    from concurrent.futures import ThreadPoolExecutor
+    schedule = {'waves': [[vm['vmid'] for vm in wave] for wave in waves], 'vm_results': [], 'failed': False}
+    with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+      for index, wave in enumerate(waves):
+        results = list(pool.map(action, wave))
+        schedule['vm_results'].extend(results)
+        if any([x['failed'] for x in results]):
+          schedule['failed'] = True
+          break
+        if delay and index < len(waves) - 1:
+          up = max([vm.get('startup', {}).get('up') or 0 for vm in wave])
+          if up:
+            self._sleep(up)
+    return schedule
+
+  def Start(self):
+    '''Start VMs in startup order waves, honoring 'up' delays.'''
+    return self._Schedule(self.Waves(self.vms), self.StartVm, delay=True)
+
+  def Shutdown(self):
+    '''Shutdown VMs in reverse startup order waves, honoring 'down' timeouts.'''
+    return self._Schedule(self.Waves(self.vms, reverse=True), self.ShutdownVm)
@@ -0,0 +1,117 @@
+#!/usr/bin/python
+#
+# Build a Chrome trace-event timeline of a role run for critical path
+# analysis. Each PVE node is a track (process) with a row (thread) per VM;
+# every role task is a span, nested inside spans for the task files it was
+# included from (provision.yml > reconfigure.yml > operations/resize.yml).
+# Load the JSON in chrome://tracing, https://ui.perfetto.dev or speedscope.
+# Used by the pve_trace callback plugin; not named 'trace' because plugins put
+# module_utils first on sys.path, which would shadow the standard library.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://docs.google.com/document/d/1CvAClvFfyA5R-PhYUmn5OOQtYMH4h6I0nSsKchNAySU
+# * https://ui.perfetto.dev
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import json
+
+try:
+  from ansible.module_utils import files
+except:
+  import files
+
+
+class Trace(object):
+  '''Trace-event timeline of role tasks.
+
+  Tasks carry their include chain: the task files (and the include instance
+  that loaded each) from the outermost file to the file defining the task.
+  Each include instance is a span covering all tasks run from it, including
+  tasks of files it included in turn.
+
+  Attributes
+    tasks: list of dict recorded tasks.
+    spans: dict of tuple (host, vmid, include key) to dict task file span.
+  '''
+  fleet = 'fleet'
+
+  def __init__(self):
+    self.tasks = []
+    self.spans = {}
+    self._nodes = {}
+
+  def Node(self, vmid, node):
+    '''Record the cluster node a VM resides on; its events use that track.'''
+    if vmid and node:
+      self._nodes[str(vmid)] = str(node).split('.')[0]
+
+  def Task(self, host, vmid, node, includes, name, start, end, status, phase=None):
+    '''Record a role task.
+
+    Args
+      host: str inventory host the task ran for.
+      vmid: str VMID; '' for tasks not specific to a VM.
+      node: str cluster node the task ran on (delegate_to or host).
+      includes: list of tuple (include key, str task file), outermost first;
+          the last entry is the file defining the task. Keys identify an
+          include instance (e.g. one loop iteration of include_tasks).
+      name: str templated task name.
+      start: float task start (seconds, monotonic).
+      end: float task end (seconds, monotonic).
+      status: str task outcome.
+      phase: str provisioning phase. Optional.
+    '''
+    vmid = str(vmid or '')
+    node = str(node or host).split('.')[0]
+    self.tasks.append({'host': host, 'vmid': vmid, 'node': node, 'file': includes[-1][1] if includes else '',
+                       'name': name, 'start': start, 'end': end, 'status': status, 'phase': phase})
+    for key, task_file in includes:
+      span = self.spans.setdefault((host, vmid, key), {'file': task_file, 'vmid': vmid, 'node': node,
+                                                      'start': start, 'end': end})
+      span['start'] = min(span['start'], start)
+      span['end'] = max(span['end'], end)
+
+  def _Track(self, vmid, node):
+    '''Return tuple (str node, str row) for an event.'''
+    return self._nodes.get(vmid, node), vmid or self.fleet
+
+  def Events(self):
+    '''Return list of dict trace events (microseconds from the first task).'''
+    if not self.tasks:
+      return []
+    origin = min([x['start'] for x in self.tasks])
+    us = lambda x: round((x - origin) * 1e6)
+
+    spans = []
+    for span in self.spans.values():
+      node, row = self._Track(span['vmid'], span['node'])
+      spans.append((node, row, {'name': span['file'], 'cat': 'task_file', 'ph': 'X', 'ts': us(span['start']),
+                                'dur': us(span['end']) - us(span['start']), 'args': {'vmid': span['vmid']}}))
+    for task in self.tasks:
+      node, row = self._Track(task['vmid'], task['node'])
+      spans.append((node, row, {'name': task['name'], 'cat': task['phase'] or 'task', 'ph': 'X',
+                                'ts': us(task['start']), 'dur': us(task['end']) - us(task['start']),
+                                'args': {'file': task['file'], 'status': task['status'], 'host': task['host'],
+                                         'ran_on': task['node']}}))
+
+    pids = {x: i + 1 for i, x in enumerate(sorted(set([x[0] for x in spans])))}
+    rows = sorted(set([(x[0], x[1]) for x in spans]), key=lambda x: (x[0], x[1] != self.fleet, int(x[1]) if x[1].isdigit() else 0, x[1]))
+    tids = {}
+    events = []
+    for node, pid in pids.items():
+      events.append({'name': 'process_name', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'name': node}})
+      events.append({'name': 'process_sort_index', 'ph': 'M', 'pid': pid, 'tid': 0, 'args': {'sort_index': pid}})
+    for node, row in rows:
+      tids[(node, row)] = int(row) if row.isdigit() else 0
+      events.append({'name': 'thread_name', 'ph': 'M', 'pid': pids[node], 'tid': tids[(node, row)], 'args': {'name': row}})
+    # Longest first so parents precede children with the same start time.
+    for node, row, event in sorted(spans, key=lambda x: (x[2]['ts'], -x[2]['dur'])):
+      events.append(dict(event, pid=pids[node], tid=tids[(node, row)]))
+    return events
+
+  def Write(self, path):
+    '''Atomically write the trace JSON (object format) to path.'''
+    files.WriteAtomic(path, json.dumps({'traceEvents': self.Events(), 'displayTimeUnit': 'ms'}))
@@ -0,0 +1,319 @@
+#!/usr/bin/python
+#
+# Long-lived PveConfig parse service for controller-side tooling (CMDB sync,
+# pre-commit validation of host_vars). Each kvm_config/lxc_config module call
+# starts a new interpreter, imports data/parsers and compiles the option
+# matchers; the service pays that once and keeps a parse cache warm.
+#
+# Protocol: JSON lines over a Unix socket. Each request is a single line; each
+# response is a single line with the same 'id'.
+#
+#   {"id": 1, "params": {"vmid": 100, "node": "pm1", "config": "..."}}
+#   {"id": 1, "ok": true, "result": {... PveConfig.Ansible() ...}}
+#   {"id": 2, "op": "stats"}
+#   {"id": 2, "ok": true, "result": {"hits": 0, "misses": 1, "size": 1}}
+#
+# Usage (from module_utils):
+#
+#   python3 service.py serve --socket /tmp/pve_parse.sock
+#   python3 service.py benchmark --requests 200
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://docs.python.org/3/library/socketserver.html
+# * https://jsonlines.org/
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+from collections import OrderedDict
+import argparse
+import hashlib
+import json
+import os
+import socket
+import socketserver
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+try:
+  from ansible.module_utils import parsers
+except:
+  import parsers
+
+
+class ParseCache(object):
+  '''Thread-safe LRU cache of serialized PveConfig.Ansible() results.
+
+  Results are keyed by the sha1 of the canonical (sorted) JSON params and
+  stored serialized, so cached responses are never mutated by callers.
+
+  Attributes
+    size: int maximum cached results.
+    hits: int cache hits.
+    misses: int cache misses.
+  '''
+
+  def __init__(self, size=1024):
+    '''Initialize ParseCache.
+
+    Args
+      size: int maximum cached results. Default: 1024.
+    '''
+    self.size = max(1, int(size))
+    self.hits = 0
+    self.misses = 0
+    self._cache = OrderedDict()
+    self._lock = threading.Lock()
+
+  @staticmethod
+  def Key(params):
+    '''Return str cache key for module params.'''
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+  def Parse(self, params):
+    '''Return str JSON PveConfig.Ansible() result for module params.
+
+    Raises
+      ValueError, KeyError, TypeError for invalid params (see PveConfig).
+    '''
+    key = self.Key(params)
+    with self._lock:
+      if key in self._cache:
+        self.hits += 1
+        self._cache.move_to_end(key)
+        return self._cache[key]
+      self.misses += 1
+
+    result = json.dumps(parsers.PveConfig(params).Ansible())
+    with self._lock:
+      self._cache[key] = result
+      while len(self._cache) > self.size:
+        self._cache.popitem(last=False)
+    return result
+
+  def Stats(self):
+    '''Return dict cache statistics {hits, misses, size}.'''
+    with self._lock:
+      return {'hits': self.hits, 'misses': self.misses, 'size': len(self._cache)}
+
+
+class _Handler(socketserver.StreamRequestHandler):
+  '''Serve JSON-lines requests until the client disconnects.'''
+
+  def _Response(self, line):
+    '''Return str JSON response for a request line.'''
+    request_id = None
+    try:
+      request = json.loads(line)
+      request_id = request.get('id')
+      if request.get('op', 'parse') == 'stats':
+        result = json.dumps(self.server.cache.Stats())
+      elif request.get('op', 'parse') == 'parse':
+        result = self.server.cache.Parse(request['params'])
+      else:
+        raise ValueError(f'unknown op: {request["op"]}')
+    except Exception as e:
+      return json.dumps({'id': request_id, 'ok': False, 'error': f'{type(e).__name__}: {e}'})
+    return f'{{"id": {json.dumps(request_id)}, "ok": true, "result": {result}}}'
+
+  def handle(self):
+    for line in self.rfile:
+      if not line.strip():
+        continue
+      self.wfile.write(f'{self._Response(line)}\n'.encode())
+      self.wfile.flush()
+
+
+class ParseService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+  '''PveConfig parse service listening on a Unix socket.
+
+  Attributes
+    path: str Unix socket path.
+    cache: ParseCache shared by all connections.
+  '''
+  daemon_threads = True
+
+  def __init__(self, path, cache_size=1024):
+    '''Initialize ParseService. The socket is created user-only (0600).
+
+    Args
+      path: str Unix socket path. An existing socket is replaced.
+      cache_size: int maximum cached parse results. Default: 1024.
+    '''
+    self.path = path
+    self.cache = ParseCache(cache_size)
+    if os.path.exists(path):
+      os.unlink(path)
+    umask = os.umask(0o177)
+    try:
+      super().__init__(path, _Handler)
+    finally:
+      os.umask(umask)
+
+  def server_close(self):
+    super().server_close()
+    if os.path.exists(self.path):
+      os.unlink(self.path)
+
+
+class Client(object):
+  '''Client for ParseService. Requests on a connection are sequential.
+
+  Attributes
+    path: str Unix socket path.
+  '''
+
+  def __init__(self, path, timeout=30):
+    '''Initialize Client and connect to the service.
+
+    Args
+      path: str Unix socket path.
+      timeout: int seconds to wait for a response. Default: 30.
+    '''
+    self.path = path
+    self._id = 0
+    self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    self._sock.settimeout(timeout)
+    self._sock.connect(path)
+    self._file = self._sock.makefile('rwb')
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def Close(self):
+    '''Close the connection.'''
+    self._file.close()
+    self._sock.close()
+
+  def Request(self, request):
+    '''Return dict result for a request.
+
+    Raises
+      ValueError if the service failed the request.
+    '''
+    self._id += 1
+    request = dict(request, id=self._id)
+    self._file.write(f'{json.dumps(request)}\n'.encode())
+    self._file.flush()
+    response = json.loads(self._file.readline())
+    if not response['ok']:
+      raise ValueError(response['error'])
+    return response['result']
+
+  def Parse(self, params):
+    '''Return dict PveConfig.Ansible() result for module params.'''
+    return self.Request({'op': 'parse', 'params': params})
+
+  def Stats(self):
+    '''Return dict service cache statistics.'''
+    return self.Request({'op': 'stats'})
+
+
+def _ColdParse(params):
+  '''Parse params in a new interpreter, as a kvm_config module call does.'''
+  code = 'import json, sys, parsers; print(json.dumps(parsers.PveConfig(json.load(sys.stdin)).Ansible()))'
+  proc = subprocess.run([sys.executable, '-c', code], input=json.dumps(params), capture_output=True,
+                        text=True, cwd=os.path.dirname(os.path.abspath(__file__)), check=True)
+  return json.loads(proc.stdout)
+
+
+def Benchmark(requests, path=None):
+  '''Compare requests per second of cold per-process parsing and the service.
+
+  Args
+    requests: list of dict module params to parse.
+    path: str Unix socket path. Default: temporary socket.
+
+  Returns
+    dict benchmark results.
+    {
+      'requests': 200,
+      'cold_rps': 25.1,
+      'warm_rps': 4100.7,
+      'cached_rps': 15400.2,
+      'speedup': 163.4,
+    }
+  '''
+  tmp = None
+  if path is None:
+    tmp = tempfile.TemporaryDirectory()
+    path = os.path.join(tmp.name, 'parse.sock')
+
+  start = time.perf_counter()
+  for params in requests:
+    _ColdParse(params)
+  cold = time.perf_counter() - start
+
+  server = ParseService(path, cache_size=len(requests) or 1)
+  thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+  thread.start()
+  try:
+    with Client(path) as client:
+      start = time.perf_counter()
+      for params in requests:
+        client.Parse(params)
+      warm = time.perf_counter() - start
+      start = time.perf_counter()
+      for params in requests:
+        client.Parse(params)
+      cached = time.perf_counter() - start
+  finally:
+    server.shutdown()
+    server.server_close()
+    if tmp:
+      tmp.cleanup()
+
+  n = len(requests)
+  return {
+    'requests': n,
+    'cold_rps': round(n / cold, 1) if cold else 0.0,
+    'warm_rps': round(n / warm, 1) if warm else 0.0,
+    'cached_rps': round(n / cached, 1) if cached else 0.0,
+    'speedup': round(cold / warm, 1) if warm else 0.0,
+  }
+
+
+def _BenchmarkRequests(count):
+  '''Return list of distinct KVM and LXC module params.'''
+  requests = []
+  for vmid in range(100, 100 + count):
+    if vmid % 2:
+      config = f'rootfs: local-lvm:vm-{vmid}-disk-0,size=4G\ncores: 2\nmemory: 1024\nnet0: name=eth0,bridge=vmbr0,ip=dhcp'
+    else:
+      config = f'scsi0: local-lvm:vm-{vmid}-disk-0,size=8G\ncores: 4\nmemory: 4096\nnet0: virtio,bridge=vmbr0'
+    requests.append({'vmid': vmid, 'node': 'pm1.example.com', 'config': config})
+  return requests
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='PveConfig parse service.')
+  commands = parser.add_subparsers(dest='command', required=True)
+  serve = commands.add_parser('serve', help='serve parse requests on a Unix socket')
+  serve.add_argument('--socket', required=True, help='Unix socket path')
+  serve.add_argument('--cache-size', type=int, default=1024, help='maximum cached parse results')
+  benchmark = commands.add_parser('benchmark', help='compare cold parsing against the service')
+  benchmark.add_argument('--requests', type=int, default=100, help='number of distinct configs parsed')
+  args = parser.parse_args(argv)
+
+  if args.command == 'benchmark':
+    print(json.dumps(Benchmark(_BenchmarkRequests(args.requests)), indent=2))
+    return
+
+  server = ParseService(args.socket, args.cache_size)
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+
+
+if __name__ == '__main__':
+  main()
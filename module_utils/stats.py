@@ -0,0 +1,27 @@
+#!/usr/bin/python
+#
+# Summary statistics for durations reported by modules and callbacks. Kept
+# free of other role module_utils so controller plugins (pve_metrics) load
+# nothing else.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://en.wikipedia.org/wiki/Percentile#The_nearest-rank_method
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import math
+
+
+def Percentile(values, percent):
+  '''Return nearest-rank percentile of values, or 0.0 if empty.
+
+  Args
+    values: list of float values.
+    percent: float percentile (0-100].
+  '''
+  if not values:
+    return 0.0
+  ordered = sorted(values)
+  return ordered[max(0, math.ceil(percent / 100 * len(ordered)) - 1)]
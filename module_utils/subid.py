@@ -0,0 +1,74 @@
+#!/usr/bin/python
+#
+# Merge subordinate user/group ID ranges (/etc/subuid, /etc/subgid) for LXC
+# ID mapping in a single read-modify-write per file.
+#
+# Run unittests from module_utils: python3 -m unittest
+#
+# Reference:
+# * https://pve.proxmox.com/wiki/Unprivileged_LXC_containers
+# * https://man7.org/linux/man-pages/man5/subuid.5.html
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+import os
+
+try:
+  from ansible.module_utils import files
+except:
+  import files
+
+
+def Merge(lines, entries):
+  '''Merge subordinate ID entries into existing file lines.
+
+  Existing lines are kept in order; entries not already present (exact
+  match) are appended once.
+
+  Args
+    lines: list of str existing file lines.
+    entries: list of str entries, e.g. ['root:1005:1'].
+
+  Returns
+    tuple (list of str merged lines, list of str added entries).
+  '''
+  present = set([x.strip() for x in lines])
+  added = []
+  for entry in entries:
+    entry = entry.strip()
+    if entry and entry not in present:
+      present.add(entry)
+      added.append(entry)
+  return lines + added, added
+
+
+def Apply(path, entries, check_mode=False):
+  '''Merge entries into a subordinate ID file atomically.
+
+  The file is written to a temporary file in the same directory and renamed
+  over the original, preserving ownership and permissions. A missing file is
+  created root:root 0644.
+
+  Args
+    path: str file path, e.g. '/etc/subuid'.
+    entries: list of str entries, e.g. ['root:1005:1'].
+    check_mode: bool True to report changes without writing. Default: False.
+
+  Returns
+    list of str added entries.
+  '''
+  lines = []
+  stat = None
+  if os.path.exists(path):
+    stat = os.stat(path)
+    with open(path) as f:
+      lines = f.read().splitlines()
+
+  merged, added = Merge(lines, entries)
+  if not added or check_mode:
+    return added
+
+  files.WriteAtomic(path, ''.join([f'{x}\n' for x in merged]),
+                    perms=stat.st_mode & 0o7777 if stat else 0o644,
+                    owner=(stat.st_uid, stat.st_gid) if stat and os.geteuid() == 0 else None)
+  return added
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+#
+# Benchmark node apply (node.NodeApply through executor.Executor) throughput
+# and tail latency. Fake qm, pvesm, pct and pvesh commands (tests/bin) are
+# placed on PATH and sleep for the given latency per command; configs are
+# written to a temporary directory. Run from 'module_utils' with
+#
+#   python3 -m tests.benchmark --vms 100 --latency 0.05
+#
+# Each VM allocates two disks on one storage, is rescanned and has cloud init
+# mounted. Applied sequentially (one command at a time) and with the given
+# node and storage limits.
+#
+# Reference:
+# * https://pve.proxmox.com/pve-docs/pvesm.1.html
+
+import argparse
+import executor
+import json
+import node
+import os
+import shutil
+import tempfile
+
+
+def Vms(count, storage='local-lvm', node_name='pm1'):
+  '''Return list of minimal PveConfig.Ansible()-like results to apply.'''
+  vms = []
+  for vmid in range(100, 100 + count):
+    disks = []
+    for index in range(2):
+      name = f'vm-{vmid}-disk-{index}'
+      disks.append({'disk': f'scsi{index}', 'file': f'{storage}:{name}', 'fullname': name,
+                    'storage': storage, 'size': '4G', 'format': None})
+    vms.append({
+      'vmid': vmid,
+      'node': node_name,
+      'config_list_canonical': [f'{x["disk"]}: {x["file"]},size=4G' for x in disks],
+      'disks': disks,
+      'isos': [],
+      'cloud_init': {'mountpoint': 'ide0', 'storage': storage},
+    })
+  return vms
+
+
+def Benchmark(vms, config_dir, node_limit, storage_limit):
+  '''Return dict executor stats for applying vms.'''
+  runner = executor.Executor(node_limit=node_limit, storage_limit=storage_limit)
+  results = node.NodeApply(vms, config_dir=config_dir, executor=runner).Apply()
+  stats = runner.Stats()
+  stats['vms_failed'] = len([x for x in results if x['failed']])
+  return stats
+
+
+def main(argv=None):
+  parser = argparse.ArgumentParser(description='Benchmark node apply against fake node commands.')
+  parser.add_argument('--vms', type=int, default=50, help='number of VMs applied')
+  parser.add_argument('--latency', type=float, default=0.05, help='fake command latency in seconds')
+  parser.add_argument('--node-limit', type=int, default=8, help='concurrent commands per node')
+  parser.add_argument('--storage-limit', type=int, default=2, help='concurrent commands per storage')
+  args = parser.parse_args(argv)
+
+  work_dir = tempfile.mkdtemp()
+  os.environ['PATH'] = os.pathsep.join([os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bin'), os.environ['PATH']])
+  os.environ['FAKE_PVE_LATENCY'] = str(args.latency)
+  try:
+    vms = Vms(args.vms)
+    results = {}
+    for name, node_limit, storage_limit in (('sequential', 1, 1), ('concurrent', args.node_limit, args.storage_limit)):
+      config_dir = os.path.join(work_dir, name)
+      os.makedirs(os.path.join(config_dir, 'qemu-server'))
+      results[name] = Benchmark(vms, config_dir, node_limit, storage_limit)
+  finally:
+    shutil.rmtree(work_dir)
+  results['speedup'] = round(results['sequential']['duration'] / results['concurrent']['duration'], 2)
+  print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+  main()
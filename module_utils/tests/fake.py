@@ -0,0 +1,154 @@
+# Fake PVE node commands (tests/bin), cluster node copies and image server for
+# unittests.
+
+import http.server
+import json
+import node
+import os
+import shlex
+import tempfile
+import threading
+
+
+class FakePve(object):
+  '''Place fake qm, pvesm, pct and pvesh commands on PATH.
+
+  Invocations are recorded to a log in a temporary directory, which also
+  serves as the pmxcfs config directory (config_dir).
+  '''
+
+  def __init__(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.config_dir = self.tmp.name
+    os.makedirs(os.path.join(self.config_dir, 'qemu-server'))
+    os.makedirs(os.path.join(self.config_dir, 'lxc'))
+    self.log = os.path.join(self.tmp.name, 'commands.log')
+    self.content = os.path.join(self.tmp.name, 'content.json')
+    self.env = dict(os.environ)
+    os.environ['PATH'] = os.pathsep.join([os.path.join(os.path.dirname(__file__), 'bin'), os.environ['PATH']])
+    os.environ['FAKE_PVE_LOG'] = self.log
+    os.environ['FAKE_PVESH_CONTENT'] = self.content
+    self.routes = os.path.join(self.tmp.name, 'routes')
+    os.makedirs(self.routes)
+    os.environ['FAKE_PVESH_ROUTES'] = self.routes
+    self.Content([])
+
+  def Cleanup(self):
+    os.environ.clear()
+    os.environ.update(self.env)
+    self.tmp.cleanup()
+
+  def Content(self, volids):
+    '''Set volume IDs returned for storage content listings.'''
+    with open(self.content, 'w') as f:
+      json.dump([{'volid': x} for x in volids], f)
+
+  def Route(self, path, response):
+    '''Set json response returned by 'pvesh get' for an API path.'''
+    with open(os.path.join(self.routes, f'{path.replace("/", "_")}.json'), 'w') as f:
+      json.dump(response, f)
+
+  def Commands(self):
+    '''Return list of str commands executed.'''
+    if not os.path.exists(self.log):
+      return []
+    with open(self.log) as f:
+      return f.read().splitlines()
+
+
+class FakeNodes(object):
+  '''Fake 'ssh' and 'scp' runner for cluster node to node copies.
+
+  Remote node files are kept in memory keyed by (node, path). Remote shell
+  commands are '&&' separated mkdir, 'stat -c "%s %Y"' and cat commands. Use
+  as the 'run' callable for node commands.
+
+  Attributes
+    files: dict {(node, path): bytes} remote node file contents.
+    mtimes: dict {(node, path): int} remote node file mtimes (scp -p).
+    commands: list of list command executed.
+    unreachable: set of str nodes which fail all commands.
+  '''
+
+  def __init__(self):
+    self.files = {}
+    self.mtimes = {}
+    self.commands = []
+    self.unreachable = set()
+
+  def __call__(self, cmd, ok_rc=(0,), timeout=None):
+    self.commands.append(cmd)
+    if cmd[0] == 'ssh':
+      host = cmd[-2].split('@')[-1]
+      if host in self.unreachable:
+        return node.CommandResult(cmd, 255, '', 'unreachable', ok=False)
+      args = shlex.split(cmd[-1])
+      stdout = ''
+      while args:
+        command = args[:args.index('&&')] if '&&' in args else args
+        args = args[len(command) + 1:]
+        if command[0] == 'mkdir':
+          continue
+        path = command[-1]
+        if (host, path) not in self.files:
+          return node.CommandResult(cmd, 1, stdout, 'No such file', ok=1 in ok_rc)
+        if command[0] == 'stat':
+          stdout += f'{len(self.files[(host, path)])} {self.mtimes.get((host, path), 0)}\n'
+        else:
+          stdout += self.files[(host, path)].decode()
+      return node.CommandResult(cmd, 0, stdout, '')
+
+    host, directory = cmd[-1].split('@')[-1].split(':', 1)
+    if host in self.unreachable:
+      return node.CommandResult(cmd, 1, '', 'unreachable', ok=False)
+    path = os.path.join(directory, os.path.basename(cmd[-2]))
+    with open(cmd[-2], 'rb') as f:
+      self.files[(host, path)] = f.read()
+    self.mtimes[(host, path)] = int(os.stat(cmd[-2]).st_mtime)
+    return node.CommandResult(cmd, 0)
+
+  def Copies(self):
+    '''Return list of (str node, str file name) copied with scp.'''
+    return [(x[-1].split('@')[-1].split(':')[0], os.path.basename(x[-2])) for x in self.commands if x[0] == 'scp']
+
+
+class FakeImageServer(object):
+  '''Serve files from a temporary directory over HTTP on localhost.
+
+  Attributes
+    root: str directory served.
+    requests: list of str paths requested.
+  '''
+
+  def __init__(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.root = self.tmp.name
+    self.requests = []
+    server = self
+
+    class Handler(http.server.SimpleHTTPRequestHandler):
+
+      def __init__(self, *args, **kwargs):
+        super().__init__(*args, directory=server.root, **kwargs)
+
+      def do_GET(self):
+        server.requests.append(self.path)
+        super().do_GET()
+
+      def log_message(self, *args):
+        pass
+
+    self.httpd = http.server.ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+    self.thread = threading.Thread(target=self.httpd.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    self.thread.start()
+
+  def Add(self, name, content):
+    '''Serve content as name; return str url.'''
+    with open(os.path.join(self.root, name), 'wb') as f:
+      f.write(content)
+    return f'http://127.0.0.1:{self.httpd.server_port}/{name}'
+
+  def Cleanup(self):
+    self.httpd.shutdown()
+    self.httpd.server_close()
+    self.tmp.cleanup()
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+#
+# Test linked clone provisioning. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import fake
+from tests import params
+import clone
+import os
+import parsers
+import unittest
+
+
+def CloudInitVm(vmid=100) -> dict:
+  base = params.KvmCloudInitRequired()
+  base.update({
+    'vmid': vmid,
+    'template': {'url': 'https://example.com/debian-11-genericcloud-amd64.qcow2', 'checksum': 'AB' * 32, 'algorithm': 'sha256'},
+    'config': f'scsi0: local-lvm:vm-{vmid}-disk-0,size=8G\nmemory: 2048',
+  })
+  return parsers.PveConfig(base).Ansible()
+
+
+class TestLinkedClone(unittest.TestCase):
+
+  def setUp(self):
+    self.fake = fake.FakePve()
+    self.fake.Route('/storage/local-lvm', {'type': 'lvmthin'})
+    self.fake.Route('/cluster/resources', [
+      {'vmid': 9000, 'node': 'pm2', 'template': 1, 'tags': 'ci-abababababababab-local-lvm'},
+      {'vmid': 9001, 'node': 'pm1', 'template': 0},
+      {'vmid': 100, 'node': 'pm1'},
+    ])
+
+  def tearDown(self):
+    self.fake.Cleanup()
+
+  def test_tag(self):
+    self.assertEqual(clone.LinkedClone(CloudInitVm(), '/d.raw').Tag(), 'ci-abababababababab-local-lvm')
+
+  def test_template_created_once(self):
+    result = clone.LinkedClone(CloudInitVm(), '/var/lib/vz/template/qemu/debian.qcow2').Apply()
+    self.assertDictEqual({x: result[x] for x in ('linked', 'template_vmid', 'template_created')},
+        {'linked': True, 'template_vmid': 9002, 'template_created': True})
+    self.assertListEqual([x for x in self.fake.Commands() if x.startswith('qm')], [
+        'qm create 9002 --name ci-debian-11-genericcloud-amd64 --memory 512 --tags ci-abababababababab-local-lvm',
+        'qm importdisk 9002 /var/lib/vz/template/qemu/debian.qcow2 local-lvm',
+        'qm set 9002 --scsi0 local-lvm:vm-9002-disk-0',
+        'qm template 9002',
+        'qm clone 9002 100 --full 0',
+    ])
+
+  def test_existing_template_cloned(self):
+    vm = CloudInitVm(101)
+    vm['node'] = 'pm2.example.com'
+    result = clone.LinkedClone(vm, '/d.raw').Apply()
+    self.assertEqual(result['template_vmid'], 9000)
+    self.assertFalse(result['template_created'])
+    self.assertListEqual([x for x in self.fake.Commands() if x.startswith('qm')], ['qm clone 9000 101 --full 0'])
+
+  def test_template_skips_inventory_vmid(self):
+    # pve_kvm 9002 on pm2 is provisioned after VM 100 on pm1.
+    result = clone.LinkedClone(CloudInitVm(), '/d.raw', reserved=[100, 9002, 9003]).Apply()
+    self.assertEqual(result['template_vmid'], 9004)
+    self.assertIn('qm create 9004 --name ci-debian-11-genericcloud-amd64 --memory 512 --tags ci-abababababababab-local-lvm',
+        self.fake.Commands())
+
+  def test_inventory_vmid_is_template(self):
+    vm = CloudInitVm(101)
+    vm['node'] = 'pm2.example.com'
+    self.assertRaisesRegex(RuntimeError, 'inventory VMID 9000 is image template VM',
+        clone.LinkedClone(vm, '/d.raw', reserved=[101, 9000]).Apply)
+    self.assertListEqual([x for x in self.fake.Commands() if x.startswith('qm')], [])
+
+  def test_is_template(self):
+    self.assertTrue(clone.IsTemplate({'vmid': 9000, 'template': 1, 'tags': 'pve-fp-1;ci-abababababababab-local-lvm'}))
+    self.assertFalse(clone.IsTemplate({'vmid': 9000, 'template': 0, 'tags': 'ci-abababababababab-local-lvm'}))
+    self.assertFalse(clone.IsTemplate({'vmid': 9000, 'template': 1, 'tags': 'golden'}))
+
+  def test_unsupported_storage(self):
+    self.fake.Route('/storage/local-lvm', {'type': 'dir'})
+    self.assertFalse(clone.LinkedClone(CloudInitVm(), '/d.raw').Apply()['linked'])
+    self.assertListEqual([x for x in self.fake.Commands() if x.startswith('qm')], [])
+
+  def test_base_volume_storage(self):
+    # ZFS/RBD linked clones are named base-9000-disk-0/vm-100-disk-0.
+    for storage_type in ('zfspool', 'rbd'):
+      self.fake.Route('/storage/local-lvm', {'type': storage_type})
+      self.assertFalse(clone.LinkedClone(CloudInitVm(), '/d.raw').Supported())
+
+  def test_unexpected_root_disk_name(self):
+    vm = CloudInitVm()
+    vm['root']['fullname'] = 'vm-100-disk-1'
+    self.assertFalse(clone.LinkedClone(vm, '/d.raw').Apply()['linked'])
+    self.assertListEqual(self.fake.Commands(), [])
+
+  def test_command_failure(self):
+    os.environ['FAKE_QM_RC'] = '2'
+    self.assertRaises(RuntimeError, clone.LinkedClone(CloudInitVm(), '/d.raw').Apply)
+
+
+if __name__ == '__main__':
+  unittest.main()
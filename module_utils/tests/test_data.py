@@ -41,6 +41,20 @@ class TestImageOption(unittest.TestCase):
     self.assertEqual(i.name, 'debian-11.1.0-amd64-netinst')
     self.assertEqual(i.extension, 'iso')
 
+  def test_as_dict(self):
+    i = data.ImageMap(**params.TemplateIso()['template'])
+    self.assertListEqual(list(i.AsDict()), ['url', 'checksum', 'algorithm', 'file', 'name', 'extension'])
+    self.assertEqual(i, data.ImageMap(**params.TemplateIso()['template']))
+
+
+class TestLineMatcher(unittest.TestCase):
+
+  def test_compiled_on_first_use(self):
+    matcher = data.LineMatcher('(^mp)(\\d+)', data.PveType.MP)
+    self.assertIsNone(matcher._regex)
+    self.assertTrue(matcher.regex.match('mp0'))
+    self.assertIs(matcher.regex, matcher._regex)
+
 
 class TestSecondaryOption(unittest.TestCase):
 
@@ -303,5 +317,42 @@ class TestStringConversion(unittest.TestCase):
       comment.Cli()
 
 
+class TestCanonicalConversion(unittest.TestCase):
+
+  def test_default_key_omitted(self):
+    config = data.PveConfigOption('scsi0: file=local-lvm:vm-100-disk-0,ssd=1,size=4G')
+    self.assertEqual(config.Config(canonical=True), 'scsi0: local-lvm:vm-100-disk-0,size=4G,ssd=1')
+
+  def test_default_key_sorted_first(self):
+    config = data.PveConfigOption('agent: enabled=1,type=virtio,fstrim_cloned_disks=1')
+    self.assertEqual(config.Config(canonical=True), 'agent: 1,fstrim_cloned_disks=1,type=virtio')
+
+  def test_kvm_net_model_alias(self):
+    config = data.PveConfigOption('net0: firewall=1,virtio=AA:BB:CC:DD:EE:FF,bridge=vmbr0', config=data.PveConfigType.KVM)
+    self.assertEqual(config.Config(canonical=True), 'net0: virtio=AA:BB:CC:DD:EE:FF,bridge=vmbr0,firewall=1')
+
+  def test_kvm_net_model_macaddr(self):
+    config = data.PveConfigOption('net0: model=e1000,macaddr=AA:BB:CC:DD:EE:FF,bridge=vmbr0', config=data.PveConfigType.KVM)
+    self.assertEqual(config.Config(canonical=True), 'net0: e1000=AA:BB:CC:DD:EE:FF,bridge=vmbr0')
+
+  def test_lxc_required_keys_first(self):
+    net = data.PveConfigOption('net0: type=veth,bridge=vmbr0,name=eth0,ip=dhcp', config=data.PveConfigType.LXC)
+    mp = data.PveConfigOption('mp0: volume=/d,ro=1,mp=/data', config=data.PveConfigType.LXC)
+    self.assertEqual(net.Config(canonical=True), 'net0: name=eth0,bridge=vmbr0,ip=dhcp,type=veth')
+    self.assertEqual(mp.Config(canonical=True), 'mp0: /d,mp=/data,ro=1')
+
+  def test_verbatim_keys(self):
+    config = data.PveConfigOption('startup: order=2,up=30,down=10')
+    self.assertEqual(config.Config(canonical=True), 'startup: order=2,up=30,down=10')
+
+  def test_comment_encoded(self):
+    comment = data.PveConfigOption('# note: see docs')
+    self.assertEqual(comment.Config(canonical=True), '# note%3A see docs')
+
+  def test_lxc_extension_unchanged(self):
+    config = data.PveConfigOption('lxc.idmap: u 0 100000 1005', config=data.PveConfigType.LXC)
+    self.assertEqual(config.Config(canonical=True), 'lxc.idmap: u 0 100000 1005')
+
+
 if __name__ == '__main__':
   unittest.main()
@@ -0,0 +1,139 @@
+#!/usr/bin/python
+#
+# Test asyncio node commands and executor limits. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Fake qm, pvesm, pct and pvesh commands (tests/bin) are placed on PATH and
+# sleep for FAKE_PVE_LATENCY seconds.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import fake
+import asyncio
+import executor
+import node
+import os
+import time
+import unittest
+
+
+class TestRunAsync(unittest.TestCase):
+
+  def setUp(self):
+    self.fake = fake.FakePve()
+
+  def tearDown(self):
+    self.fake.Cleanup()
+
+  def test_command(self):
+    result = asyncio.run(executor.RunAsync(['qm', 'start', '100']))
+    self.assertTrue(result.ok)
+    self.assertListEqual(self.fake.Commands(), ['qm start 100'])
+
+  def test_accepted_return_code(self):
+    os.environ['FAKE_PVESM_RC'] = '5'
+    self.assertFalse(asyncio.run(executor.RunAsync(['pvesm', 'alloc', 'local-lvm', '100', 'vm-100-disk-1', '4G'])).ok)
+    self.assertTrue(asyncio.run(executor.RunAsync(['pvesm', 'alloc', 'local-lvm', '100', 'vm-100-disk-1', '4G'], ok_rc=(0, 5))).ok)
+
+  def test_commands_run_concurrently(self):
+    os.environ['FAKE_PVE_LATENCY'] = '0.2'
+
+    async def RunAll():
+      return await asyncio.gather(*[executor.RunAsync(['qm', 'start', str(x)]) for x in range(4)])
+
+    started = time.monotonic()
+    results = asyncio.run(RunAll())
+    self.assertLess(time.monotonic() - started, 4 * 0.2 * 0.75)
+    self.assertTrue(all([x.ok for x in results]))
+
+  def test_command_timeout_killed(self):
+    os.environ['FAKE_PVE_LATENCY_SHUTDOWN'] = '5'
+    started = time.monotonic()
+    result = asyncio.run(executor.RunAsync(['qm', 'shutdown', '100'], timeout=0.2))
+    self.assertFalse(result.ok)
+    self.assertIn('timeout after 0.2 seconds', result.stderr)
+    self.assertLess(time.monotonic() - started, 2)
+
+  def test_missing_command(self):
+    result = asyncio.run(executor.RunAsync(['pve-missing-command']))
+    self.assertIsInstance(result, node.CommandResult)
+    self.assertFalse(result.ok)
+
+
+class FakeRun(object):
+  '''Record concurrent commands per storage and in total.'''
+
+  def __init__(self, latency=0.05):
+    self.latency = latency
+    self.active = {}
+    self.peak = {}
+    self.timeouts = []
+
+  async def __call__(self, cmd, ok_rc=(0,), timeout=None):
+    self.timeouts.append(timeout)
+    keys = ['node'] + ([cmd[2]] if cmd[:2] == ['pvesm', 'alloc'] else [])
+    for key in keys:
+      self.active[key] = self.active.get(key, 0) + 1
+      self.peak[key] = max(self.peak.get(key, 0), self.active[key])
+    await asyncio.sleep(self.latency)
+    for key in keys:
+      self.active[key] -= 1
+    rc = 1 if cmd[1] == 'destroy' else 0
+    return node.CommandResult(cmd, rc, '', '', ok=rc in ok_rc)
+
+
+class TestExecutor(unittest.TestCase):
+
+  def Alloc(self, storage, vmid):
+    return ['pvesm', 'alloc', storage, str(vmid), f'vm-{vmid}-disk-1', '4G']
+
+  def test_storage(self):
+    self.assertEqual(executor.Executor.Storage(self.Alloc('local-lvm', 100)), 'local-lvm')
+    self.assertEqual(executor.Executor.Storage(['qm', 'importdisk', '100', '/tmp/d.raw', 'nas']), 'nas')
+    self.assertIsNone(executor.Executor.Storage(['qm', 'start', '100']))
+
+  def test_timeout(self):
+    e = executor.Executor(timeout=60, shutdown_timeout=45)
+    self.assertEqual(e.Timeout(['qm', 'shutdown', '100', '--timeout', '45']), 45 + e.shutdown_grace)
+    self.assertEqual(e.Timeout(['pct', 'stop', '100']), 45 + e.shutdown_grace)
+    self.assertEqual(e.Timeout(['qm', 'start', '100']), 60)
+
+  def test_node_and_storage_limits(self):
+    run = FakeRun()
+    e = executor.Executor(node_limit=3, storage_limit=1, run=run)
+    cmds = [self.Alloc('local-lvm', x) for x in range(100, 104)] + [['qm', 'start', str(x)] for x in range(100, 104)]
+    results = e.Run(lambda cmd: e.Command('pm1', cmd), cmds)
+    self.assertListEqual([x['cmd'] for x in results], cmds)
+    self.assertEqual(run.peak['node'], 3)
+    self.assertEqual(run.peak['local-lvm'], 1)
+    self.assertListEqual([x['storage'] for x in results], ['local-lvm'] * 4 + [None] * 4)
+
+  def test_busy_storage_does_not_block_node(self):
+    run = FakeRun(latency=0.2)
+    e = executor.Executor(node_limit=2, storage_limit=1, run=run)
+    results = e.Run(lambda cmd: e.Command('pm1', cmd), [self.Alloc('local-lvm', 100), self.Alloc('local-lvm', 101), ['qm', 'start', '102']])
+    self.assertGreaterEqual(results[1]['waited'], run.latency / 2)
+    self.assertLess(results[2]['waited'], run.latency / 2)
+
+  def test_shutdown_timeout_passed(self):
+    run = FakeRun(latency=0)
+    e = executor.Executor(timeout=60, shutdown_timeout=45, run=run)
+    e.Run(lambda cmd: e.Command('pm1', cmd), [['qm', 'shutdown', '100'], ['qm', 'start', '100']])
+    self.assertListEqual(run.timeouts, [45 + e.shutdown_grace, 60])
+
+  def test_stats(self):
+    run = FakeRun()
+    e = executor.Executor(node_limit=1, run=run)
+    e.Run(lambda cmd: e.Command('pm1', cmd), [['qm', 'start', '100'], ['qm', 'destroy', '101']])
+    stats = e.Stats()
+    self.assertEqual(stats['commands'], 2)
+    self.assertEqual(stats['failed'], 1)
+    self.assertGreaterEqual(stats['p99'], 2 * run.latency * 0.9)
+    self.assertGreater(stats['throughput'], 0)
+    self.assertEqual(executor.Executor().Stats()['commands'], 0)
+
+
+if __name__ == '__main__':
+  unittest.main()
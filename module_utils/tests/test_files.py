@@ -0,0 +1,54 @@
+#!/usr/bin/python
+#
+# Test atomic file writes. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import files
+import os
+import tempfile
+import unittest
+
+
+class TestWriteAtomic(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'sub', 'file.json')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_write(self):
+    files.WriteAtomic(self.path, '{}\n')
+    with open(self.path) as f:
+      self.assertEqual(f.read(), '{}\n')
+    self.assertEqual(os.stat(self.path).st_mode & 0o7777, 0o644)
+    self.assertListEqual(os.listdir(os.path.dirname(self.path)), ['file.json'])
+
+  def test_write_bytes_perms(self):
+    files.WriteAtomic(self.path, b'\x00\x01', perms=0o600)
+    with open(self.path, 'rb') as f:
+      self.assertEqual(f.read(), b'\x00\x01')
+    self.assertEqual(os.stat(self.path).st_mode & 0o7777, 0o600)
+
+  def test_failed_write_cleans_up(self):
+    files.WriteAtomic(self.path, 'original')
+    with self.assertRaises(ValueError):
+      with files.OpenAtomic(self.path) as f:
+        f.write('partial')
+        raise ValueError('interrupted')
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'original')
+    self.assertListEqual(os.listdir(os.path.dirname(self.path)), ['file.json'])
+
+  def test_failed_encode_cleans_up(self):
+    self.assertRaises(TypeError, files.WriteAtomic, self.path, 1)
+    self.assertListEqual(os.listdir(os.path.dirname(self.path)), [])
+
+
+if __name__ == '__main__':
+  unittest.main()
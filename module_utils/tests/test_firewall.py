@@ -0,0 +1,226 @@
+#!/usr/bin/python
+#
+# Test firewall rendering and comparison. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import firewall
+import os
+import parsers
+import tempfile
+import unittest
+
+
+def VmFirewall() -> dict:
+  return {
+    'enable': True,
+    'policy_in': 'drop',
+    'rules': [
+      {'direction': 'in', 'action': 'ACCEPT', 'proto': 'tcp', 'dport': '22', 'log': 'NOLOG', 'comment': 'ssh'},
+      {'direction': 'in', 'macro': 'Ping', 'action': 'ACCEPT', 'source': '+trusted'},
+      {'direction': 'in', 'action': 'ACCEPT', 'proto': 'icmp', 'icmp_type': 'echo-request'},
+    ],
+    'ipset': [
+      {'name': 'trusted', 'comment': 'trusted hosts', 'hosts': [
+        {'ip': '10.0.0.1', 'comment': 'gateway'},
+        {'ip': '10.0.0.2'},
+      ]},
+    ],
+    'ip_aliases': [
+      {'name': 'gateway', 'ip': '10.0.0.1', 'comment': 'router'},
+    ],
+  }
+
+
+class TestFirewallRender(unittest.TestCase):
+
+  def test_vm_defaults(self):
+    self.assertEqual(firewall.PveFirewall({}).Text(),
+        '[OPTIONS]\n\nenable: 0\ndhcp: 1\nipfilter: 0\nlog_level_in: nolog\n'
+        'log_level_out: nolog\nmacfilter: 1\nndp: 1\npolicy_in: DROP\n'
+        'policy_out: ACCEPT\nradv: 0\n')
+
+  def test_vm_sections(self):
+    self.assertListEqual(firewall.PveFirewall(VmFirewall()).Lines()[13:],
+        [
+          '[RULES]',
+          '',
+          'IN ACCEPT -dport 22 -p tcp -log nolog # ssh',
+          'IN Ping(ACCEPT) -source +trusted',
+          'IN ACCEPT -p icmp -icmp-type echo-request',
+          '',
+          '[IPSET trusted] # trusted hosts',
+          '',
+          '10.0.0.1 # gateway',
+          '10.0.0.2',
+          '',
+          '[ALIASES]',
+          '',
+          'gateway 10.0.0.1 # router',
+          '',
+        ])
+
+  def test_bool_strings(self):
+    self.assertIn('enable: 1', firewall.PveFirewall({'enable': 'true'}).Lines())
+    self.assertIn('dhcp: 0', firewall.PveFirewall({'dhcp': 'no'}).Lines())
+
+  def test_cluster_options_and_groups(self):
+    fw = {
+      'log_ratelimit': {'burst': 10, 'enable': False},
+      'ipset': [{'name': 'cluster', 'comment': 'pve servers', 'hosts': ['192.168.0.10']}],
+      'rules': [{'direction': 'GROUP', 'action': 'pve', 'iface': 'vmbr0'}],
+      'group_rules': [{'name': 'pve', 'rules': [{'proto': 'tcp', 'dport': '8006'}]}],
+    }
+    lines = firewall.PveFirewall(fw, 'cluster').Lines()
+    self.assertIn('log_ratelimit: burst=10,enable=0,rate=1/second', lines)
+    self.assertLess(lines.index('[IPSET cluster] # pve servers'), lines.index('[RULES]'))
+    self.assertIn('192.168.0.10', lines)
+    self.assertIn('GROUP pve -i vmbr0', lines)
+    self.assertEqual(lines[-4:], ['[GROUP pve]', '', 'IN ACCEPT -dport 8006 -p tcp', ''])
+
+  def test_unknown_kind(self):
+    self.assertRaises(ValueError, firewall.PveFirewall, {}, 'node')
+
+
+class TestFirewallRoundTrip(unittest.TestCase):
+
+  def test_rendered_firewall_parses_equal(self):
+    text = firewall.PveFirewall(VmFirewall()).Text()
+    template = '\n'.join([x + ' ' for x in text.splitlines()]) + '\n\n\n'
+    self.assertEqual(parsers.PveFirewallConfig(text), parsers.PveFirewallConfig(template))
+
+  def test_disabled_rule(self):
+    render = firewall.PveFirewall({'rules': [{'enable': False, 'proto': 'tcp'}]})
+    self.assertIn('|IN ACCEPT -p tcp', render.Lines())
+    self.assertFalse(parsers.PveFirewallConfig(render.Text()).rules[0]['enable'])
+
+
+class TestFirewallCompact(unittest.TestCase):
+
+  def test_adjacent_collapsed(self):
+    hosts, stats = firewall.CompactHosts(['10.0.0.0', '10.0.0.1', '10.0.0.2', '10.0.0.3'])
+    self.assertListEqual(hosts, [{'ip': '10.0.0.0/30'}])
+    self.assertDictEqual(stats, {'before': 4, 'after': 1})
+
+  def test_duplicates_and_covered_removed(self):
+    hosts, _ = firewall.CompactHosts(['10.0.0.5', '10.0.0.5', '10.0.0.0/24', '192.168.1.1/32'])
+    self.assertListEqual(hosts, [{'ip': '10.0.0.0/24'}, {'ip': '192.168.1.1'}])
+
+  def test_host_bits_normalized(self):
+    hosts, _ = firewall.CompactHosts(['10.0.0.7/29'])
+    self.assertListEqual(hosts, [{'ip': '10.0.0.0/29'}])
+
+  def test_ipv4_ipv6_separate(self):
+    hosts, _ = firewall.CompactHosts(['fd00::1', '10.0.0.1', 'fd00::0'])
+    self.assertListEqual(hosts, [{'ip': '10.0.0.1'}, {'ip': 'fd00::/127'}])
+
+  def test_comment_attributed(self):
+    hosts, _ = firewall.CompactHosts([
+        {'ip': '10.0.0.0', 'comment': 'office'},
+        {'ip': '10.0.0.1', 'comment': 'office'},
+        {'ip': '10.0.0.2'},
+        {'ip': '10.0.0.3'},
+        {'ip': '10.0.1.0', 'comment': 'lab'},
+        {'ip': '10.0.1.1', 'comment': 'vpn'},
+        {'ip': '10.0.5.5', 'comment': 'printer'},
+    ])
+    self.assertListEqual(hosts, [
+        {'ip': '10.0.0.0/30', 'comment': 'office'},
+        {'ip': '10.0.1.0/31'},
+        {'ip': '10.0.5.5', 'comment': 'printer'},
+    ])
+
+  def test_aliases_and_nomatch_kept(self):
+    hosts, stats = firewall.CompactHosts(['gateway', '!10.0.0.1', 'gateway', {'ip': 'dc/dns', 'comment': 'dns'}])
+    self.assertListEqual(hosts, [{'ip': 'gateway'}, {'ip': '!10.0.0.1'}, {'ip': 'dc/dns', 'comment': 'dns'}])
+    self.assertDictEqual(stats, {'before': 4, 'after': 3})
+
+  def test_large_set(self):
+    hosts = [f'10.{x // 256}.{x % 256}.{y}' for x in range(16) for y in range(256)] * 2
+    compacted, stats = firewall.CompactHosts(hosts)
+    self.assertListEqual(compacted, [{'ip': '10.0.0.0/20'}])
+    self.assertDictEqual(stats, {'before': 8192, 'after': 1})
+
+  def test_render_report(self):
+    fw = {'ipset': [
+      {'name': 'a', 'hosts': ['10.0.0.0', '10.0.0.1']},
+      {'name': 'b', 'hosts': ['10.0.0.9']},
+    ]}
+    render = firewall.PveFirewall(fw, compact=True)
+    self.assertIn('10.0.0.0/31', render.Lines())
+    self.assertListEqual(render.compaction, [
+        {'name': 'a', 'before': 2, 'after': 1},
+        {'name': 'b', 'before': 1, 'after': 1},
+    ])
+
+  def test_not_compacted_by_default(self):
+    render = firewall.PveFirewall({'ipset': [{'name': 'a', 'hosts': ['10.0.0.0', '10.0.0.1']}]})
+    self.assertIn('10.0.0.1', render.Lines())
+    self.assertListEqual(render.compaction, [])
+
+
+class TestFirewallApply(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, '100.fw')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_create(self):
+    result = firewall.Apply(VmFirewall(), self.path)
+    self.assertTrue(result['changed'])
+    with open(self.path) as f:
+      self.assertEqual(f.read(), result['after'])
+
+  def test_unchanged_not_written(self):
+    firewall.Apply(VmFirewall(), self.path)
+    with open(self.path, 'a') as f:
+      f.write('\n\n')
+    result = firewall.Apply(VmFirewall(), self.path)
+    self.assertFalse(result['changed'])
+    with open(self.path) as f:
+      self.assertTrue(f.read().endswith('\n\n\n'))
+
+  def test_changed_written(self):
+    firewall.Apply(VmFirewall(), self.path)
+    fw = VmFirewall()
+    fw['enable'] = False
+    self.assertTrue(firewall.Apply(fw, self.path)['changed'])
+    with open(self.path) as f:
+      self.assertIn('enable: 0', f.read())
+
+  def test_compaction_report(self):
+    fw = VmFirewall()
+    fw['ipset'][0]['hosts'] += [{'ip': '10.0.0.3'}, {'ip': '10.0.0.3'}]
+    result = firewall.Apply(fw, self.path, compact=True)
+    self.assertDictEqual(result['compaction'], {
+        'before': 4,
+        'after': 2,
+        'ipsets': [{'name': 'trusted', 'before': 4, 'after': 2}],
+    })
+
+  def test_semantic_change_sections(self):
+    firewall.Apply(VmFirewall(), self.path)
+    fw = VmFirewall()
+    fw['ipset'][0]['hosts'].reverse()
+    fw['rules'][0]['dport'] = '2222'
+    self.assertListEqual(firewall.Apply(fw, self.path)['changes'], ['rules'])
+
+  def test_unparsable_replaced(self):
+    with open(self.path, 'w') as f:
+      f.write('[BOGUS]\n')
+    self.assertListEqual(firewall.Apply(VmFirewall(), self.path)['changes'], ['file'])
+
+  def test_check_mode(self):
+    result = firewall.Apply(VmFirewall(), self.path, check_mode=True)
+    self.assertTrue(result['changed'])
+    self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,147 @@
+#!/usr/bin/python
+#
+# Test SQLite fleet index. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from unittest import mock
+import contextlib
+import fleet
+import io
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+
+
+def Hostvars():
+  return {
+    'gpu.example.com': {'pve_lxc': {'vmid': 101, 'node': 'pm1.example.com', 'config': (
+        'rootfs: local-lvm:vm-101-disk-0,size=4G\n'
+        'mp0: /dev/nvidia0,mp=/dev/nvidia0\n'
+        'mp1: ceph:vm-101-disk-1,mp=/data,size=512M\n'
+        'lxc.mount.entry: /dev/nvidia-uvm dev/nvidia-uvm none bind,optional,create=file\n'
+        'memory: 2048')}},
+    'vtest.example.com': {'pve_kvm': {'vmid': 100, 'node': 'pm2.example.com', 'config': (
+        'scsi0: local-lvm:vm-100-disk-0,size=8G\n'
+        'scsi1: ceph:vm-100-disk-1,size=1T\n'
+        'ide2: local:iso/debian.iso,media=cdrom\n'
+        'net0: virtio,bridge=vmbr0\n'
+        'memory: 4096')}},
+    'dns.example.com': {'ansible_host': '10.9.9.2'},
+  }
+
+
+class TestFleet(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'fleet.db')
+    self.fleet = fleet.Fleet(self.path)
+    self.hostvars = Hostvars()
+    self.result = self.fleet.Update(fleet.Inventory(self.hostvars))
+
+  def tearDown(self):
+    self.fleet.Close()
+    self.tmp.cleanup()
+
+  def test_inventory(self):
+    self.assertListEqual([(x['host'], x['kind']) for x in fleet.Inventory(self.hostvars)],
+                         [('gpu.example.com', 'lxc'), ('vtest.example.com', 'kvm')])
+
+  def test_tokens(self):
+    rows = self.fleet.Query('SELECT line, key, sub_key, value, type FROM tokens WHERE vmid = 100 AND line < 2 ORDER BY line, rowid')
+    self.assertListEqual([tuple(x.values()) for x in rows], [
+      (0, 'scsi0', 'file', 'local-lvm:vm-100-disk-0', 'DISK'),
+      (0, 'scsi0', 'size', '8G', 'DISK'),
+      (1, 'scsi1', 'file', 'ceph:vm-100-disk-1', 'DISK'),
+      (1, 'scsi1', 'size', '1T', 'DISK'),
+    ])
+
+  def test_update_incremental(self):
+    self.assertDictEqual(self.result, {'added': [100, 101], 'updated': [], 'unchanged': [], 'removed': []})
+    self.hostvars['vtest.example.com']['pve_kvm']['config'] += '\ncores: 4'
+    with mock.patch.object(fleet, 'Tokens', wraps=fleet.Tokens) as tokens:
+      result = self.fleet.Update(fleet.Inventory(self.hostvars))
+    self.assertEqual(tokens.call_count, 1)
+    self.assertDictEqual(result, {'added': [], 'updated': [100], 'unchanged': [101], 'removed': []})
+    self.assertEqual(self.fleet.Query("SELECT count(*) AS n FROM tokens WHERE vmid = 100 AND key = 'cores'")[0]['n'], 1)
+
+  def test_update_prune(self):
+    del self.hostvars['gpu.example.com']
+    self.assertListEqual(self.fleet.Update(fleet.Inventory(self.hostvars))['removed'], [])
+    self.assertListEqual(self.fleet.Update(fleet.Inventory(self.hostvars), prune=True)['removed'], [101])
+    self.assertListEqual(self.fleet.Query('SELECT DISTINCT vmid FROM tokens'), [{'vmid': 100}])
+
+  def test_update_duplicate_vmid(self):
+    self.hostvars['other.example.com'] = {'pve_kvm': dict(self.hostvars['vtest.example.com']['pve_kvm'])}
+    self.assertRaises(ValueError, self.fleet.Update, fleet.Inventory(self.hostvars))
+
+  def test_update_parse_error(self):
+    self.hostvars['vtest.example.com']['pve_kvm']['config'] = 'scsi0'
+    self.assertRaisesRegex(ValueError, 'vtest.example.com', self.fleet.Update, fleet.Inventory(self.hostvars))
+
+  def test_vms(self):
+    vmids = lambda **x: [y['vmid'] for y in self.fleet.Vms(**x)]
+    self.assertListEqual(vmids(key='mp*', value='/dev/nvidia*'), [101])
+    self.assertListEqual(vmids(key='lxc.mount.entry', value='/dev/nvidia*'), [101])
+    self.assertListEqual(vmids(sub_key='bridge', value='vmbr0'), [100])
+    self.assertListEqual(vmids(storage='ceph'), [101, 100])
+    self.assertListEqual(vmids(storage='ceph', node='pm2'), [100])
+    self.assertListEqual(vmids(storage='local'), [100])
+    self.assertListEqual(vmids(kind='lxc'), [101])
+    self.assertDictEqual(self.fleet.Vms(key='memory', value='4096')[0],
+                         {'vmid': 100, 'host': 'vtest.example.com', 'node': 'pm2.example.com', 'kind': 'kvm'})
+
+  def test_vms_use_indexes(self):
+    for sql, params in (
+        ('SELECT vmid FROM tokens WHERE key GLOB ? AND value GLOB ?', ('mp*', '/dev/nvidia*')),
+        ('SELECT vmid FROM tokens WHERE value GLOB ?', ('/dev/nvidia*',)),
+        ("SELECT vmid FROM tokens WHERE sub_key IN ('file', 'volume') AND value GLOB ?", ('ceph:*',))):
+      plan = ' '.join([x['detail'] for x in self.fleet.Query(f'EXPLAIN QUERY PLAN {sql}', params)])
+      self.assertIn('USING COVERING INDEX', plan)
+
+  def test_storage(self):
+    self.assertDictEqual(self.fleet.Storage(), {
+      'ceph': {'disks': 2, 'bytes': 1024**4 + 512 * 1024**2},
+      'local-lvm': {'disks': 2, 'bytes': 12 * 1024**3},
+    })
+
+  def test_readonly(self):
+    with fleet.Fleet(self.path, readonly=True) as index:
+      self.assertEqual(len(index.Vms()), 2)
+      self.assertRaises(sqlite3.OperationalError, index.Update, [], prune=True)
+
+
+class TestMain(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.db = os.path.join(self.tmp.name, 'fleet.db')
+    self.inventory = os.path.join(self.tmp.name, 'inventory.json')
+    with open(self.inventory, 'w') as f:
+      json.dump({'_meta': {'hostvars': Hostvars()}, 'all': {'children': ['ungrouped']}}, f)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def Main(self, *argv):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      fleet.main(['--db', self.db] + list(argv))
+    return json.loads(out.getvalue())
+
+  def test_index_and_query(self):
+    self.assertDictEqual(self.Main('index', '--inventory', self.inventory), {'added': 2, 'updated': 0, 'unchanged': 0, 'removed': 0})
+    self.assertDictEqual(self.Main('index', '--inventory', self.inventory), {'added': 0, 'updated': 0, 'unchanged': 2, 'removed': 0})
+    self.assertListEqual([x['host'] for x in self.Main('vms', '--key', 'mp*', '--value', '/dev/nvidia*')], ['gpu.example.com'])
+    self.assertEqual(self.Main('storage')['ceph']['disks'], 2)
+    self.assertListEqual(self.Main('sql', 'SELECT count(*) AS n FROM vms'), [{'n': 2}])
+
+
+if __name__ == '__main__':
+  unittest.main()
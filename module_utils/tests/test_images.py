@@ -0,0 +1,255 @@
+#!/usr/bin/python
+#
+# Test cloud init image cache. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import fake
+from unittest import mock
+import hashlib
+import images
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import time
+import unittest
+
+
+class TestImageCache(unittest.TestCase):
+
+  def setUp(self):
+    self.server = fake.FakeImageServer()
+    self.nodes = fake.FakeNodes()
+    self.tmp = tempfile.TemporaryDirectory()
+    self.cache = self.tmp.name
+    self.content = b'qcow2 image' * 1024
+    url = self.server.Add('debian-cloud.qcow2', self.content)
+    self.image_map = {
+      'debian': {'url': url, 'checksum': hashlib.sha512(self.content).hexdigest(), 'algorithm': 'sha512'},
+      'debian-mirror': {'url': url.replace('debian-cloud', 'debian-cloud-mirror'), 'checksum': hashlib.sha512(self.content).hexdigest(), 'algorithm': 'sha512'},
+      'bad': {'url': self.server.Add('bad.qcow2', b'corrupt'), 'checksum': 'abc', 'algorithm': 'sha512'},
+    }
+    self.vms = [
+      {'vmid': 100, 'node': 'pm1', 'template': 'debian', 'cloud_init': 'local-lvm'},
+      {'vmid': 101, 'node': 'pm2', 'template': 'debian', 'cloud_init': 'local-lvm'},
+      {'vmid': 102, 'node': 'pm3', 'template': 'debian', 'cloud_init': 'local-lvm'},
+      {'vmid': 103, 'node': 'pm2', 'template': 'debian', 'cloud_init': 'local-lvm'},
+      {'vmid': 104, 'node': 'pm3', 'template': 'debian'},
+    ]
+    self.image_cache = images.ImageCache(self.cache, 'pm1', run=self.nodes)
+
+  def tearDown(self):
+    self.server.Cleanup()
+    self.tmp.cleanup()
+
+  def test_plan_deduplicated(self):
+    plan = images.ImageCache.Plan(self.vms, self.image_map, existing=[102])
+    self.assertEqual(len(plan), 1)
+    self.assertListEqual(plan[0]['files'], ['debian-cloud.qcow2'])
+    self.assertListEqual(plan[0]['nodes'], ['pm1', 'pm2'])
+
+  def test_plan_same_checksum_different_name(self):
+    self.vms[1]['template'] = 'debian-mirror'
+    plan = images.ImageCache.Plan(self.vms, self.image_map)
+    self.assertEqual(len(plan), 1)
+    self.assertListEqual(plan[0]['nodes'], ['pm1', 'pm2', 'pm3'])
+
+  def test_download_once_and_distribute(self):
+    results = self.image_cache.Apply(self.vms, self.image_map)
+    self.assertEqual(results[0]['status'], 'downloaded')
+    self.assertFalse(results[0]['failed'])
+    self.assertListEqual(self.server.requests, ['/debian-cloud.qcow2'])
+    self.assertListEqual(sorted(self.nodes.Copies()), [
+        ('pm2', 'debian-cloud.qcow2'),
+        ('pm2', 'debian-cloud.qcow2.checksum'),
+        ('pm3', 'debian-cloud.qcow2'),
+        ('pm3', 'debian-cloud.qcow2.checksum'),
+    ])
+    self.assertEqual(self.nodes.files[('pm2', os.path.join(self.cache, 'debian-cloud.qcow2'))], self.content)
+
+  def test_sidecar_skips_download_and_copy(self):
+    self.image_cache.Apply(self.vms, self.image_map)
+    self.nodes.commands = []
+    results = self.image_cache.Apply(self.vms, self.image_map)
+    self.assertEqual(results[0]['status'], 'cached')
+    self.assertEqual(len(self.server.requests), 1)
+    self.assertListEqual(self.nodes.Copies(), [])
+
+  def test_node_image_checked_before_sidecar(self):
+    self.image_cache.Apply(self.vms, self.image_map)
+    path = os.path.join(self.cache, 'debian-cloud.qcow2')
+    del self.nodes.files[('pm2', path)]
+    self.nodes.files[('pm3', path)] = self.content[:10]
+    self.nodes.commands = []
+    results = self.image_cache.Apply(self.vms, self.image_map)
+    self.assertFalse(results[0]['failed'])
+    self.assertListEqual(sorted([x for x in self.nodes.Copies() if not x[1].endswith('.checksum')]), [
+        ('pm2', 'debian-cloud.qcow2'),
+        ('pm3', 'debian-cloud.qcow2'),
+    ])
+    self.assertEqual(self.nodes.files[('pm3', path)], self.content)
+
+  def test_unverified_sidecar_rewritten(self):
+    self.image_map['debian']['checksum'] = ''
+    self.image_cache.Apply(self.vms, self.image_map)
+    path = os.path.join(self.cache, 'debian-cloud.qcow2')
+    with open(path, 'wb') as f:
+      f.write(b'new image')
+    os.utime(path, (0, 0))
+    self.nodes.commands = []
+    results = self.image_cache.Apply(self.vms, self.image_map)
+    self.assertEqual(results[0]['status'], 'cached')
+    self.assertEqual(images.ReadSidecar(path)['digest'], hashlib.sha256(b'new image').hexdigest())
+    self.assertIn(('pm2', 'debian-cloud.qcow2'), self.nodes.Copies())
+    self.assertEqual(self.nodes.files[('pm2', path)], b'new image')
+
+  def test_stale_sidecar_rehashed(self):
+    path = os.path.join(self.cache, 'debian-cloud.qcow2')
+    images.Download(images.ImageCache.Plan(self.vms, self.image_map)[0]['template'], path)
+    images.WriteSidecar(path, 'sha512', 'stale')
+    self.assertEqual(self.image_cache.Apply(self.vms, self.image_map)[0]['status'], 'cached')
+    self.assertEqual(len(self.server.requests), 1)
+
+  def test_truncated_redownloads(self):
+    self.image_cache.Apply(self.vms, self.image_map)
+    with open(os.path.join(self.cache, 'debian-cloud.qcow2'), 'r+b') as f:
+      f.truncate(10)
+    self.assertEqual(self.image_cache.Apply(self.vms, self.image_map)[0]['status'], 'downloaded')
+    self.assertEqual(len(self.server.requests), 2)
+
+  def test_linked_alias(self):
+    self.vms[1]['template'] = 'debian-mirror'
+    self.image_cache.Apply(self.vms, self.image_map)
+    self.assertEqual(len(self.server.requests), 1)
+    first = os.stat(os.path.join(self.cache, 'debian-cloud.qcow2'))
+    self.assertEqual(first.st_nlink, 2)
+
+  def test_checksum_mismatch(self):
+    self.vms[0]['template'] = 'bad'
+    results = self.image_cache.Apply(self.vms[:1], self.image_map)
+    self.assertTrue(results[0]['failed'])
+    self.assertIn('checksum mismatch', results[0]['msg'])
+    self.assertListEqual(os.listdir(self.cache), [])
+
+  def test_node_copy_failure(self):
+    self.nodes.unreachable.add('pm3')
+    results = self.image_cache.Apply(self.vms, self.image_map)
+    self.assertTrue(results[0]['failed'])
+    self.assertTrue(results[0]['msg'].startswith('pm3: '))
+    self.assertEqual(json.loads(self.nodes.files[('pm2', os.path.join(self.cache, 'debian-cloud.qcow2.checksum'))])['algorithm'], 'sha512')
+
+
+class TestImageVerify(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'image.iso')
+    self.content = os.urandom(1024 * 1024)
+    with open(self.path, 'wb') as f:
+      f.write(self.content)
+    self.template = {'url': 'http://127.0.0.1:1/image.iso', 'file': 'image.iso', 'algorithm': 'sha256', 'checksum': hashlib.sha256(self.content).hexdigest()}
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_hash_chunked(self):
+    self.assertEqual(images.Hash(self.path, 'sha256', chunk=4096), self.template['checksum'])
+
+  def test_missing(self):
+    self.assertEqual(images.Verify(os.path.join(self.tmp.name, 'none.iso'), self.template), 'missing')
+
+  def test_verified_then_trusted(self):
+    self.assertEqual(images.Verify(self.path, self.template), 'verified')
+    self.assertDictEqual(images.ReadSidecar(self.path), {
+        'size': len(self.content),
+        'mtime': int(os.stat(self.path).st_mtime),
+        'algorithm': 'sha256',
+        'digest': self.template['checksum'],
+    })
+    with mock.patch.object(images, 'Hash') as hashed:
+      self.assertEqual(images.Verify(self.path, self.template), 'trusted')
+      hashed.assert_not_called()
+
+  def test_mtime_change_rehashed(self):
+    images.Verify(self.path, self.template)
+    os.utime(self.path, (0, 0))
+    with mock.patch.object(images, 'Hash', wraps=images.Hash) as hashed:
+      self.assertEqual(images.Verify(self.path, self.template), 'verified')
+      hashed.assert_called_once()
+
+  def test_modified_same_size_invalid(self):
+    images.Verify(self.path, self.template)
+    with open(self.path, 'r+b') as f:
+      f.write(b'corrupt')
+    os.utime(self.path, (0, 0))
+    self.assertEqual(images.Verify(self.path, self.template), 'invalid')
+
+  def test_no_checksum(self):
+    self.template['checksum'] = ''
+    self.assertEqual(images.Verify(self.path, self.template), 'unverified')
+    self.assertEqual(images.Ensure(self.path, self.template), 'unverified')
+
+  def test_many_images_trusted_quickly(self):
+    paths = []
+    for x in range(40):
+      path = os.path.join(self.tmp.name, f'{x}.iso')
+      os.link(self.path, path)
+      images.WriteSidecar(path, 'sha256', self.template['checksum'])
+      paths.append(path)
+    start = time.monotonic()
+    self.assertListEqual(list(set([images.Verify(x, self.template) for x in paths])), ['trusted'])
+    self.assertLess(time.monotonic() - start, 0.5)
+
+
+class TestImageExtract(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.disk = os.urandom(1024 * 1024) + bytes(8 * 1024 * 1024) + os.urandom(64 * 1024) + bytes(7 * 1024 * 1024 - 64 * 1024)
+    self.archive = os.path.join(self.tmp.name, 'debian-cloud.tar.xz')
+    with tarfile.open(self.archive, 'w:xz', preset=0) as tar:
+      for name, content in (('README', b'readme'), ('./disk.raw', self.disk)):
+        info = tarfile.TarInfo(name)
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    self.dest = os.path.join(self.tmp.name, 'debian-cloud.raw')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def assertExtracted(self):
+    with open(self.dest, 'rb') as f:
+      self.assertEqual(f.read(), self.disk)
+    self.assertLess(os.stat(self.dest).st_blocks * 512, 4 * 1024 * 1024)
+    self.assertListEqual(sorted(os.listdir(self.tmp.name)), ['debian-cloud.raw', 'debian-cloud.tar.xz'])
+
+  @unittest.skipUnless(shutil.which('xz'), 'xz not installed')
+  def test_extract_xz(self):
+    self.assertEqual(images.Extract(self.archive, 'disk.raw', self.dest, threads=2), len(self.disk))
+    self.assertExtracted()
+
+  def test_extract_lzma(self):
+    self.assertEqual(images.Extract(self.archive, 'disk.raw', self.dest, use_xz=False), len(self.disk))
+    self.assertExtracted()
+
+  def test_missing_member(self):
+    self.assertRaises(ValueError, images.Extract, self.archive, 'missing.raw', self.dest)
+    self.assertListEqual(os.listdir(self.tmp.name), ['debian-cloud.tar.xz'])
+
+  def test_corrupt_archive(self):
+    with open(self.archive, 'r+b') as f:
+      f.seek(100)
+      f.write(b'corrupt' * 100)
+    for use_xz in (True, False):
+      self.assertRaises(Exception, images.Extract, self.archive, 'disk.raw', self.dest, use_xz=use_xz)
+      self.assertListEqual(os.listdir(self.tmp.name), ['debian-cloud.tar.xz'])
+
+
+if __name__ == '__main__':
+  unittest.main()
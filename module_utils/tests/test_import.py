@@ -0,0 +1,70 @@
+#!/usr/bin/python
+#
+# Test per-VM module cold start import budget. Run from 'module_utils'
+# with
+#
+#   python3 -m unittest
+#
+# Each module execution imports parsers in a new interpreter. Modules listed
+# in the budget cost more to import than parsing a typical config; parsing
+# must not import them.
+#
+# Reference:
+# * https://docs.python.org/3/using/cmdline.html#cmdoption-X
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+def ImportTime(code):
+  '''Return dict of str module to int cumulative import microseconds.
+
+  Args
+    code: str python statements executed in a new interpreter.
+  '''
+  proc = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], capture_output=True, text=True,
+                        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
+  modules = {}
+  for line in proc.stderr.splitlines():
+    if not line.startswith('import time:') or 'cumulative' in line:
+      continue
+    _, cumulative, name = line.split('|')
+    modules[name.strip()] = int(cumulative)
+  return modules
+
+
+class TestImportBudget(unittest.TestCase):
+  budget = ('dataclasses', 'inspect', 'typing', 'ipaddress', 'ast', 'dis', 'tokenize')
+
+  def test_parse_imports_within_budget(self):
+    modules = ImportTime("import parsers; parsers.PveConfig({'vmid': 100, 'node': 'pm1', 'config': 'scsi0: local-lvm:vm-100-disk-0,size=4G'}).Ansible()")
+    self.assertIn('parsers', modules)
+    self.assertListEqual([x for x in self.budget if x in modules], [])
+
+  def test_node_imports_within_budget(self):
+    # pve_config_write and pve_disk_grow import node for each VM.
+    modules = ImportTime("import node; node.CommandResult(['true'], 0).AsDict()")
+    self.assertIn('node', modules)
+    self.assertListEqual([x for x in self.budget if x in modules], [])
+
+  def test_images_imports_within_budget(self):
+    # pve_image and pve_image_extract import images for each VM.
+    modules = ImportTime("import images; images.Verify('/nonexistent', {'checksum': '', 'algorithm': 'sha256'})")
+    self.assertIn('images', modules)
+    self.assertListEqual([x for x in self.budget if x in modules], [])
+    self.assertListEqual([x for x in ('logging', 'urllib.request', 'tarfile') if x in modules], [])
+
+  def test_power_imports_within_budget(self):
+    modules = ImportTime("import power; power.PowerSchedule.Waves([])")
+    self.assertIn('power', modules)
+    self.assertListEqual([x for x in self.budget if x in modules], [])
+
+  def test_firewall_imports_ipaddress(self):
+    modules = ImportTime("import parsers; parsers.PveFirewallConfig('[IPSET a]\\n10.0.0.1\\n').Ansible()")
+    self.assertIn('ipaddress', modules)
+
+
+if __name__ == '__main__':
+  unittest.main()
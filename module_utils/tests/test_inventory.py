@@ -0,0 +1,61 @@
+#!/usr/bin/python
+#
+# Test inventory index of hosts defining PVE VMs. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import inventory
+import unittest
+
+
+class TestIndex(unittest.TestCase):
+
+  def setUp(self):
+    self.hosts = {
+      'c.example.com': {'pve_kvm': {'vmid': 102, 'node': 'pm2.example.com', 'config': 'cores: 2'}},
+      'b.example.com': {'pve_kvm': {'vmid': 101, 'node': 'pm1.example.com'}, 'other': 'x'},
+      'a.example.com': {'pve_kvm': {'vmid': '100', 'node': 'pm1'}},
+      'd.example.com': {'pve_lxc': {'vmid': 200, 'node': 'pm1.example.com'}},
+      'e.example.com': {'pve_kvm': {'vmid': 103}},
+      'f.example.com': {'unrelated': True},
+    }
+
+  def test_kind(self):
+    self.assertListEqual([x['key'] for x in inventory.Index(self.hosts, 'lxc')], ['d.example.com'])
+    self.assertRaisesRegex(ValueError, 'kvm, lxc: qemu', inventory.Index, self.hosts, 'qemu')
+
+  def test_sorted_by_node_and_vmid(self):
+    index = inventory.Index(self.hosts, 'kvm')
+    self.assertListEqual([(x['node'], x['vmid']) for x in index], [
+        ('', 103),
+        ('pm1', 100),
+        ('pm1.example.com', 101),
+        ('pm2.example.com', 102),
+    ])
+    self.assertDictEqual(index[3], {
+      'key': 'c.example.com',
+      'node': 'pm2.example.com',
+      'vmid': 102,
+      'config': 'cores: 2',
+      'value': {'pve_kvm': {'vmid': 102, 'node': 'pm2.example.com', 'config': 'cores: 2'}},
+    })
+
+  def test_node_short_name_or_fqdn(self):
+    for node in ('pm1', 'pm1.example.com', 'pm1.other.com'):
+      self.assertListEqual([x['vmid'] for x in inventory.Index(self.hosts, 'kvm', node=node)], [100, 101])
+    self.assertListEqual(inventory.Index(self.hosts, 'kvm', node='pm11'), [])
+
+  def test_placement(self):
+    placement = {'103': 'pm2.example.com', 101: 'pm2.example.com'}
+    index = inventory.Index(self.hosts, 'kvm', node='pm2', placement=placement)
+    self.assertListEqual([(x['vmid'], x['node']) for x in index], [(102, 'pm2.example.com'), (103, 'pm2.example.com')])
+    self.assertEqual(index[1]['value']['pve_kvm']['node'], 'pm2.example.com')
+    # Host variables are not modified.
+    self.assertNotIn('node', self.hosts['e.example.com']['pve_kvm'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,91 @@
+#!/usr/bin/python
+#
+# Test provisioning phase metrics. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import json
+import metrics
+import os
+import tempfile
+import unittest
+
+
+class TestPhase(unittest.TestCase):
+
+  def test_task_file(self):
+    self.assertTupleEqual(metrics.TaskFile('/p/roles/pve/kvm/tasks/operations/shutdown.yml:18'), ('kvm', 'operations/shutdown'))
+    self.assertTupleEqual(metrics.TaskFile('/p/roles/pve/global_tasks/quorum.yml:3'), ('global', 'quorum'))
+    self.assertTupleEqual(metrics.TaskFile('/p/playbook.yml:3'), (None, None))
+
+  def test_phase(self):
+    self.assertEqual(metrics.Phase('/r/pve/lxc/tasks/operations/start.yml:10'), 'start')
+    self.assertEqual(metrics.Phase('/r/pve/kvm/tasks/reconfigure.yml:40', 'pve_config_write'), 'config_write')
+    self.assertEqual(metrics.Phase('/r/pve/kvm/tasks/cloud_init/extract_image.yml:12', 'pve_image_extract'), 'extract')
+    self.assertEqual(metrics.Phase('/r/pve/kvm/tasks/config.yml:35', 'ansible.builtin.set_fact'), 'parse')
+    self.assertEqual(metrics.Phase('/r/pve/kvm/tasks/cloud_init/ssh_keys.yml:5'), 'cloud_init_ssh_keys')
+    self.assertIsNone(metrics.Phase('/p/playbook.yml:3', 'kvm_config'))
+
+  def test_vmid(self):
+    self.assertEqual(metrics.Vmid('100 | shutdown vm for configuration updates'), '100')
+    self.assertEqual(metrics.Vmid('kvm | configuration check required'), '')
+
+
+class TestPhaseMetrics(unittest.TestCase):
+
+  def setUp(self):
+    self.metrics = metrics.PhaseMetrics()
+    self.metrics.Add('', 'pm1', 'global', 'quorum', 0.5, 'ok')
+    self.metrics.Add('100', 'pm1', 'kvm', 'shutdown', 10.0, 'changed')
+    self.metrics.Add('100', 'pm1', 'kvm', 'shutdown', 2.0, 'skipped')
+    self.metrics.Add('100', 'pm1', 'kvm', 'start', 3.0, 'changed')
+    self.metrics.Add('101', 'pm1', 'kvm', 'shutdown', 20.0, 'failed')
+    self.metrics.Add('102', 'pm2', 'lxc', 'shutdown', 1.0, 'ok')
+
+  def test_unknown_status(self):
+    self.assertRaises(ValueError, self.metrics.Add, '100', 'pm1', 'kvm', 'start', 1.0, 'bad')
+
+  def test_vms(self):
+    vms = self.metrics.Vms()
+    self.assertListEqual(sorted(vms), ['100', '101', '102'])
+    self.assertDictEqual(vms['100']['phases']['shutdown'], {'duration': 12.0, 'tasks': 2, 'status': 'ok'})
+    self.assertEqual(vms['100']['duration'], 15.0)
+    self.assertEqual(vms['101']['status'], 'failed')
+
+  def test_summary(self):
+    summary = self.metrics.Summary()
+    self.assertDictEqual(summary['phases']['shutdown'], {'count': 3, 'failed': 1, 'sum': 33.0, 'p50': 12.0, 'p99': 20.0, 'max': 20.0})
+    self.assertDictEqual(summary['nodes']['pm1']['quorum'], {'count': 1, 'failed': 0, 'sum': 0.5, 'p50': 0.5, 'p99': 0.5, 'max': 0.5})
+    self.assertEqual(summary['nodes']['pm2']['shutdown']['count'], 1)
+
+  def test_prometheus(self):
+    text = self.metrics.Prometheus()
+    self.assertIn('pve_provision_vm_phase_seconds{vmid="100",node="pm1",kind="kvm",phase="shutdown",status="ok"} 12.000000\n', text)
+    self.assertIn('pve_provision_vm_failed{vmid="101",node="pm1",kind="kvm"} 1\n', text)
+    self.assertIn('pve_provision_phase_seconds{node="pm1",phase="shutdown",quantile="0.99"} 20.000000\n', text)
+    self.assertIn('pve_provision_phase_seconds_count{node="pm1",phase="shutdown"} 2\n', text)
+    self.assertIn('pve_provision_tasks_total{node="pm1",phase="shutdown",status="failed"} 1\n', text)
+    self.assertEqual(len([x for x in text.splitlines() if x.startswith('# TYPE')]), 4)
+
+  def test_label_escaped(self):
+    m = metrics.PhaseMetrics()
+    m.Add('100', 'pm"1', 'kvm', 'start', 1.0, 'ok')
+    self.assertIn('node="pm\\"1"', m.Prometheus())
+
+  def test_write(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      prom = os.path.join(tmp, 'textfile', 'pve.prom')
+      summary = os.path.join(tmp, 'pve.json')
+      self.metrics.Write(prom, summary)
+      with open(prom) as f:
+        self.assertEqual(f.read(), self.metrics.Prometheus())
+      with open(summary) as f:
+        self.assertEqual(json.load(f)['vms']['101']['status'], 'failed')
+      self.assertListEqual(sorted(os.listdir(os.path.dirname(prom))), ['pve.prom'])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+#
+# Test VM live migration. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from unittest import mock
+import asyncio
+import migrate
+import node
+import unittest
+
+
+def Resources():
+  return [
+    {'vmid': 100, 'node': 'pm1', 'type': 'qemu', 'status': 'running'},
+    {'vmid': 101, 'node': 'pm1', 'type': 'qemu', 'status': 'stopped'},
+    {'vmid': 102, 'node': 'pm2', 'type': 'qemu', 'status': 'running'},
+    {'vmid': 200, 'node': 'pm1', 'type': 'lxc', 'status': 'running'},
+    {'vmid': 300, 'node': 'pm3', 'type': 'qemu', 'status': 'running'},
+  ]
+
+
+class FakeRun(object):
+  '''Record concurrent migrations per source and target node.'''
+
+  def __init__(self, latency=0.05, fail=()):
+    self.latency = latency
+    self.fail = fail
+    self.active = {}
+    self.peak = {}
+
+  async def __call__(self, cmd, ok_rc=(0,), timeout=None):
+    i = cmd.index('migrate')
+    keys = [('target', cmd[i + 2])] + [('source', cmd[3].split('@')[1] if cmd[0] == 'ssh' else 'pm1')]
+    for key in keys:
+      self.active[key] = self.active.get(key, 0) + 1
+      self.peak[key] = max(self.peak.get(key, 0), self.active[key])
+    await asyncio.sleep(self.latency)
+    for key in keys:
+      self.active[key] -= 1
+    rc = 255 if cmd[i + 1] in self.fail else 0
+    return node.CommandResult(cmd, rc, '', 'migration aborted' if rc else '', ok=rc in ok_rc)
+
+
+class TestPlan(unittest.TestCase):
+
+  def test_plan(self):
+    vms = {'100': 'pm2.example.com', '101': 'pm3', '102': 'pm2.example.com', '200': 'pm2', '999': 'pm1'}
+    self.assertListEqual(migrate.Plan(vms, Resources(), 'qemu'), [
+      {'vmid': 100, 'type': 'qemu', 'source': 'pm1', 'target': 'pm2', 'running': True},
+      {'vmid': 101, 'type': 'qemu', 'source': 'pm1', 'target': 'pm3', 'running': False},
+    ])
+    self.assertListEqual([x['vmid'] for x in migrate.Plan(vms, Resources(), 'lxc')], [200])
+
+  def test_plan_ignores_other_types(self):
+    self.assertListEqual(migrate.Plan({200: 'pm2'}, Resources(), 'qemu'), [])
+
+
+class TestMigrator(unittest.TestCase):
+
+  def Migration(self, vmid, source, target, vm_type='qemu', running=True):
+    return {'vmid': vmid, 'type': vm_type, 'source': source, 'target': target, 'running': running}
+
+  def test_command(self):
+    m = migrate.Migrator(with_local_disks=True, shutdown_timeout=45, local='pm1.example.com')
+    self.assertListEqual(m.Command(self.Migration(100, 'pm1', 'pm2')),
+                         ['qm', 'migrate', '100', 'pm2', '--online', '--with-local-disks'])
+    self.assertListEqual(m.Command(self.Migration(200, 'pm3', 'pm2', 'lxc')),
+                         ['ssh', '-o', 'BatchMode=yes', 'root@pm3', 'pct', 'migrate', '200', 'pm2', '--restart', '--timeout', '45'])
+    self.assertListEqual(migrate.Migrator(local='pm1').Command(self.Migration(101, 'pm1', 'pm3', running=False)),
+                         ['qm', 'migrate', '101', 'pm3'])
+
+  def test_source_and_target_limits(self):
+    run = FakeRun()
+    migrations = [self.Migration(100 + x, 'pm1', f'pm{2 + x % 2}') for x in range(6)]
+    migrations += [self.Migration(200 + x, 'pm4', 'pm2') for x in range(2)]
+    result = migrate.Migrator(source_limit=2, target_limit=1, local='pm1', run=run).Run(migrations)
+    self.assertEqual(result['stats']['failed'], 0)
+    self.assertEqual(run.peak[('source', 'pm1')], 2)
+    self.assertEqual(run.peak[('target', 'pm2')], 1)
+    self.assertEqual(run.peak[('target', 'pm3')], 1)
+    self.assertListEqual([x['vmid'] for x in result['migrations']], [x['vmid'] for x in migrations])
+    # pm2 receives 5 migrations one at a time.
+    self.assertGreaterEqual(result['stats']['duration'], 5 * run.latency)
+
+  def test_busy_target_does_not_block_source(self):
+    run = FakeRun(latency=0.2)
+    migrations = [
+      self.Migration(100, 'pm1', 'pm2'),
+      self.Migration(101, 'pm3', 'pm2'),  # waits for pm2
+      self.Migration(102, 'pm3', 'pm4'),  # pm3 and pm4 are free
+    ]
+    result = migrate.Migrator(local='pm1', run=run).Run(migrations)
+    waited = {x['vmid']: x['waited'] for x in result['migrations']}
+    self.assertLess(waited[102], run.latency / 2)
+    self.assertGreaterEqual(waited[101], run.latency / 2)
+    self.assertEqual(run.peak[('source', 'pm3')], 1)
+    self.assertEqual(run.peak[('target', 'pm2')], 1)
+
+  def test_failed(self):
+    result = migrate.Migrator(local='pm1', run=FakeRun(fail=('101',))).Run(
+        [self.Migration(100, 'pm1', 'pm2'), self.Migration(101, 'pm1', 'pm3')])
+    self.assertListEqual([x['ok'] for x in result['migrations']], [True, False])
+    self.assertEqual(result['stats']['failed'], 1)
+
+  def test_none(self):
+    self.assertDictEqual(migrate.Migrator(local='pm1').Run([])['stats'],
+                         {'duration': mock.ANY, 'migrations': 0, 'failed': 0, 'p50': 0.0, 'max': 0.0})
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,197 @@
+#!/usr/bin/python
+#
+# Test node apply. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Fake qm, pvesm, pct and pvesh commands (tests/bin) are placed on PATH and
+# record invocations to FAKE_PVE_LOG.
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import fake
+from tests import params
+import executor
+import node
+import os
+import parsers
+import unittest
+
+
+class TestNodeApply(unittest.TestCase):
+
+  def setUp(self):
+    self.fake = fake.FakePve()
+    self.config_dir = self.fake.config_dir
+    self.Content = self.fake.Content
+    self.Commands = self.fake.Commands
+
+  def tearDown(self):
+    self.fake.Cleanup()
+
+  def Kvm(self, vmid, config):
+    base = params.PveRequired()
+    base['vmid'] = vmid
+    base['config'] = config
+    return parsers.PveConfig(base).Ansible()
+
+  def test_new_disks_allocated_single_rescan(self):
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G\nscsi1: local-lvm:vm-100-disk-1,size=8G')
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertFalse(results[0]['failed'])
+    self.assertTrue(results[0]['changed'])
+    self.assertListEqual(results[0]['allocated'], ['local-lvm:vm-100-disk-0', 'local-lvm:vm-100-disk-1'])
+    self.assertListEqual(self.Commands(), [
+        'pvesh get /nodes/pm1/storage/local-lvm/content --output-format json',
+        'pvesm alloc local-lvm 100 vm-100-disk-0 4G',
+        'pvesm alloc local-lvm 100 vm-100-disk-1 8G',
+        'qm rescan --vmid 100',
+    ])
+
+  def test_rescans_avoided_counted(self):
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G\nscsi1: local-lvm:vm-100-disk-1,size=8G\nscsi2: local-lvm:vm-100-disk-2,size=8G')
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertEqual(results[0]['rescans_avoided'], 2)
+    self.assertEqual(len([x for x in self.Commands() if x.startswith('qm rescan')]), 1)
+
+  def test_rescans_avoided_nothing_allocated(self):
+    self.Content(['local-lvm:vm-100-disk-0', 'local-lvm:vm-100-disk-1'])
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G\nscsi1: local-lvm:vm-100-disk-1,size=8G')
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertEqual(results[0]['rescans_avoided'], 2)
+
+  def test_existing_disk_resized_no_rescan(self):
+    self.Content(['local-lvm:vm-100-disk-0'])
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G')
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertTrue(results[0]['resized'])
+    self.assertListEqual(results[0]['allocated'], [])
+    self.assertNotIn('qm rescan --vmid 100', self.Commands())
+    self.assertIn('qm resize 100 scsi0 4G', self.Commands())
+
+  def WriteCurrent(self, vm):
+    '''Write the VM canonical config so the config write is unchanged.'''
+    node.WriteConfig(node.ConfigPath(vm, self.config_dir), vm['config_list_canonical'])
+
+  def test_allocated_changed_with_current_config(self):
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G')
+    self.WriteCurrent(vm)
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertListEqual(results[0]['allocated'], ['local-lvm:vm-100-disk-0'])
+    self.assertTrue(results[0]['changed'])
+
+  def test_resized_changed_with_current_config(self):
+    self.Content(['local-lvm:vm-100-disk-0'])
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G')
+    self.WriteCurrent(vm)
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertTrue(results[0]['resized'])
+    self.assertTrue(results[0]['changed'])
+
+  def test_unchanged_with_current_config(self):
+    os.environ['FAKE_QM_RC'] = '255'
+    self.Content(['local-lvm:vm-100-disk-0'])
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G')
+    self.WriteCurrent(vm)
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertFalse(results[0]['failed'])
+    self.assertFalse(results[0]['resized'])
+    self.assertFalse(results[0]['changed'])
+
+  def test_lxc_resized_changed_with_current_config(self):
+    vm = parsers.PveConfig(params.LxcMinimumValid()).Ansible()
+    self.WriteCurrent(vm)
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertTrue(results[0]['resized'])
+    self.assertTrue(results[0]['changed'])
+
+  def test_config_written_canonical(self):
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G\ncores: 2')
+    node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    with open(os.path.join(self.config_dir, 'qemu-server', '100.conf')) as f:
+      self.assertEqual(f.read(), ''.join([f'{x}\n' for x in vm['config_list_canonical']]))
+
+  def test_cloud_init_mounted(self):
+    base = params.KvmCloudInitRequired()
+    base['config'] = 'scsi0: local-lvm:vm-100-disk-0,size=4G'
+    vm = parsers.PveConfig(base).Ansible()
+    node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertEqual(self.Commands()[-1], 'qm set 100 --ide0 local-lvm:cloudinit')
+
+  def test_storage_listed_once_per_node(self):
+    vms = [self.Kvm(x, f'scsi0: local-lvm:vm-{x}-disk-0,size=4G') for x in range(100, 110)]
+    results = node.NodeApply(vms, config_dir=self.config_dir, executor=executor.Executor(node_limit=4)).Apply()
+    self.assertListEqual([x['vmid'] for x in results], list(range(100, 110)))
+    self.assertEqual(len([x for x in self.Commands() if x.startswith('pvesh')]), 1)
+    self.assertEqual(len([x for x in self.Commands() if x.startswith('qm rescan')]), 10)
+
+  def test_vms_applied_concurrently_within_limits(self):
+    os.environ['FAKE_PVE_LATENCY'] = '0.1'
+    runner = executor.Executor(node_limit=4, storage_limit=1)
+    vms = [self.Kvm(x, f'scsi0: local-lvm:vm-{x}-disk-0,size=4G') for x in range(100, 104)]
+    results = node.NodeApply(vms, config_dir=self.config_dir, executor=runner).Apply()
+    self.assertFalse(any([x['failed'] for x in results]))
+    stats = runner.Stats()
+    # listing + 4 allocs (one at a time on local-lvm) + 4 concurrent rescans.
+    self.assertEqual(stats['commands'], 9)
+    self.assertLess(stats['duration'], 9 * 0.1 * 0.9)
+    self.assertGreaterEqual(max([x['commands'][0]['waited'] for x in results]), 0.25)
+
+  def test_command_failure_reported_per_vm(self):
+    os.environ['FAKE_PVESM_RC'] = '1'
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G')
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertTrue(results[0]['failed'])
+    self.assertIn('pvesm alloc', results[0]['msg'])
+    self.assertEqual(results[0]['commands'][-1]['rc'], 1)
+
+  def test_lxc_resize_and_config(self):
+    vm = parsers.PveConfig(params.LxcMinimumValid()).Ansible()
+    results = node.NodeApply([vm], config_dir=self.config_dir).Apply()
+    self.assertFalse(results[0]['failed'])
+    self.assertListEqual(self.Commands(), ['pct resize 100 rootfs 4G'])
+    self.assertTrue(os.path.exists(os.path.join(self.config_dir, 'lxc', '100.conf')))
+
+  def test_multiple_nodes_rejected(self):
+    vm = self.Kvm(100, 'scsi0: local-lvm:vm-100-disk-0,size=4G')
+    other = dict(vm, node='pm2.example.com')
+    self.assertRaises(ValueError, node.NodeApply, [vm, other])
+
+
+class TestWriteConfig(unittest.TestCase):
+
+  def setUp(self):
+    self.fake = fake.FakePve()
+    self.path = os.path.join(self.fake.config_dir, 'qemu-server', '100.conf')
+
+  def tearDown(self):
+    self.fake.Cleanup()
+
+  def test_config_path(self):
+    self.assertEqual(node.ConfigPath({'vmid': 100}), '/etc/pve/qemu-server/100.conf')
+    self.assertEqual(node.ConfigPath({'vmid': 100, 'lxc': {}}, '/tmp/pve'), '/tmp/pve/lxc/100.conf')
+
+  def test_missing_written(self):
+    self.assertTrue(node.WriteConfig(self.path, ['cores: 2', 'memory: 2048']))
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'cores: 2\nmemory: 2048\n')
+
+  def test_unchanged_not_written(self):
+    node.WriteConfig(self.path, ['cores: 2'])
+    mtime = os.stat(self.path).st_mtime_ns
+    os.utime(self.path, ns=(mtime - 10**9, mtime - 10**9))
+    self.assertFalse(node.WriteConfig(self.path, ['cores: 2']))
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime - 10**9)
+
+  def test_changed_written_in_place(self):
+    node.WriteConfig(self.path, ['cores: 2'])
+    inode = os.stat(self.path).st_ino
+    self.assertTrue(node.WriteConfig(self.path, ['cores: 4']))
+    self.assertEqual(os.stat(self.path).st_ino, inode)
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'cores: 4\n')
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -8,6 +8,7 @@
 # * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
 
 from tests import params
+import hashlib
 import parsers
 import unittest
 
@@ -238,6 +239,243 @@ class TestParserConfig(unittest.TestCase):
     )
 
 
+class TestParserFingerprint(unittest.TestCase):
+
+  def setUp(self):
+    self.params = params.KvmMinimumValid()
+    self.params['config'] += '\nboot: order=scsi0\nmemory: 4096'
+
+  def test_fingerprint_ignores_order(self):
+    reordered = params.KvmMinimumValid()
+    reordered['config'] = 'memory: 4096\nboot: order=scsi0\n' + reordered['config']
+    self.assertEqual(parsers.PveConfig(self.params).Fingerprint(),
+                     parsers.PveConfig(reordered).Fingerprint())
+
+  def test_fingerprint_ignores_inferred_keys(self):
+    explicit = params.KvmMinimumValid()
+    explicit['config'] = 'scsi0: local-lvm:vm-100-disk-0,size=4G\nboot: order=scsi0\nmemory: 4096'
+    self.assertEqual(parsers.PveConfig(self.params).Fingerprint(),
+                     parsers.PveConfig(explicit).Fingerprint())
+
+  def test_fingerprint_detects_value_change(self):
+    changed = params.KvmMinimumValid()
+    changed['config'] += '\nboot: order=scsi0\nmemory: 2048'
+    self.assertNotEqual(parsers.PveConfig(self.params).Fingerprint(),
+                        parsers.PveConfig(changed).Fingerprint())
+
+  def test_fingerprint_tag(self):
+    kvm = parsers.PveConfig(self.params)
+    self.assertEqual(kvm.FingerprintTag(), f'fp-{kvm.Fingerprint()}')
+    self.assertEqual(len(kvm.Fingerprint()), 16)
+
+  def test_stamp_adds_tags(self):
+    self.params['fingerprint'] = True
+    kvm = parsers.PveConfig(self.params)
+    self.assertEqual(kvm.ConfigList()[-1], f'tags: {kvm.FingerprintTag()}')
+
+  def test_stamp_merges_existing_tags(self):
+    self.params['config'] += '\ntags: web;fp-0000000000000000'
+    self.params['fingerprint'] = True
+    kvm = parsers.PveConfig(self.params)
+    self.assertIn(f'tags: web;{kvm.FingerprintTag()}', kvm.ConfigList())
+    self.assertEqual(len(kvm.ConfigList()), 4)
+
+  def test_stamp_keeps_fingerprint(self):
+    stamped = dict(self.params, fingerprint=True)
+    self.assertEqual(parsers.PveConfig(self.params).Fingerprint(),
+                     parsers.PveConfig(stamped).Fingerprint())
+
+  def test_stamped_config_fingerprint_stable(self):
+    stamped = dict(self.params, fingerprint=True)
+    restamped = dict(self.params, config=parsers.PveConfig(stamped).ConfigText())
+    self.assertEqual(parsers.PveConfig(self.params).Fingerprint(),
+                     parsers.PveConfig(restamped).Fingerprint())
+
+
+  def test_fingerprint_covers_inputs(self):
+    fingerprint = parsers.PveConfig(self.params).Fingerprint()
+    for key, value in (('firewall', {'options': {'enable': 1}}), ('cloud_init', 'local-lvm')):
+      self.assertNotEqual(parsers.PveConfig(dict(self.params, **{key: value})).Fingerprint(), fingerprint)
+
+  def test_checksum_ignores_fingerprint_tag(self):
+    stamped = dict(self.params, fingerprint=True)
+    self.assertEqual(parsers.PveConfig(self.params).Checksum(), parsers.PveConfig(stamped).Checksum())
+    self.params['config'] += '\ntags: web'
+    stamped = dict(self.params, fingerprint=True)
+    self.assertEqual(parsers.PveConfig(self.params).Checksum(), parsers.PveConfig(stamped).Checksum())
+
+  def test_checksum_detects_tag_change(self):
+    tagged = dict(self.params, config=self.params['config'] + '\ntags: web', fingerprint=True)
+    self.assertNotEqual(parsers.PveConfig(dict(self.params, fingerprint=True)).Checksum(),
+                        parsers.PveConfig(tagged).Checksum())
+
+class TestParserCanonical(unittest.TestCase):
+
+  def test_canonical_key_order(self):
+    kvm = parsers.PveConfig(dict(params.KvmMinimumValid(), config='memory: 4096\n# vm notes\nboot: order=scsi0\nscsi0: local-lvm:vm-100-disk-0,size=4G'))
+    self.assertEqual(kvm.ConfigText(canonical=True),
+        '# vm notes\nboot: order=scsi0\nmemory: 4096\nscsi0: local-lvm:vm-100-disk-0,size=4G'
+    )
+
+  def test_canonical_lxc_extensions_last(self):
+    lxc = parsers.PveConfig(dict(params.PveRequired(), config='lxc.idmap: g 0 100000 1005\nrootfs: local-lvm:vm-100-disk-0,size=4G\nlxc.idmap: u 0 100000 1005\narch: amd64'))
+    self.assertListEqual(lxc.ConfigList(canonical=True),
+        [
+          'arch: amd64',
+          'rootfs: local-lvm:vm-100-disk-0,size=4G',
+          'lxc.idmap: g 0 100000 1005',
+          'lxc.idmap: u 0 100000 1005',
+        ]
+    )
+
+  def test_canonical_idempotent(self):
+    kvm = parsers.PveConfig(params.KvmMediumValid())
+    rewritten = parsers.PveConfig(dict(params.KvmMediumValid(), config=kvm.ConfigText(canonical=True)))
+    self.assertEqual(kvm.ConfigText(canonical=True), rewritten.ConfigText(canonical=True))
+
+  def test_canonical_description_key(self):
+    kvm = parsers.PveConfig(dict(params.KvmMinimumValid(), config='memory: 4096\ndescription: web: nginx\nscsi0: local-lvm:vm-100-disk-0,size=4G'))
+    self.assertListEqual(kvm.ConfigList(canonical=True),
+        ['#web%3A nginx', 'memory: 4096', 'scsi0: local-lvm:vm-100-disk-0,size=4G'])
+
+  def test_canonical_comments_override_description_key(self):
+    kvm = parsers.PveConfig(dict(params.KvmMinimumValid(), config='description: ignored\n# vm notes\nmemory: 4096'))
+    self.assertListEqual(kvm.ConfigList(canonical=True), ['# vm notes', 'memory: 4096'])
+
+  def test_checksum_description_key_matches_pve_file(self):
+    # PVE writes the description as encoded comment lines ('qm set --tags'
+    # after the config write rewrites the file this way).
+    p = dict(params.KvmMinimumValid(), config='description: hello world\nmemory: 4096\nscsi0: local-lvm:vm-100-disk-0,size=4G')
+    written = '#hello world\nmemory: 4096\nscsi0: local-lvm:vm-100-disk-0,size=4G\n'
+    self.assertEqual(parsers.PveConfig(p).Checksum(), hashlib.sha1(written.encode()).hexdigest())
+    node = parsers.PveConfig(dict(p, config=written))
+    self.assertEqual(node.ConfigText(canonical=True) + '\n', written)
+    self.assertEqual(parsers.PveConfig(p).Checksum(), node.Checksum())
+    self.assertListEqual(parsers.PveConfig(p).DiskGrowth(written), [])
+
+  def test_default_order_unchanged(self):
+    self.params = params.KvmMinimumValid()
+    self.params['config'] += '\nmemory: 4096\nboot: order=scsi0'
+    self.assertEqual(parsers.PveConfig(self.params).ConfigText(), self.params['config'])
+
+  def test_checksum_ignore(self):
+    self.assertListEqual(parsers.PveConfig(params.KvmMediumValid()).ChecksumIgnore(), ['meta', 'ide0'])
+    self.assertListEqual(parsers.PveConfig(params.LxcMinimumValid()).ChecksumIgnore(), [])
+
+  def test_checksum_matches_file(self):
+    kvm = parsers.PveConfig(params.KvmMediumValid())
+    lines = kvm.ConfigList(canonical=True)
+    self.assertEqual(kvm.Checksum(), hashlib.sha1(''.join([f'{x}\n' for x in lines]).encode()).hexdigest())
+
+  def test_checksum_ignores_order(self):
+    reordered = params.KvmMediumValid()
+    reordered['config'] = '\n'.join(reversed(reordered['config'].split('\n')))
+    self.assertEqual(parsers.PveConfig(params.KvmMediumValid()).Checksum(),
+                     parsers.PveConfig(reordered).Checksum())
+
+
+class TestParserStartup(unittest.TestCase):
+
+  def setUp(self):
+    self.params = params.KvmMinimumValid()
+
+  def test_startup_unset(self):
+    self.assertDictEqual(parsers.PveConfig(self.params).Startup(),
+        {'order': None, 'up': None, 'down': None})
+
+  def test_startup_all_values(self):
+    self.params['config'] += '\nstartup: order=2,up=30,down=10'
+    self.assertDictEqual(parsers.PveConfig(self.params).Startup(),
+        {'order': 2, 'up': 30, 'down': 10})
+
+  def test_startup_inferred_order(self):
+    self.params['config'] += '\nstartup: 3'
+    self.assertDictEqual(parsers.PveConfig(self.params).Startup(),
+        {'order': 3, 'up': None, 'down': None})
+
+  def test_startup_up_only(self):
+    self.params['config'] += '\nstartup: up=5'
+    config = parsers.PveConfig(self.params)
+    self.assertDictEqual(config.Startup(), {'order': None, 'up': 5, 'down': None})
+    self.assertIn('startup: up=5', config.ConfigList(canonical=True))
+
+  def test_startup_down_only(self):
+    self.params['config'] += '\nstartup: down=10'
+    self.assertDictEqual(parsers.PveConfig(self.params).Startup(),
+        {'order': None, 'up': None, 'down': 10})
+
+  def test_startup_order_last(self):
+    self.params['config'] += '\nstartup: up=5,down=3,order=2'
+    config = parsers.PveConfig(self.params)
+    self.assertDictEqual(config.Startup(), {'order': 2, 'up': 5, 'down': 3})
+    self.assertIn('startup: up=5,down=3,order=2', config.ConfigList(canonical=True))
+
+  def test_startup_in_ansible(self):
+    self.params['config'] += '\nstartup: order=1,up=5'
+    self.assertDictEqual(parsers.PveConfig(self.params).Ansible()['startup'],
+        {'order': 1, 'up': 5, 'down': None})
+    vm = params.KvmMinimumValid()
+    vm['config'] += '\nstartup: up=5'
+    self.assertDictEqual(parsers.PveConfig(vm).Ansible()['startup'],
+        {'order': None, 'up': 5, 'down': None})
+
+
+class TestParserDiskGrowth(unittest.TestCase):
+
+  def Config(self, p, config):
+    p['config'] = config
+    return parsers.PveConfig(p)
+
+  def test_bytes(self):
+    self.assertEqual(parsers.Bytes('4G'), 4 * 1024**3)
+    self.assertEqual(parsers.Bytes('512M'), 512 * 1024**2)
+    self.assertEqual(parsers.Bytes('1024'), 1024)
+    self.assertRaises(ValueError, parsers.Bytes, 'big')
+
+  def test_kvm_grow(self):
+    kvm = self.Config(params.KvmMinimumValid(), 'scsi0: local-lvm:vm-100-disk-0,size=8G,ssd=1\nscsi1: local-lvm:vm-100-disk-1,size=1T\ncores: 2')
+    current = 'cores: 2\nscsi0: file=local-lvm:vm-100-disk-0,ssd=1,size=4096M\nscsi1: local-lvm:vm-100-disk-1,size=1T\n\n[snap]\ncores: 1\n'
+    self.assertListEqual(kvm.DiskGrowth(current), [{'disk': 'scsi0', 'size': '8G', 'current': '4096M'}])
+
+  def test_lxc_grow_rootfs_and_mountpoint(self):
+    lxc = self.Config(params.LxcMinimumValid(), 'rootfs: local-lvm:vm-100-disk-0,size=8G\nmp0: local-lvm:vm-100-disk-1,mp=/data,size=2T')
+    current = 'mp0: local-lvm:vm-100-disk-1,mp=/data,size=1T\nrootfs: local-lvm:vm-100-disk-0,size=4G'
+    self.assertListEqual(lxc.DiskGrowth(current), [
+      {'disk': 'mp0', 'size': '2T', 'current': '1T'},
+      {'disk': 'rootfs', 'size': '8G', 'current': '4G'},
+    ])
+
+  def test_fingerprint_only(self):
+    p = params.KvmMinimumValid()
+    current = parsers.PveConfig(dict(p, fingerprint=True)).ConfigText(canonical=True)
+    p['config'] += '\ntags: web'
+    self.assertIsNone(parsers.PveConfig(dict(p, fingerprint=True)).DiskGrowth(current))
+    p['config'] = params.KvmMinimumValid()['config']
+    self.assertListEqual(parsers.PveConfig(p).DiskGrowth(current), [])
+
+  def test_offline_changes(self):
+    kvm = self.Config(params.KvmMinimumValid(), 'scsi0: local-lvm:vm-100-disk-0,size=8G\ncores: 4')
+    for current in (
+        'scsi0: local-lvm:vm-100-disk-0,size=4G\ncores: 2',        # other option changed
+        'scsi0: local-lvm:vm-100-disk-0,size=16G\ncores: 4',       # shrink
+        'scsi0: local-lvm:vm-100-disk-0,size=8G,ssd=1\ncores: 4',  # disk option changed
+        'scsi0: local-lvm:vm-100-disk-0\ncores: 4',                # no size
+        'scsi0: local-lvm:vm-100-disk-0,size=4G',                  # option added
+        '# web\nscsi0: local-lvm:vm-100-disk-0,size=4G\ncores: 4'): # description
+      self.assertIsNone(kvm.DiskGrowth(current), current)
+
+  def test_lxc_extension_changes(self):
+    lxc = self.Config(params.LxcMinimumValid(), 'rootfs: local-lvm:vm-100-disk-0,size=8G\nlxc.idmap: u 0 100000 1005\nlxc.idmap: g 0 100000 1005')
+    self.assertIsNone(lxc.DiskGrowth('rootfs: local-lvm:vm-100-disk-0,size=4G\nlxc.idmap: u 0 100000 1005\nlxc.idmap: g 0 100000 1006'))
+    self.assertListEqual(lxc.DiskGrowth('rootfs: local-lvm:vm-100-disk-0,size=4G\nlxc.idmap: u 0 100000 1005\nlxc.idmap: g 0 100000 1005'),
+                         [{'disk': 'rootfs', 'size': '8G', 'current': '4G'}])
+
+  def test_ignored_keys(self):
+    kvm = self.Config(params.KvmMinimumValid(), 'scsi0: local-lvm:vm-100-disk-0,size=8G')
+    self.assertListEqual(kvm.DiskGrowth('meta: creation-qemu=7.1.0,ctime=1\nscsi0: local-lvm:vm-100-disk-0,size=4G'),
+                         [{'disk': 'scsi0', 'size': '8G', 'current': '4G'}])
+
+
 class TestLxcParserConfig(unittest.TestCase):
 
   def test_lxc_init_cmd(self):
@@ -390,5 +628,167 @@ class TestLxcParserConfig(unittest.TestCase):
         }
     )
 
+class TestParserLxcIdmap(unittest.TestCase):
+
+  def test_valid(self):
+    self.assertDictEqual(parsers.PveConfig(params.LxcIdmapValid()).Idmap(), {'gaps': []})
+
+  def test_no_idmap(self):
+    self.assertListEqual(parsers.LxcIdmap([]).Gaps(), [])
+
+  def test_container_overlap(self):
+    idmap = parsers.LxcIdmap(['u 0 100000 1006', 'u 1005 1005 1', 'u 1006 101006 64530'])
+    self.assertListEqual(idmap.Overlaps(), [
+        {'ctype': 'u', 'space': 'container', 'mappings': ['u 0 100000 1006', 'u 1005 1005 1']},
+    ])
+
+  def test_host_overlap(self):
+    idmap = parsers.LxcIdmap(['g 0 100000 1005', 'g 1005 100000 1'])
+    self.assertListEqual(idmap.Overlaps(), [
+        {'ctype': 'g', 'space': 'host', 'mappings': ['g 1005 100000 1', 'g 0 100000 1005']},
+    ])
+
+  def test_overlap_raises(self):
+    config = dict(params.PveRequired(), config='rootfs: local-lvm:vm-100-disk-0,size=4G\nlxc.idmap: u 0 100000 2000\nlxc.idmap: u 1005 1005 1')
+    self.assertRaises(ValueError, parsers.PveConfig(config).Idmap)
+
+  def test_gaps(self):
+    idmap = parsers.LxcIdmap([
+        {'ctype': 'u', 'cid': '0', 'hid': '100000', 'crange': '1005'},
+        {'ctype': 'u', 'cid': '1006', 'hid': '101006', 'crange': '64530'},
+    ])
+    self.assertListEqual(idmap.Gaps(), [
+        {'ctype': 'u', 'start': 1005, 'end': 1005},
+        {'ctype': 'g', 'start': 0, 'end': 65535},
+    ])
+
+  def test_malformed(self):
+    self.assertRaises(ValueError, parsers.LxcIdmap, ['u 0 100000'])
+    self.assertRaises(ValueError, parsers.LxcIdmap, ['x 0 100000 10'])
+    self.assertRaises(ValueError, parsers.LxcIdmap, ['u 0 100000 0'])
+
+  def test_generate(self):
+    self.assertListEqual(parsers.LxcIdmap.Generate([1005]), [
+        'u 0 100000 1005',
+        'u 1005 1005 1',
+        'u 1006 101006 64530',
+        'g 0 100000 1005',
+        'g 1005 1005 1',
+        'g 1006 101006 64530',
+    ])
+
+  def test_generate_merges_runs_and_edges(self):
+    self.assertListEqual(parsers.LxcIdmap.Generate({'u': [0, 65535, 1001, 1000, 1000]}), [
+        'u 0 0 1',
+        'u 1 100001 999',
+        'u 1000 1000 2',
+        'u 1002 101002 64533',
+        'u 65535 65535 1',
+        'g 0 100000 65536',
+    ])
+
+  def test_generate_out_of_range(self):
+    self.assertRaises(ValueError, parsers.LxcIdmap.Generate, [65536])
+
+  def test_generate_many_complete(self):
+    ids = list(range(1000, 60000, 97))
+    idmap = parsers.LxcIdmap(parsers.LxcIdmap.Generate(ids))
+    self.assertEqual(len(idmap.maps['u']), 2 * len(ids) + 1)
+    self.assertListEqual(idmap.Overlaps(), [])
+    self.assertListEqual(idmap.Gaps(), [])
+
+  def test_passthrough_config(self):
+    config = dict(params.PveRequired(), idmap_passthrough=[1005, 1006],
+                  config='rootfs: local-lvm:vm-100-disk-0,size=4G')
+    lxc = parsers.PveConfig(config).Lxc()
+    self.assertIn('u 1005 1005 2', lxc['lxc.idmap'])
+    self.assertListEqual(lxc['meta']['subuid'], ['root:1005:2'])
+    self.assertListEqual(lxc['meta']['subgid'], ['root:1005:2'])
+
+  def test_passthrough_with_idmap_config(self):
+    self.assertRaises(ValueError, parsers.PveConfig, dict(params.LxcIdmapValid(), idmap_passthrough=[1005]))
+
+
+class TestParserFirewall(unittest.TestCase):
+
+  def setUp(self):
+    self.text = (
+      '# description\n'
+      '[OPTIONS]\n\n'
+      'enable: 1\n'
+      'log_ratelimit: enable=1,burst=5,rate=1/second\n\n'
+      '[ALIASES]\n\n'
+      'Gateway 10.0.0.1 # router\n\n'
+      '[IPSET trusted] # trusted hosts\n\n'
+      '10.0.0.1/32 # gateway\n'
+      '!10.0.0.9\n'
+      'fd00:0:0::1\n\n'
+      '[RULES]\n\n'
+      'IN ACCEPT -p TCP -dport 22 -log nolog # ssh\n'
+      '|OUT Ping(accept) -dest +trusted\n'
+      'GROUP pve -i vmbr0\n\n'
+      '[group PVE] # hypervisor\n\n'
+      'IN ACCEPT -p tcp -dport 8006\n'
+    )
+
+  def test_sections(self):
+    fw = parsers.PveFirewallConfig(self.text)
+    self.assertDictEqual(fw.options, {'enable': '1', 'log_ratelimit': 'burst=5,enable=1,rate=1/second'})
+    self.assertDictEqual(fw.aliases, {'gateway': {'ip': '10.0.0.1', 'comment': 'router'}})
+    self.assertDictEqual(fw.ipsets, {'trusted': {'comment': 'trusted hosts', 'hosts': [
+        {'ip': '10.0.0.1', 'comment': 'gateway'},
+        {'ip': '!10.0.0.9', 'comment': ''},
+        {'ip': 'fd00::1', 'comment': ''},
+    ]}})
+    self.assertListEqual(list(fw.groups), ['pve'])
+    self.assertEqual(fw.groups['pve']['comment'], 'hypervisor')
+
+  def test_rules(self):
+    fw = parsers.PveFirewallConfig(self.text)
+    self.assertListEqual(fw.rules, [
+        {'enable': True, 'direction': 'IN', 'action': 'ACCEPT', 'proto': 'tcp', 'dport': '22', 'log': 'nolog', 'comment': 'ssh'},
+        {'enable': False, 'direction': 'OUT', 'macro': 'Ping', 'action': 'ACCEPT', 'dest': '+trusted'},
+        {'enable': True, 'direction': 'GROUP', 'action': 'pve', 'iface': 'vmbr0'},
+    ])
+
+  def test_malformed_rule(self):
+    self.assertRaises(ValueError, parsers.PveFirewallConfig, '[RULES]\nIN ACCEPT -p\n')
+
+  def test_unknown_section(self):
+    self.assertRaises(ValueError, parsers.PveFirewallConfig, '[BOGUS]\n')
+
+  def test_equal_ignores_formatting_and_set_order(self):
+    other = (
+      '[OPTIONS]\nlog_ratelimit: burst=5, rate=1/second, enable=1\nenable: 1\n'
+      '[rules]\nIN   ACCEPT -dport 22 -log nolog -p tcp   # ssh\n'
+      '|OUT Ping(ACCEPT) -dest +trusted\nGROUP pve -i vmbr0\n'
+      '[ipset TRUSTED] # trusted hosts\nfd00::1\n!10.0.0.9\n10.0.0.1 # gateway\n'
+      '[aliases]\ngateway 10.0.0.1/32 # router\n'
+      '[GROUP pve] # hypervisor\nIN ACCEPT -dport 8006 -p tcp\n'
+    )
+    self.assertEqual(parsers.PveFirewallConfig(self.text), parsers.PveFirewallConfig(other))
+
+  def test_diff_sections(self):
+    other = self.text.replace('-dport 8006', '-dport 8007').replace('!10.0.0.9', '10.0.0.9')
+    self.assertListEqual(parsers.PveFirewallConfig(self.text).Diff(parsers.PveFirewallConfig(other)),
+        ['group pve', 'ipset trusted'])
+
+  def test_rule_order_significant(self):
+    a = '[RULES]\nIN ACCEPT -p tcp\nIN DROP -p udp\n'
+    b = '[RULES]\nIN DROP -p udp\nIN ACCEPT -p tcp\n'
+    self.assertListEqual(parsers.PveFirewallConfig(a).Diff(parsers.PveFirewallConfig(b)), ['rules'])
+
+  def test_duplicate_ipset_entries_significant(self):
+    a = '[IPSET x]\n10.0.0.1\n'
+    b = '[IPSET x]\n10.0.0.1\n10.0.0.1\n'
+    self.assertNotEqual(parsers.PveFirewallConfig(a), parsers.PveFirewallConfig(b))
+
+  def test_large_firewall(self):
+    hosts = '\n'.join([f'10.{x // 65536}.{x // 256 % 256}.{x % 256}' for x in range(50000)])
+    a = parsers.PveFirewallConfig(f'[IPSET big]\n{hosts}\n')
+    b = parsers.PveFirewallConfig(f'[IPSET big]\n' + '\n'.join(reversed(hosts.split('\n'))) + '\n')
+    self.assertEqual(a, b)
+
+
 if __name__ == '__main__':
   unittest.main()
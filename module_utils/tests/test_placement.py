@@ -0,0 +1,163 @@
+#!/usr/bin/python
+#
+# Test capacity-aware VM placement. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import contextlib
+import io
+import json
+import os
+import placement
+import tempfile
+import time
+import unittest
+
+GB = 1024**3
+
+
+def Node(name, memory, cpus, status='online'):
+  return {'type': 'node', 'node': name, 'status': status, 'maxmem': memory * GB, 'maxcpu': cpus}
+
+
+def Storage(node, storage, free, shared=0):
+  return {'type': 'storage', 'node': node, 'storage': storage, 'shared': shared, 'status': 'available',
+          'maxdisk': free * GB + GB, 'disk': GB}
+
+
+def Resources():
+  return [
+    Node('pm1', 16, 8),
+    Node('pm2', 16, 8),
+    Node('pm3', 64, 32, status='offline'),
+    Storage('pm1', 'local-lvm', 100),
+    Storage('pm2', 'local-lvm', 10),
+    Storage('pm1', 'ceph', 1000, shared=1),
+    Storage('pm2', 'ceph', 1000, shared=1),
+    {'type': 'qemu', 'vmid': 900, 'node': 'pm1', 'status': 'running', 'maxmem': 4 * GB, 'maxcpu': 2, 'tags': 'aa-db'},
+  ]
+
+
+def Vm(vmid, memory=1024, cores=1, disk='ceph:8', node=None, extra=''):
+  storage, size = disk.split(':')
+  vm = {'vmid': vmid, 'config': f'memory: {memory}\ncores: {cores}\nscsi0: {storage}:vm-{vmid}-disk-0,size={size}G{extra}'}
+  if node:
+    vm['node'] = node
+  return vm
+
+
+class TestDemand(unittest.TestCase):
+
+  def test_kvm(self):
+    vm = {'vmid': 100, 'node': 'pm1.example.com', 'config': (
+        'memory: 4096\nballoon: 1024\ncores: 2\nsockets: 2\ntags: aa-web\n'
+        'scsi0: local-lvm:vm-100-disk-0,size=8G\nscsi1: ceph:vm-100-disk-1,size=1T\n'
+        'ide2: local:iso/debian.iso,media=cdrom')}
+    self.assertDictEqual(placement.Demand(vm), {
+      'vmid': 100, 'node': 'pm1', 'memory': 1024, 'cpus': 4,
+      'storage': {'local-lvm': 8 * GB, 'ceph': 1024 * GB}, 'tags': ['aa-web']})
+    self.assertEqual(placement.Demand(vm, balloon=False)['memory'], 4096)
+
+  def test_lxc(self):
+    vm = {'vmid': 101, 'config': (
+        'rootfs: local-lvm:vm-101-disk-0,size=4G\nmp0: /dev/nvidia0,mp=/dev/nvidia0\n'
+        'mp1: local-lvm:vm-101-disk-1,mp=/data,size=512M\ntags: aa-gpu;media')}
+    self.assertDictEqual(placement.Demand(vm), {
+      'vmid': 101, 'node': '', 'memory': placement.DEFAULT_MEMORY, 'cpus': 1,
+      'storage': {'local-lvm': 4 * GB + GB // 2}, 'tags': ['aa-gpu', 'media']})
+
+
+class TestPlan(unittest.TestCase):
+
+  def test_pinned_and_existing(self):
+    resources = Resources() + [{'type': 'lxc', 'vmid': 101, 'node': 'pm2', 'maxmem': GB, 'maxcpu': 1}]
+    vms = [Vm(100, memory=12288, node='pm2.example.com'), Vm(101), Vm(102, memory=4096)]
+    plan = placement.Plan(vms, resources)
+    self.assertDictEqual(plan['placement'], {101: 'pm2', 102: 'pm1'})
+    self.assertDictEqual(plan['nodes']['pm2'], {'memory': 13312, 'memory_total': 16384, 'cpus': 2, 'cpus_total': 8, 'vms': 2})
+    self.assertDictEqual(plan['stats'], dict(plan['stats'], vms=3, pinned=1, placed=2, unplaced=0))
+    # Pinned VMs are not placed; rebalanced existing VMs are (best fit fills pm2).
+    self.assertDictEqual(placement.Plan(vms, resources, rebalance=True)['placement'], {101: 'pm1', 102: 'pm2'})
+
+  def test_strategy(self):
+    vms = [Vm(100 + x) for x in range(4)]
+    self.assertListEqual(list(placement.Plan(vms, Resources())['placement'].values()), ['pm1'] * 4)
+    self.assertListEqual(list(placement.Plan(vms, Resources(), strategy='spread')['placement'].values()),
+                         ['pm2', 'pm2', 'pm1', 'pm2'])
+    self.assertRaises(ValueError, placement.Plan, vms, Resources(), strategy='random')
+
+  def test_largest_first(self):
+    vms = [Vm(100, memory=8192), Vm(101, memory=12288), Vm(102, memory=8192)]
+    plan = placement.Plan(vms, Resources())
+    self.assertDictEqual(plan['placement'], {100: 'pm2', 101: 'pm1', 102: 'pm2'})
+
+  def test_anti_affinity(self):
+    vms = [Vm(100, extra='\ntags: aa-db'), Vm(101, extra='\ntags: aa-web;x'), Vm(102, extra='\ntags: aa-web')]
+    self.assertDictEqual(placement.Plan(vms, Resources())['placement'], {100: 'pm2', 101: 'pm1', 102: 'pm2'})
+    plan = placement.Plan(vms + [Vm(103, extra='\ntags: aa-web')], Resources())
+    self.assertListEqual([x['vmid'] for x in plan['unplaced']], [103])
+    self.assertEqual(len(placement.Plan(vms, Resources(), anti_affinity_prefix='none-')['unplaced']), 0)
+
+  def test_storage(self):
+    vms = [Vm(100, disk='local-lvm:8'), Vm(101, disk='local-lvm:8', memory=8192), Vm(102, disk='nfs:8')]
+    plan = placement.Plan(vms, Resources(), strategy='spread')
+    # pm2 local-lvm has room for one 8G disk.
+    self.assertDictEqual(plan['placement'], {100: 'pm1', 101: 'pm2'})
+    self.assertListEqual([x['vmid'] for x in plan['unplaced']], [102])
+
+  def test_capacity(self):
+    plan = placement.Plan([Vm(100, memory=8192, cores=4), Vm(101, memory=4096, cores=8)], Resources(),
+                          reserved_memory=4096, cpu_ratio=1.5)
+    self.assertDictEqual(plan['placement'], {100: 'pm1', 101: 'pm2'})
+    self.assertEqual(plan['nodes']['pm1']['memory_total'], 12288)
+    self.assertDictEqual(placement.Plan([Vm(100, cores=9)], Resources())['unplaced'][0]['storage'], {'ceph': 8 * GB})
+
+  def test_nodes(self):
+    plan = placement.Plan([Vm(100), Vm(101)], Resources(), nodes=['pm2.example.com', 'pm3.example.com'])
+    self.assertDictEqual(plan['placement'], {100: 'pm2.example.com', 101: 'pm2.example.com'})
+    self.assertNotIn('pm3', plan['nodes'])
+
+  def test_overcommitted(self):
+    plan = placement.Plan([Vm(100, memory=16384, node='pm1')], Resources())
+    self.assertListEqual(plan['overcommitted'], ['pm1'])
+
+  def test_errors(self):
+    self.assertRaisesRegex(ValueError, 'duplicate', placement.Plan, [Vm(100), Vm(100)], Resources())
+    self.assertRaisesRegex(ValueError, 'VM 100', placement.Plan, [{'vmid': 100, 'config': 'memory: lots'}], Resources())
+
+  def test_fleet_under_a_second(self):
+    vms, resources = placement.Synthetic(5000, 50)
+    started = time.perf_counter()
+    plan = placement.Plan(vms, resources, cpu_ratio=4.0)
+    self.assertLess(time.perf_counter() - started, 1.0)
+    self.assertEqual(plan['stats']['placed'], 5000)
+    self.assertListEqual(plan['overcommitted'], [])
+
+
+class TestMain(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.inventory = os.path.join(self.tmp.name, 'inventory.json')
+    self.resources = os.path.join(self.tmp.name, 'resources.json')
+    hostvars = {'a.example.com': {'pve_kvm': Vm(100)}, 'b.example.com': {'pve_lxc': Vm(101, node='pm2')}}
+    with open(self.inventory, 'w') as f:
+      json.dump({'_meta': {'hostvars': hostvars}}, f)
+    with open(self.resources, 'w') as f:
+      json.dump(Resources(), f)
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_plan(self):
+    out = io.StringIO()
+    with contextlib.redirect_stdout(out):
+      placement.main(['plan', '--inventory', self.inventory, '--resources', self.resources, '--node', 'pm1.example.com'])
+    self.assertDictEqual(json.loads(out.getvalue())['placement'], {'100': 'pm1.example.com'})
+
+
+if __name__ == '__main__':
+  unittest.main()
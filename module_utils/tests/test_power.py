@@ -0,0 +1,102 @@
+#!/usr/bin/python
+#
+# Test startup order power scheduling. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import fake
+from tests import params
+import os
+import parsers
+import power
+import time
+import unittest
+
+
+class TestPowerSchedule(unittest.TestCase):
+
+  def setUp(self):
+    self.fake = fake.FakePve()
+    self.sleeps = []
+
+  def tearDown(self):
+    self.fake.Cleanup()
+
+  def Vm(self, vmid, startup=None, node='pm1.example.com'):
+    base = params.KvmMinimumValid()
+    base['vmid'] = vmid
+    base['node'] = node
+    if startup:
+      base['config'] += f'\nstartup: {startup}'
+    return parsers.PveConfig(base).Ansible()
+
+  def Schedule(self, vms, **kwargs):
+    return power.PowerSchedule(vms, sleep=self.sleeps.append, **kwargs)
+
+  def test_waves_grouped_by_order(self):
+    vms = [self.Vm(100), self.Vm(101, 'order=2'), self.Vm(102, 'order=1'), self.Vm(103, 'order=2')]
+    self.assertListEqual([[x['vmid'] for x in wave] for wave in power.PowerSchedule.Waves(vms)],
+        [[102], [101, 103], [100]])
+
+  def test_waves_reversed_for_shutdown(self):
+    vms = [self.Vm(100), self.Vm(101, 'order=2'), self.Vm(102, 'order=1')]
+    self.assertListEqual([[x['vmid'] for x in wave] for wave in power.PowerSchedule.Waves(vms, reverse=True)],
+        [[100], [101], [102]])
+
+  def test_start_commands(self):
+    result = self.Schedule([self.Vm(100)], start_timeout=60).Start()
+    self.assertFalse(result['failed'])
+    self.assertListEqual(self.fake.Commands(),
+        ['pvesh create /nodes/pm1/qemu/100/status/start --timeout 60'])
+
+  def test_start_lxc_no_timeout(self):
+    vm = parsers.PveConfig(params.LxcMinimumValid()).Ansible()
+    self.Schedule([vm]).Start()
+    self.assertListEqual(self.fake.Commands(), ['pvesh create /nodes/pm1/lxc/100/status/start'])
+
+  def test_start_up_delay_between_waves(self):
+    vms = [self.Vm(100, 'order=1,up=30'), self.Vm(101, 'order=1,up=10'), self.Vm(102, 'order=2,up=99')]
+    result = self.Schedule(vms).Start()
+    self.assertListEqual(result['waves'], [[100, 101], [102]])
+    self.assertListEqual(self.sleeps, [30])
+
+  def test_shutdown_down_timeout(self):
+    vms = [self.Vm(100, 'order=1,down=15'), self.Vm(101, 'order=2')]
+    self.Schedule(vms, shutdown_timeout=120).Shutdown()
+    self.assertListEqual(self.fake.Commands(), [
+        'pvesh create /nodes/pm1/qemu/101/status/shutdown --timeout 120',
+        'pvesh create /nodes/pm1/qemu/100/status/shutdown --timeout 15',
+    ])
+    self.assertListEqual(self.sleeps, [])
+
+  def test_shutdown_force_stop(self):
+    os.environ['FAKE_PVESH_RC'] = '1'
+    vm = self.Vm(100)
+    vm['force_stop'] = True
+    result = self.Schedule([vm], shutdown_timeout=5).Shutdown()
+    self.assertListEqual(self.fake.Commands()[-1:],
+        ['pvesh create /nodes/pm1/qemu/100/status/shutdown --timeout 5 --forceStop 1'])
+    self.assertTrue(result['failed'])
+
+  def test_failed_wave_skips_remaining_waves(self):
+    os.environ['FAKE_PVESH_RC'] = '1'
+    result = self.Schedule([self.Vm(100, 'order=1'), self.Vm(101, 'order=2')]).Start()
+    self.assertTrue(result['failed'])
+    self.assertListEqual([x['vmid'] for x in result['vm_results']], [100])
+    self.assertIn('failed (1)', result['vm_results'][0]['msg'])
+
+  def test_wave_runs_concurrently(self):
+    os.environ['FAKE_PVE_LATENCY'] = '0.2'
+    vms = [self.Vm(x, 'order=1') for x in range(100, 108)] + [self.Vm(x, 'order=2') for x in range(108, 116)]
+    start = time.monotonic()
+    self.Schedule(vms, max_workers=8).Start()
+    # Serial execution would take 16 * 0.2 seconds.
+    self.assertLess(time.monotonic() - start, 1.6)
+    self.assertEqual(len(self.fake.Commands()), 16)
+
+
+if __name__ == '__main__':
+  unittest.main()
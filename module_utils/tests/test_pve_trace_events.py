@@ -0,0 +1,96 @@
+#!/usr/bin/python
+#
+# Test trace-event timeline. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import json
+import os
+import tempfile
+import pve_trace_events
+import unittest
+
+
+class TestTrace(unittest.TestCase):
+
+  def setUp(self):
+    self.trace = pve_trace_events.Trace()
+    main = ('main', 'kvm/main.yml')
+    provision = ('i1', 'kvm/provision.yml')
+    config = ('i2', 'kvm/config.yml')
+    shutdown = ('i3', 'kvm/operations/shutdown.yml')
+    reconfigure = ('i4', 'kvm/reconfigure.yml')
+    resize = ('i5', 'kvm/operations/resize.yml')
+    start = ('i6', 'kvm/operations/start.yml')
+    t = self.trace.Task
+    t('localhost', '', 'localhost', [main], 'provision KVM instances', 0.0, 0.1, 'ok')
+    t('localhost', '100', 'localhost', [main, provision, config], '100 | parse config', 0.1, 0.2, 'ok', 'parse')
+    self.trace.Node('100', 'pm1.example.com')
+    t('localhost', '100', 'pm1.example.com', [main, provision], '100 | check', 0.2, 0.3, 'ok', 'config_check')
+    t('localhost', '100', 'pm1.example.com', [main, provision, shutdown], '100 | shutdown', 0.3, 5.3, 'changed', 'shutdown')
+    t('localhost', '100', 'pm1.example.com', [main, provision, reconfigure], '100 | apply', 5.3, 5.4, 'changed', 'config_write')
+    t('localhost', '100', 'pm1.example.com', [main, provision, reconfigure, resize], '100 | resize', 5.4, 5.5, 'changed', 'disk_resize')
+    t('localhost', '100', 'pm1.example.com', [main, provision, reconfigure], '100 | mount', 5.5, 5.6, 'ok', 'config_write')
+    t('localhost', '100', 'pm1.example.com', [main, provision], '100 | queue', 5.6, 5.7, 'skipped', 'config_check')
+    t('localhost', '101', 'pm2', [main, ('i7', 'kvm/provision.yml'), start], '101 | start', 1.0, 2.0, 'changed', 'start')
+
+  def Spans(self):
+    return {(x['name'], x['ts']): x for x in self.trace.Events() if x['ph'] == 'X' and x['cat'] == 'task_file'}
+
+  def test_tracks_per_node(self):
+    events = self.trace.Events()
+    processes = {x['pid']: x['args']['name'] for x in events if x['name'] == 'process_name'}
+    self.assertListEqual(sorted(processes.values()), ['localhost', 'pm1', 'pm2'])
+    threads = sorted([(processes[x['pid']], x['args']['name']) for x in events if x['name'] == 'thread_name'])
+    self.assertListEqual(threads, [('localhost', 'fleet'), ('pm1', '100'), ('pm2', '101')])
+
+  def test_vm_events_on_vm_node(self):
+    events = [x for x in self.trace.Events() if x['name'] == '100 | parse config']
+    pm1 = [x['pid'] for x in self.trace.Events() if x['name'] == 'process_name' and x['args']['name'] == 'pm1']
+    self.assertEqual(events[0]['pid'], pm1[0])
+    self.assertEqual(events[0]['tid'], 100)
+    self.assertEqual(events[0]['args']['ran_on'], 'localhost')
+
+  def test_task_file_spans_nest(self):
+    spans = self.Spans()
+    self.assertDictEqual({x: y['dur'] for x, y in spans.items()}, {
+      ('kvm/main.yml', 0): 100000,
+      ('kvm/main.yml', 100000): 5600000,
+      ('kvm/provision.yml', 100000): 5600000,
+      ('kvm/config.yml', 100000): 100000,
+      ('kvm/operations/shutdown.yml', 300000): 5000000,
+      ('kvm/reconfigure.yml', 5300000): 300000,
+      ('kvm/operations/resize.yml', 5400000): 100000,
+      ('kvm/main.yml', 1000000): 1000000,
+      ('kvm/provision.yml', 1000000): 1000000,
+      ('kvm/operations/start.yml', 1000000): 1000000,
+    })
+
+  def test_task_event(self):
+    event = [x for x in self.trace.Events() if x['name'] == '100 | shutdown'][0]
+    self.assertEqual(event['cat'], 'shutdown')
+    self.assertEqual(event['dur'], 5000000)
+    self.assertDictEqual(event['args'], {'file': 'kvm/operations/shutdown.yml', 'status': 'changed', 'host': 'localhost', 'ran_on': 'pm1'})
+
+  def test_parents_precede_children(self):
+    names = [x['name'] for x in self.trace.Events() if x['ph'] == 'X' and x['ts'] == 300000]
+    self.assertListEqual(names, ['kvm/operations/shutdown.yml', '100 | shutdown'])
+
+  def test_empty(self):
+    self.assertListEqual(pve_trace_events.Trace().Events(), [])
+
+  def test_write(self):
+    with tempfile.TemporaryDirectory() as tmp:
+      path = os.path.join(tmp, 'trace.json')
+      self.trace.Write(path)
+      with open(path) as f:
+        content = json.load(f)
+      self.assertEqual(content['displayTimeUnit'], 'ms')
+      self.assertTrue(all(set(['name', 'ph', 'pid', 'tid']) <= set(x) for x in content['traceEvents']))
+
+
+if __name__ == '__main__':
+  unittest.main()
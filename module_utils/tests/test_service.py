@@ -0,0 +1,78 @@
+#!/usr/bin/python
+#
+# Test PveConfig parse service. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import params
+import os
+import parsers
+import service
+import tempfile
+import threading
+import unittest
+
+
+class TestParseService(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'parse.sock')
+    self.server = service.ParseService(self.path, cache_size=2)
+    self.thread = threading.Thread(target=self.server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    self.thread.start()
+    self.client = service.Client(self.path)
+
+  def tearDown(self):
+    self.client.Close()
+    self.server.shutdown()
+    self.server.server_close()
+    self.tmp.cleanup()
+
+  def test_socket_user_only(self):
+    self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+  def test_parse_matches_pve_config(self):
+    for p in (params.KvmMinimumValid(), params.LxcMinimumValid()):
+      self.assertDictEqual(self.client.Parse(p), parsers.PveConfig(p).Ansible())
+
+  def test_cache_hit(self):
+    self.client.Parse(params.KvmMinimumValid())
+    self.client.Parse(params.KvmMinimumValid())
+    self.assertDictEqual(self.client.Stats(), {'hits': 1, 'misses': 1, 'size': 1})
+
+  def test_cache_evicts_least_recently_used(self):
+    for vmid in (100, 101, 100, 102):
+      p = params.KvmMinimumValid()
+      p['vmid'] = vmid
+      self.client.Parse(p)
+    self.assertDictEqual(self.client.Stats(), {'hits': 1, 'misses': 3, 'size': 2})
+
+  def test_invalid_config_reported(self):
+    p = params.KvmMinimumValid()
+    p['config'] = 'not a config line'
+    self.assertRaises(ValueError, self.client.Parse, p)
+    self.assertDictEqual(self.client.Parse(params.KvmMinimumValid()), parsers.PveConfig(params.KvmMinimumValid()).Ansible())
+
+  def test_unknown_op(self):
+    self.assertRaisesRegex(ValueError, 'unknown op', self.client.Request, {'op': 'missing'})
+
+  def test_concurrent_clients(self):
+    with service.Client(self.path) as other:
+      self.assertEqual(other.Parse(params.LxcMinimumValid())['vmid'], 100)
+    self.assertEqual(self.client.Parse(params.LxcMinimumValid())['vmid'], 100)
+
+
+class TestBenchmark(unittest.TestCase):
+
+  def test_benchmark(self):
+    result = service.Benchmark(service._BenchmarkRequests(2))
+    self.assertEqual(result['requests'], 2)
+    self.assertGreater(result['warm_rps'], result['cold_rps'])
+
+
+if __name__ == '__main__':
+  unittest.main()
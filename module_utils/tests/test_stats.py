@@ -0,0 +1,26 @@
+#!/usr/bin/python
+#
+# Test summary statistics. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+import stats
+import unittest
+
+
+class TestPercentile(unittest.TestCase):
+
+  def test_empty(self):
+    self.assertEqual(stats.Percentile([], 99), 0.0)
+
+  def test_nearest_rank(self):
+    self.assertEqual(stats.Percentile([3, 1, 2, 4], 50), 2)
+    self.assertEqual(stats.Percentile(list(range(1, 101)), 99), 99)
+    self.assertEqual(stats.Percentile([5.0], 99), 5.0)
+
+
+if __name__ == '__main__':
+  unittest.main()
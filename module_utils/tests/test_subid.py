@@ -0,0 +1,77 @@
+#!/usr/bin/python
+#
+# Test subordinate ID merging. Run from 'module_utils' with
+#
+#   python3 -m unittest
+#
+# Reference:
+# * https://docs.ansible.com/ansible/latest/dev_guide/testing_units_modules.html
+
+from tests import params
+import os
+import parsers
+import subid
+import tempfile
+import unittest
+
+
+class TestSubidMerge(unittest.TestCase):
+
+  def test_append_missing(self):
+    self.assertTupleEqual(subid.Merge(['root:100000:65536'], ['root:1005:1']),
+        (['root:100000:65536', 'root:1005:1'], ['root:1005:1']))
+
+  def test_exact_match_only(self):
+    # A prefix match (lineinfile regexp) would replace 'root:1005:10'.
+    lines, added = subid.Merge(['root:1005:10'], ['root:1005:1'])
+    self.assertListEqual(lines, ['root:1005:10', 'root:1005:1'])
+
+  def test_duplicates_merged_once(self):
+    lines, added = subid.Merge(['root:1005:1'], ['root:1005:1', 'root:1006:1', 'root:1006:1 '])
+    self.assertListEqual(added, ['root:1006:1'])
+
+  def test_from_parser(self):
+    lxc = parsers.PveConfig(params.LxcIdmapValid()).Lxc()
+    lines, added = subid.Merge(['root:100000:65536'], lxc['meta']['subuid'])
+    self.assertListEqual(added, ['root:1005:1'])
+
+
+class TestSubidApply(unittest.TestCase):
+
+  def setUp(self):
+    self.tmp = tempfile.TemporaryDirectory()
+    self.path = os.path.join(self.tmp.name, 'subuid')
+
+  def tearDown(self):
+    self.tmp.cleanup()
+
+  def test_create_missing(self):
+    self.assertListEqual(subid.Apply(self.path, ['root:1005:1']), ['root:1005:1'])
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'root:1005:1\n')
+    self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o644)
+
+  def test_merge_preserves_mode(self):
+    with open(self.path, 'w') as f:
+      f.write('root:100000:65536\n')
+    os.chmod(self.path, 0o640)
+    subid.Apply(self.path, ['root:1005:1', 'root:100000:65536'])
+    with open(self.path) as f:
+      self.assertEqual(f.read(), 'root:100000:65536\nroot:1005:1\n')
+    self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o640)
+    self.assertListEqual(os.listdir(self.tmp.name), ['subuid'])
+
+  def test_unchanged_not_written(self):
+    with open(self.path, 'w') as f:
+      f.write('root:1005:1\n')
+    mtime = os.stat(self.path).st_mtime_ns
+    self.assertListEqual(subid.Apply(self.path, ['root:1005:1']), [])
+    self.assertEqual(os.stat(self.path).st_mtime_ns, mtime)
+
+  def test_check_mode(self):
+    self.assertListEqual(subid.Apply(self.path, ['root:1005:1'], check_mode=True), ['root:1005:1'])
+    self.assertFalse(os.path.exists(self.path))
+
+
+if __name__ == '__main__':
+  unittest.main()